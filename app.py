@@ -1,101 +1,44 @@
-from flask import Flask, request, jsonify
-from rag import RAG, answer_question, get_conversation_history, detect_missing_info
+from flask import Flask, request, jsonify, Response
+from rag import (
+    get_shared_rag, answer_question, answer_question_stream, embed_text,
+    embedding_cache, embedding_batcher, RAG_RETRIEVAL_MODE,
+)
 from dotenv import load_dotenv
 import os
-import requests
 import json
-import threading
-import re
+import time
+import atexit
+import logging
+from functools import partial
+from worker_pool import ConversationWorkerPool
+from chatwoot import chatwoot_auth, send_message_to_chatwoot
+from order_state import update_order_state
+from transcript import get_conversation_history, history_cache, record_turn
+from turn_steps import search_scope, turn_contexts, turn_response_cache, sends_early, transcript_messages, replies
+from fast_path import fast_path_stats
+from response_cache import response_cache
+from metrics import registry, span, get_logger, log_event
+from debounce import MessageDebouncer, Turn, TurnSuperseded
 
 load_dotenv()
 
-CHATWOOT_EMAIL = os.getenv("CHATWOOT_EMAIL")
-CHATWOOT_PASSWORD = os.getenv("CHATWOOT_PASSWORD")
-CHATWOOT_BASE_URL = os.getenv("CHATWOOT_BASE_URL")
-TOKEN_FILE = "chatwoot_token.txt"
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "8"))
+WORKER_QUEUE_MAX = int(os.getenv("WORKER_QUEUE_MAX", "500"))
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "30"))
+WORKER_RETRY_AFTER = os.getenv("WORKER_RETRY_AFTER", "5")
 
-app = Flask(__name__)
+# Messages of one conversation arriving within this window are answered as a single turn
+DEBOUNCE_WINDOW_SECONDS = float(os.getenv("DEBOUNCE_WINDOW_SECONDS", "1.5"))
+DEBOUNCE_MAX_WAIT_SECONDS = float(os.getenv("DEBOUNCE_MAX_WAIT_SECONDS", "6"))
 
-def get_saved_token():
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'r') as f:
-            return f.read().strip()
-    return None
-
-def save_token(token):
-    with open(TOKEN_FILE, 'w') as f:
-        f.write(token)
-
-def login_to_chatwoot():
-    url = f"{CHATWOOT_BASE_URL}/auth/sign_in"
-    response = requests.post(url, json={
-        "email": CHATWOOT_EMAIL,
-        "password": CHATWOOT_PASSWORD
-    })
-    response.raise_for_status()
-    token = response.json()["data"]["access_token"]
-    save_token(token)
-    return token
-
-def validate_token(token):
-    url = f"{CHATWOOT_BASE_URL}/api/v1/profile"
-    headers = {"api_access_token": token}
-    
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            profile_data = response.json()
-            return True, profile_data.get("account_id")
-        else:
-            return False, None
-    except Exception as e:
-        print(f"[validate_token] Error: {e}")
-        return False, None
-
-def get_next_missing_field(info_status):
-    order_fields = ["kích thước", "màu sắc", "số bộ"]
-    global_fields = ["số điện thoại", "địa chỉ giao hàng"]
-
-    # Ensure there's at least one order to validate
-    orders = info_status.get("đơn hàng", [])
-    if not orders:
-        orders = [{
-            "kích thước": None,
-            "màu sắc": None,
-            "số bộ": 1
-        }]
-
-    for i, order in enumerate(orders):
-        for field in order_fields:
-            if order.get(field) is None:
-                return f"đơn hàng {i + 1}: {field}"
-
-    for field in global_fields:
-        if info_status.get(field) is None:
-            return field
-
-    return None  # All info present
-
-def send_message_to_chatwoot(account_id, conversation_id, message, token):
-    url = f"{CHATWOOT_BASE_URL}/api/v1/accounts/{account_id}/conversations/{conversation_id}/messages"
-    headers = {
-        "api_access_token": f"{token}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "content": message,
-        "message_type": "outgoing",
-        "private": False,
-        "content_type": "text"
-    }
+# sync: one blocking call after another | async: independent stages run concurrently (async_pipeline.py)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "sync")
 
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        print(f"[send_message_to_chatwoot] Error sending message: {e}")
-        return None
+# Stream the answer and send answer_only to Chatwoot as soon as it is complete
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+
+app = Flask(__name__)
+log = get_logger("app")
 
 @app.route('/ask', methods=['POST'])
 def ask():
@@ -116,99 +59,114 @@ def ask():
     if not chatwoot_convo_id:
         return jsonify({"error": "Missing conversation ID"}), 400
 
-    # ✅ Run the heavy work in a background thread
-    threading.Thread(target=handle_chatwoot_message, args=(query, chatwoot_convo_id)).start()
+    if worker_pool.is_full():
+        return jsonify({"error": "Too many pending messages"}), 429, {"Retry-After": WORKER_RETRY_AFTER}
+
+    # ✅ Bursts are merged into one turn and run on the worker pool; redeliveries (same message id) are dropped
+    debouncer.add(chatwoot_convo_id, query, data.get("id"))
 
     # ✅ Immediately return an empty response so Chatwoot can proceed
     return jsonify(data), 200
 
-def handle_chatwoot_message(query, convo_id):
+def handle_chatwoot_message(query, convo_id, turn=None):
+    with span("turn", pipeline="sync"):
+        _handle_chatwoot_message(query, convo_id, turn or Turn(convo_id, [(None, query)]))
+
+def _handle_chatwoot_message(query, convo_id, turn):
     try:
-        # ✅ Get valid token and account_id
-        token = get_saved_token()
-        is_valid, account_id = validate_token(token)
-
-        if not is_valid or not account_id:
-            token = login_to_chatwoot()
-            is_valid, account_id = validate_token(token)
-            if not is_valid or not account_id:
-                print("[ask] Authentication failed")
-                return
-
-        convo_history = get_conversation_history(convo_id)
-        info_status = detect_missing_info(convo_history + [query])
-        print("Missing info status:", info_status)
-
-        next_missing = get_next_missing_field(info_status)
-        print("Next missing field:", next_missing)
-
-        must_know_context = [
-            "Giá mỗi bộ là 175,000 VNĐ. Mua từ 2 set giá còn 170k",
-            "trả lời ngắn gọn, lịch sự, xưng hô là em, khách hàng là chị",
-            "bắt đầu câu trả lời bằng từ Dạ",
-            "các câu khách hỏi giá như bao nhiêu, ib, inbox, xin giá ...",
-        ]
-
-        extra_context_map = {
-            "kích thước": [
-                "hỏi kích thước thì hỏi chiều cao, cân nặng, độ tuổi của bé",
-                "có các cỡ 80, 90, 100, 110, 120, 130, 140",
-                "80=>1-2tuổi,9-11kg,90cm",
-                "90=>2-3tuổi,11-14kg,95cm",
-                "100=>3-4tuổi,14-16kg,104cm",
-                "110=>4-5tuổi,17-20kg,112cm",
-                "120=>5-6tuổi,20-23kg,120cm",
-                "130=>6-7tuổi,23-26kg,126cm",
-                "140=>8-9tuổi,27-30kg,134cm",
-                "phải nói là bé nhà mình phù hợp với cỡ xx và xx ạ (chọn 2 cỡ phù hợp nhất gồm cỡ vừa nhất và cỡ lớn hơn 1 cỡ)"
-                "sau khi khách hàng đã báo thông tin thì mới hỏi 2 cỡ phù hợp nhất cho khách hàng chọn ví dụ 90 100 chị chọn cỡ nào ạ",
-                "nếu khách đã báo thông tin chiều cao cân nặng rồi thì không hỏi chiều cao cân nặng độ tuổi nữa mà chỉ hỏi confirm cỡ thôi",
-                "câu hỏi thì để trong biến question_ask_next, ko để trong biến answer_only"
-            ],
-            "màu sắc": [
-                "Sản phẩm có các màu: Trắng, Hồng, Xanh cốm."
-            ],
-            "số bộ": [],
-            "số điện thoại": [
-                "Dùng mẫu câu: Chị cho em xin số điện thoại và địa chỉ để em gửi chị ạ",
-                "Số điện thoại sẽ dùng để bên vận chuyển liên hệ khi giao hàng."
-            ],
-            "địa chỉ giao hàng": [
-                "Em cần địa chỉ đầy đủ để giao hàng chính xác, gồm: số nhà, tên đường, phường/xã, quận/huyện, tỉnh/thành."
-            ]
-        }
-
-        rag = RAG()  # Initialize a fresh RAG instance
-        rag_contexts = rag.search(query, convo_history)
-        context_texts = [text for text, _ in rag_contexts]
-
-        if next_missing is None:
-            normalized_missing = ""
-        else:
-            normalized_missing = re.sub(r"^đơn hàng \d+:\s*", "", next_missing).strip()
-
-        # Combine contexts
-        combined_contexts = must_know_context[:]
-        if normalized_missing in extra_context_map:
-            combined_contexts.extend(extra_context_map[normalized_missing])
-        combined_contexts.extend(context_texts)
-
-        # Logic to override next_missing if needed
-        if normalized_missing == "số điện thoại" and info_status.get("địa chỉ giao hàng") is None:
-            next_missing = "số điện thoại & địa chỉ giao hàng"
-
-        answer = answer_question(query, combined_contexts, next_missing, info_status)
+        # ✅ Make sure we can reply before doing any work (cached, no request on the hot path)
+        try:
+            with span("chatwoot_auth"):
+                chatwoot_auth.get()
+        except Exception as e:
+            log_event(log, logging.ERROR, "auth_failed", convo_id=convo_id, error=repr(e))
+            return
+
+        turn.check()
+        # Updates the stored order state from this message only; reads history just on fallback.
+        # Saving it commits the turn: its messages must not be applied again by a merged turn.
+        info_status = update_order_state(
+            convo_id, query, partial(get_conversation_history, convo_id), before_save=turn.commit
+        )
+
+        rag = get_shared_rag()
+        rag_contexts = rag.search(query, convo_id=search_scope(convo_id))
+        combined_contexts, next_missing = turn_contexts(convo_id, info_status, rag_contexts)
+
+        cache = turn_response_cache(rag, next_missing)
+        answer = None
+        if cache:
+            q_vec = embed_text(query)  # already embedded by rag.search, served from the embedding cache
+            answer = cache.lookup(query, q_vec, next_missing, info_status)
+
+        sent_early = set()
+
+        def send_early(name, value):
+            if sends_early(name, value):
+                send_message_to_chatwoot(convo_id, value)
+                sent_early.add(name)
+
+        if answer is None:
+            started = time.perf_counter()
+            if STREAM_ANSWERS:
+                answer = answer_question_stream(query, combined_contexts, next_missing, info_status, send_early)
+            else:
+                answer = answer_question(query, combined_contexts, next_missing, info_status)
+            if answer and cache:
+                cache.store(query, q_vec, next_missing, info_status, answer, time.perf_counter() - started)
 
         if answer:
-            rag.store_and_link_query(convo_id, query, source='user')
-            rag.store_and_link_query(convo_id, answer["answer_only"], source='bot')
-            rag.store_and_link_query(convo_id, answer["question_ask_next"], source='bot')
-            send_message_to_chatwoot(account_id, convo_id, answer["answer_only"], token)
-            send_message_to_chatwoot(account_id, convo_id, answer["question_ask_next"], token)
-
-        del rag  # Optional memory cleanup
+            record_turn(convo_id, transcript_messages(query, answer))
+            for text in replies(answer, sent_early):
+                send_message_to_chatwoot(convo_id, text)
+    except TurnSuperseded:
+        log_event(log, logging.INFO, "turn_superseded", convo_id=convo_id)
     except Exception as e:
-        print(f"[handle_chatwoot_message] Error: {e}")
+        log_event(log, logging.ERROR, "turn_failed", convo_id=convo_id, error=repr(e))
+
+if PIPELINE_MODE == "async":
+    from async_pipeline import run_pipeline
+else:
+    run_pipeline = handle_chatwoot_message
+
+debouncer = MessageDebouncer(
+    lambda convo_id, query, turn: worker_pool.submit(convo_id, query, convo_id, turn),
+    window=DEBOUNCE_WINDOW_SECONDS, max_wait=DEBOUNCE_MAX_WAIT_SECONDS, retry_after=float(WORKER_RETRY_AFTER),
+)
+worker_pool = ConversationWorkerPool(
+    debouncer.wrap(run_pipeline), workers=WORKER_POOL_SIZE, max_queue=WORKER_QUEUE_MAX
+).start()
+debouncer.start()
+# atexit runs in reverse order: buffered messages are dispatched before the pool drains
+atexit.register(worker_pool.shutdown, WORKER_DRAIN_TIMEOUT)
+atexit.register(debouncer.shutdown)
+
+registry.register_source("worker_pool", worker_pool.stats)
+registry.register_source("debounce", debouncer.stats)
+registry.register_source("fast_path", fast_path_stats)
+registry.register_source("embedding_cache", embedding_cache.stats)
+registry.register_source("embedding_batcher", embedding_batcher.stats)
+registry.register_source("history_cache", history_cache.stats)
+if response_cache is not None:
+    registry.register_source("response_cache", response_cache.stats)
+if RAG_RETRIEVAL_MODE != "vector":
+    registry.register_source("lexical_index", lambda: get_shared_rag().lexical.stats())
+
+@app.route('/queue-stats', methods=['GET'])
+def queue_stats():
+    return jsonify(worker_pool.stats())
+
+@app.route('/fast-path-stats', methods=['GET'])
+def fast_path_stats_route():
+    return jsonify(fast_path_stats())
+
+@app.route('/response-cache-stats', methods=['GET'])
+def response_cache_stats():
+    return jsonify(response_cache.stats() if response_cache else {"enabled": False})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/params-check', methods=['POST'])
 def params_check():
@@ -218,10 +176,7 @@ def params_check():
     args_data = request.args.to_dict()
     headers = dict(request.headers)
 
-    print("JSON Data:", json_data)
-    print("Form Data:", form_data)
-    print("Query Params:", args_data)
-    print("Headers:", headers)
+    log_event(log, logging.INFO, "params_check", json=json_data, form=form_data, args=args_data, headers=headers)
 
     return jsonify({
         'json': json_data,
@@ -230,5 +185,14 @@ def params_check():
         'headers': headers
     })
 
+def warm_up():
+    started = time.perf_counter()
+    stats = get_shared_rag().load_stats
+    log_event(log, logging.INFO, "startup_ready", startup_seconds=time.perf_counter() - started, **stats)
+
+# At import rather than under __main__, so every WSGI worker (gunicorn imports this module
+# once per worker) loads the index before it takes its first request
+warm_up()
+
 if __name__ == '__main__':
     app.run(port=5000)
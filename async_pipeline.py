@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from functools import partial
+
+import httpx
+import openai
+
+from chatwoot import chatwoot_auth, send_message_to_chatwoot_async
+from order_state import update_order_state_async
+from transcript import get_conversation_history, record_turn
+from turn_steps import search_scope, turn_contexts, turn_response_cache, sends_early, transcript_messages, replies
+from metrics import span, get_logger, log_event
+from debounce import Turn, TurnSuperseded
+from rag import (
+    get_shared_rag, embed_text,
+    local_intent_reply, intent_request, read_intent,
+    answer_request, read_answer, AnswerStream,
+)
+
+# Per-stage timeouts (seconds)
+PIPELINE_LLM_TIMEOUT = float(os.getenv("PIPELINE_LLM_TIMEOUT", "30"))
+PIPELINE_DB_TIMEOUT = float(os.getenv("PIPELINE_DB_TIMEOUT", "10"))
+PIPELINE_HTTP_TIMEOUT = float(os.getenv("PIPELINE_HTTP_TIMEOUT", "10"))
+PIPELINE_HTTP_POOL_SIZE = int(os.getenv("PIPELINE_HTTP_POOL_SIZE", "50"))
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+
+log = get_logger("async_pipeline")
+
+# One event loop thread per process; its clients are created lazily inside the loop
+_loop = None
+_loop_lock = threading.Lock()
+_openai_client = None
+_http_client = None
+
+
+def _get_loop():
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-pipeline", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def _clients():
+    global _openai_client, _http_client
+    if _openai_client is None:
+        _openai_client = openai.AsyncOpenAI()
+        _http_client = httpx.AsyncClient(
+            timeout=PIPELINE_HTTP_TIMEOUT,
+            # Retries connection failures only, so a message POST is never sent twice
+            transport=httpx.AsyncHTTPTransport(
+                retries=3,
+                limits=httpx.Limits(max_connections=PIPELINE_HTTP_POOL_SIZE, max_keepalive_connections=PIPELINE_HTTP_POOL_SIZE),
+            ),
+        )
+    return _openai_client, _http_client
+
+
+# ------------------- LLM calls -------------------
+# Same steps as rag.answer_question / answer_question_stream; only the client call is awaited
+async def answer_question_async(client, question, contexts, next_missing=None, info_status=None):
+    if next_missing is None:
+        reply = local_intent_reply(question, info_status)
+        if reply is not None:
+            return reply
+
+        request = intent_request(question)
+        with span("llm", call="intent"):
+            response = await client.chat.completions.create(**request)
+        return read_intent(request, response, info_status)
+
+    request = answer_request(question, contexts, next_missing, info_status)
+    with span("llm", call="answer"):
+        response = await client.chat.completions.create(**request)
+    return read_answer(request, response)
+
+
+async def answer_question_stream_async(client, question, contexts, next_missing=None, info_status=None, on_field=None):
+    # on_field is awaited as each JSON field of the answer completes
+    if next_missing is None:
+        return await answer_question_async(client, question, contexts, next_missing, info_status)
+
+    answer = AnswerStream(answer_request(question, contexts, next_missing, info_status, stream=True))
+    with span("llm", call="answer_stream"):
+        async for event in await client.chat.completions.create(**answer.request):
+            for name, value in answer.feed(event):
+                if on_field:
+                    await on_field(name, value)
+    return answer.result()
+
+
+# ------------------- Pipeline -------------------
+async def _send_replies(http, convo_id, texts):
+    # The messages must arrive in order, so only the sequence runs concurrently with the DB write
+    for text in texts:
+        await send_message_to_chatwoot_async(http, convo_id, text)
+
+
+def _timed_auth():
+    with span("chatwoot_auth"):
+        return chatwoot_auth.get()
+
+
+async def handle_chatwoot_message_async(query, convo_id, turn):
+    llm, http = _clients()
+    rag = get_shared_rag()
+
+    # Independent of each other: auth, order state extraction and retrieval (query embedding + FAISS)
+    auth = asyncio.create_task(asyncio.wait_for(asyncio.to_thread(_timed_auth), PIPELINE_HTTP_TIMEOUT))
+    retrieval = asyncio.create_task(asyncio.wait_for(
+        asyncio.to_thread(rag.search, query, convo_id=search_scope(convo_id)), PIPELINE_LLM_TIMEOUT
+    ))
+    try:
+        turn.check()
+        # History is only read (from the history cache) when the incremental update falls back to a re-extraction.
+        # Saving the state commits the turn: its messages must not be applied again by a merged turn.
+        info_status = await asyncio.wait_for(
+            update_order_state_async(
+                llm, convo_id, query, partial(get_conversation_history, convo_id), before_save=turn.commit
+            ),
+            PIPELINE_LLM_TIMEOUT
+        )
+        combined_contexts, next_missing = turn_contexts(convo_id, info_status, await retrieval)
+
+        cache = turn_response_cache(rag, next_missing)
+        answer = None
+        if cache:
+            q_vec = await asyncio.to_thread(embed_text, query)  # embedding cache hit after retrieval
+            answer = cache.lookup(query, q_vec, next_missing, info_status)
+
+        sent_early = set()
+
+        async def send_early(name, value):
+            if sends_early(name, value):
+                await asyncio.wait_for(send_message_to_chatwoot_async(http, convo_id, value), PIPELINE_HTTP_TIMEOUT)
+                sent_early.add(name)
+
+        if answer is None:
+            started = time.perf_counter()
+            if STREAM_ANSWERS:
+                # Replies go out mid-stream, so auth has to be ready first (usually already done)
+                await auth
+                call = answer_question_stream_async(llm, query, combined_contexts, next_missing, info_status, send_early)
+            else:
+                call = answer_question_async(llm, query, combined_contexts, next_missing, info_status)
+            answer = await asyncio.wait_for(call, PIPELINE_LLM_TIMEOUT)
+            if answer and cache:
+                cache.store(query, q_vec, next_missing, info_status, answer, time.perf_counter() - started)
+        if not answer:
+            return
+
+        await auth
+        await asyncio.gather(
+            asyncio.wait_for(
+                asyncio.to_thread(record_turn, convo_id, transcript_messages(query, answer)), PIPELINE_DB_TIMEOUT
+            ),
+            asyncio.wait_for(_send_replies(http, convo_id, replies(answer, sent_early)), 2 * PIPELINE_HTTP_TIMEOUT),
+        )
+    finally:
+        for task in (auth, retrieval):
+            task.cancel()
+
+
+def run_pipeline(query, convo_id, turn=None):
+    # Called from worker threads: runs the turn on the shared loop and blocks until it is done
+    turn = turn or Turn(convo_id, [(None, query)])
+    future = asyncio.run_coroutine_threadsafe(handle_chatwoot_message_async(query, convo_id, turn), _get_loop())
+    try:
+        with span("turn", pipeline="async"):
+            try:
+                future.result()
+            except TurnSuperseded:
+                log_event(log, logging.INFO, "turn_superseded", convo_id=convo_id)
+    except Exception as e:
+        log_event(log, logging.ERROR, "turn_failed", convo_id=convo_id, error=repr(e))
@@ -0,0 +1,381 @@
+import base64
+import json
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from fast_path import extract_slots, apply_slots
+from text_utils import fold_diacritics
+
+# Local stand-ins for OpenAI, MySQL and Chatwoot used by bench_load.py / bench_micro.py.
+# Nothing here talks to the network beyond 127.0.0.1.
+
+
+# ------------------- Deterministic embeddings -------------------
+def fake_embedding(text, dim=1536):
+    # Sum of one fixed random vector per folded word: texts sharing words end up close,
+    # which is enough for retrieval to behave like it does on real embeddings
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in fold_diacritics(text).split() or [""]:
+        rng = np.random.default_rng(zlib.crc32(word.encode("utf-8")))
+        vec += rng.standard_normal(dim).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+# ------------------- HTTP plumbing -------------------
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "bench-fake"
+
+    def log_message(self, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class _Server:
+    handler = None
+
+    def __init__(self, port=0):
+        handler = type("Handler", (self.handler,), {"fake": self})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.calls[name] += n
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+# ------------------- OpenAI -------------------
+class _OpenAIHandler(_Handler):
+    def do_POST(self):
+        body = self.read_json()
+        if self.path.endswith("/embeddings"):
+            self.fake.count("embeddings")
+            self.embeddings(body)
+        elif self.path.endswith("/chat/completions"):
+            self.fake.count("chat_completions")
+            self.chat(body)
+        else:
+            self.send_json({"error": {"message": "not found"}}, 404)
+
+    def embeddings(self, body):
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        self.fake.count("embedded_texts", len(inputs))
+        time.sleep(self.fake.embedding_latency)
+        data = []
+        for i, text in enumerate(inputs):
+            vec = fake_embedding(text, self.fake.dim)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vec.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vec.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(t) // 4 + 1 for t in inputs)
+        self.send_json({
+            "object": "list", "data": data, "model": body.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def chat(self, body):
+        prompt = body["messages"][-1]["content"]
+        content = self.fake.reply(prompt)
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                 "total_tokens": (len(prompt) + len(content)) // 4}
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": body.get("model")}
+
+        if not body.get("stream"):
+            time.sleep(self.fake.llm_latency)
+            self.send_json(dict(base, object="chat.completion", usage=usage, choices=[
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+            ]))
+            return
+
+        # Server-sent events: first token after ~30% of the latency, the rest spread evenly
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = [content[i:i + 8] for i in range(0, len(content), 8)] or [""]
+        time.sleep(self.fake.llm_latency * 0.3)
+        for piece in pieces:
+            chunk = dict(base, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": {"content": piece}, "finish_reason": None}
+            ])
+            self.send_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            time.sleep(self.fake.llm_latency * 0.7 / len(pieces))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = dict(base, object="chat.completion.chunk", choices=[], usage=usage)
+            self.send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.send_chunk(b"")
+
+
+_EMPTY_STATE = {
+    "đơn hàng": [{"kích thước": None, "màu sắc": None, "số bộ": None}],
+    "số điện thoại": None,
+    "địa chỉ giao hàng": None,
+}
+
+
+class FakeOpenAI(_Server):
+    """Embeddings and chat completions with fixed latencies.
+
+    Chat replies are chosen from the prompt: intent classification, incremental and full
+    order-state extraction, or the {answer_only, question_ask_next} answer.
+    """
+
+    handler = _OpenAIHandler
+
+    def __init__(self, port=0, llm_latency=0.5, embedding_latency=0.05, dim=1536):
+        super().__init__(port)
+        self.llm_latency = llm_latency
+        self.embedding_latency = embedding_latency
+        self.dim = dim
+
+    def reply(self, prompt):
+        if "Chỉ trả lời bằng 1, 2 hoặc 3" in prompt:
+            self.count("chat_intent")
+            question = re.search(r'Câu của khách: "(.*)"', prompt)
+            text = fold_diacritics(question.group(1) if question else "")
+            return "1" if re.search(r"\d{9,}", text.replace(" ", "")) else "2" if "chot" in text else "3"
+
+        if "Tin nhắn mới của khách:" in prompt:
+            self.count("chat_incremental_state")
+            state = json.loads(re.search(r"Thông tin đơn hàng hiện tại:\n(.*)\n", prompt).group(1))
+            message = prompt.split("Tin nhắn mới của khách:\n", 1)[1].strip()
+            state = state or _EMPTY_STATE
+            slots = extract_slots(message) or {}
+            phone = re.search(r"0\d{9}", message)
+            if phone:
+                slots["số điện thoại"] = phone.group(0)
+            state = apply_slots(state, slots) or state
+            if "địa chỉ" in message:
+                state["địa chỉ giao hàng"] = message.split("địa chỉ", 1)[1].strip(" :,")
+            return json.dumps(dict(state, **{"độ tin cậy": 0.9}), ensure_ascii=False)
+
+        if "Lịch sử hội thoại:" in prompt:
+            self.count("chat_missing_info")
+            return json.dumps(_EMPTY_STATE, ensure_ascii=False)
+
+        self.count("chat_answer")
+        return json.dumps({
+            "answer_only": "Dạ bộ này giá 175,000 VNĐ, mua từ 2 set còn 170k chị nhé",
+            "question_ask_next": "Dạ chị cho em xin chiều cao, cân nặng của bé để em tư vấn size ạ?",
+        }, ensure_ascii=False)
+
+
+# ------------------- Chatwoot -------------------
+class _ChatwootHandler(_Handler):
+    def do_GET(self):
+        if self.path == "/api/v1/profile":
+            self.fake.count("profile")
+            self.send_json({"account_id": 1})
+        else:
+            self.send_json({}, 404)
+
+    def do_POST(self):
+        body = self.read_json()
+        if self.path == "/auth/sign_in":
+            self.fake.count("sign_in")
+            self.send_json({"data": {"access_token": "bench-token"}})
+            return
+        match = re.match(r"^/api/v1/accounts/\d+/conversations/([^/]+)/messages$", self.path)
+        if not match:
+            self.send_json({}, 404)
+            return
+        time.sleep(self.fake.latency)
+        self.fake.count("messages")
+        self.fake.record(match.group(1), body.get("content"))
+        self.send_json({"id": self.fake.calls["messages"], "content": body.get("content")})
+
+
+class FakeChatwoot(_Server):
+    """Accepts sign-in, profile and outgoing messages; records when each message arrived."""
+
+    handler = _ChatwootHandler
+
+    def __init__(self, port=0, latency=0.02):
+        super().__init__(port)
+        self.latency = latency
+        self.messages = defaultdict(list)  # conversation id -> [(arrived_at, content)]
+        self._cond = threading.Condition()
+
+    def record(self, convo_id, content):
+        with self._cond:
+            self.messages[convo_id].append((time.perf_counter(), content))
+            self._cond.notify_all()
+
+    def wait_for(self, convo_id, count, timeout):
+        # Blocks until `count` messages arrived for the conversation; returns their arrival times
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self.messages[convo_id]) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return [arrived for arrived, _ in self.messages[convo_id][:count]]
+
+
+# ------------------- MySQL -------------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS knowledge (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content TEXT NOT NULL,
+    content_hash TEXT NOT NULL UNIQUE,
+    embedding BLOB NOT NULL,
+    origin TEXT NOT NULL DEFAULT 'curated'
+);
+CREATE TABLE IF NOT EXISTS conversation_link (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    knowledge_id INTEGER NOT NULL,
+    from_source TEXT NOT NULL DEFAULT 'user',
+    UNIQUE (conversation_id, knowledge_id)
+);
+CREATE TABLE IF NOT EXISTS conversation_message (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    from_source TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_conversation_message_history ON conversation_message (conversation_id, id);
+CREATE INDEX IF NOT EXISTS ix_conversation_message_created ON conversation_message (created_at);
+CREATE TABLE IF NOT EXISTS conversation_state (
+    conversation_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    turns INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+_UPSERT_RE = re.compile(r"\s+ON DUPLICATE KEY UPDATE\s+(.*)$", re.S | re.I)
+
+
+def translate_sql(sql):
+    # The MySQL dialect rag.py uses, mapped onto SQLite. ON DUPLICATE KEY UPDATE becomes
+    # INSERT OR REPLACE when it copies VALUES(), INSERT OR IGNORE otherwise; lastrowid is
+    # therefore not the existing row after an ignored LAST_INSERT_ID(id) upsert.
+    sql = sql.replace("%s", "?")
+    match = _UPSERT_RE.search(sql)
+    if match:
+        verb = "INSERT OR REPLACE INTO" if "VALUES(" in match.group(1).upper() else "INSERT OR IGNORE INTO"
+        sql = re.sub(r"^\s*INSERT\s+INTO", verb, sql[:match.start()], count=1, flags=re.I)
+    return sql
+
+
+class _SQLiteCursor:
+    def __init__(self, conn, pool):
+        self._cursor = conn.cursor()
+        self._pool = pool
+
+    def execute(self, sql, params=()):
+        self._pool.count()
+        self._cursor.execute(translate_sql(sql), tuple(params))
+
+    def executemany(self, sql, seq_params):
+        # One round trip in MySQL (batched insert), so it counts as a single query
+        self._pool.count()
+        self._cursor.executemany(translate_sql(sql), [tuple(p) for p in seq_params])
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def close(self):
+        self._cursor.close()
+
+
+class _SQLiteConnection:
+    def __init__(self, conn, pool):
+        self._conn = conn
+        self._pool = pool
+
+    def cursor(self):
+        return _SQLiteCursor(self._conn, self._pool)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, **kwargs):
+        pass
+
+    def close(self):
+        # Like a pooled mysql connection: the underlying connection stays open for reuse
+        self._conn.rollback()
+
+
+class SQLitePool:
+    """Drop-in for rag.get_db_pool(): same get_connection() / cursor API over one SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.queries = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with sqlite3.connect(path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SQLITE_SCHEMA)
+
+    def count(self):
+        with self._lock:
+            self.queries += 1
+
+    def get_connection(self):
+        # One SQLite connection per thread, reused like a pooled connection
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        return _SQLiteConnection(conn, self)
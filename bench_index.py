@@ -0,0 +1,106 @@
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from index_factory import (
+    INDEX_TYPES, METRICS, MIN_POINTS_PER_CENTROID, build_index, default_nlist, index_kind, search_params,
+)
+
+
+# Recall@k / latency / memory of each index type on synthetic clustered unit vectors,
+# so a mode can be picked per deployment size without touching real embeddings.
+def synthetic_vectors(n, dim, clusters, rng):
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vecs = centers[rng.integers(0, clusters, n)] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(vecs)
+    return vecs
+
+
+def index_bytes(index):
+    return faiss.serialize_index(index).nbytes
+
+
+def bench_nlist(n, nlist=0):
+    # The production default (4·sqrt(n)) needs more training points than small benchmark
+    # sizes have, so it is capped to what n vectors can train
+    return nlist or max(1, min(default_nlist(n), n // MIN_POINTS_PER_CENTROID))
+
+
+def bench(kind, base, queries, ground_truth, k, metric, args):
+    # None when build_index fell back to another index type
+    ids = np.arange(len(base), dtype=np.int64)
+    started = time.perf_counter()
+    nlist = bench_nlist(len(base), args.nlist)
+    index = build_index(kind, base.shape[1], metric, base, nlist=nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
+    built = index_kind(index)
+    if built != ("ivf" if "ivf" in kind else kind):
+        return {"kind": kind, "built": built, "nlist": nlist}
+    index.add_with_ids(base, ids)
+    build_seconds = time.perf_counter() - started
+
+    params = search_params(index, nprobe=args.nprobe, ef_search=args.ef_search)
+    latencies = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, q in enumerate(queries):
+        t = time.perf_counter()
+        _, I = index.search(q[None, :], k, params=params)
+        latencies.append(time.perf_counter() - t)
+        found[i] = I[0]
+
+    recall = np.mean([len(set(f) & set(g)) / k for f, g in zip(found, ground_truth)])
+    latencies = np.array(latencies) * 1000
+    return {
+        "kind": kind,
+        "built": built,
+        "nlist": nlist if built == "ivf" else None,
+        "build_s": build_seconds,
+        "recall": recall,
+        "p50_ms": np.percentile(latencies, 50),
+        "p95_ms": np.percentile(latencies, 95),
+        "mem_mb": index_bytes(index) / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index types on synthetic embeddings")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000])
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    parser.add_argument("--metric", choices=METRICS, default="ip")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists; default min(4·sqrt(n), n / 39)")
+    parser.add_argument("--pq-m", type=int, default=64)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'size':>9} {'type':>11} {'built':>6} {'nlist':>6} {'build s':>9} {'recall@' + str(args.k):>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'mem MB':>9}")
+    for n in args.sizes:
+        clusters = max(10, n // 1000)
+        base = synthetic_vectors(n, args.dim, clusters, rng)
+        queries = synthetic_vectors(args.queries, args.dim, clusters, rng)
+
+        exact = build_index("flat", args.dim, args.metric)
+        exact.add_with_ids(base, np.arange(n, dtype=np.int64))
+        _, ground_truth = exact.search(queries, args.k)
+        del exact
+
+        for kind in args.types:
+            r = bench(kind, base, queries, ground_truth, args.k, args.metric, args)
+            if "recall" not in r:
+                print(f"{n:>9} {kind:>11} skipped: {n} vectors can't train nlist={r['nlist']} "
+                      f"(needs {MIN_POINTS_PER_CENTROID} per list and at least 256), build_index falls back to {r['built']}")
+                continue
+            print(f"{n:>9} {r['kind']:>11} {r['built']:>6} {r['nlist'] or '-':>6} {r['build_s']:>9.2f} {r['recall']:>9.3f} "
+                  f"{r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} {r['mem_mb']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
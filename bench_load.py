@@ -0,0 +1,194 @@
+import argparse
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from bench_fakes import FakeOpenAI, FakeChatwoot, SQLitePool, fake_embedding
+
+# End-to-end load test of /ask -> handle_chatwoot_message against local fakes: no API
+# credits, no MySQL, no Chatwoot. Run from the repository root:
+#   python bench_load.py --conversations 100 --concurrency 20 --llm-latency 0.5
+
+QUESTIONS = [
+    "shop ơi bộ này giá bao nhiêu",
+    "có size cho bé 2 tuổi không ạ",
+    "chất vải có mát không shop",
+    "bé nhà em 12kg cao 85cm mặc size nào",
+    "ship về Đà Nẵng mất mấy ngày ạ",
+    "bộ này có màu nào vậy shop",
+]
+SIZES = ["size 80", "size 90", "cỡ 100", "size 110"]
+COLORS = ["màu trắng", "màu hồng", "màu xanh cốm", "màu đen"]
+COUNTS = ["1 bộ", "2 bộ", "lấy 3 bộ"]
+ADDRESSES = ["12 Nguyễn Trãi, Thanh Xuân, Hà Nội", "45 Lê Lợi, Quận 1, TP HCM", "8 Trần Phú, Hải Châu, Đà Nẵng"]
+CONFIRMS = ["ok chốt đơn em nhé", "oke em", "chốt nhé"]
+
+CORPUS_TOPICS = ["giá", "size", "chất liệu", "màu sắc", "giao hàng", "đổi trả", "thanh toán", "khuyến mãi"]
+
+
+def synthetic_conversation(rng, index, burst=False):
+    # A list of steps; the messages of one step are sent back to back and expect one reply pair
+    phone = f"09{index:08d}"[:10]
+    slots = [rng.choice(SIZES), rng.choice(COLORS), rng.choice(COUNTS)]
+    return [
+        [rng.choice(QUESTIONS)],
+        *([slots] if burst else [[slot] for slot in slots]),
+        [f"sđt {phone} địa chỉ {rng.choice(ADDRESSES)}"],
+        [rng.choice(CONFIRMS)],
+    ]
+
+
+def synthetic_corpus(rng, n):
+    return [
+        f"Câu hỏi về {rng.choice(CORPUS_TOPICS)} số {i}: {rng.choice(QUESTIONS)} - trả lời mẫu {i}"
+        for i in range(n)
+    ]
+
+
+def seed_knowledge(pool, texts, encode_vector, content_hash):
+    conn = pool.get_connection()
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO knowledge (content, content_hash, embedding) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE id = id",
+        [(t, content_hash(t), encode_vector(fake_embedding(t))) for t in texts],
+    )
+    conn.commit()
+    cursor.close()
+
+
+def percentiles(values):
+    if not values:
+        return "n/a"
+    ms = np.array(values) * 1000
+    return "p50={:.0f}ms p95={:.0f}ms p99={:.0f}ms".format(*np.percentile(ms, [50, 95, 99]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic conversations through the Flask app against local fakes")
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10, help="conversations in flight at once")
+    parser.add_argument("--corpus", type=int, default=2000, help="knowledge rows seeded before the run")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--chatwoot-latency", type=float, default=0.02)
+    parser.add_argument("--pipeline", choices=["sync", "async"], default="sync")
+    parser.add_argument("--no-stream", action="store_true", help="disable streamed answers")
+    parser.add_argument("--burst", action="store_true", help="send size, colour and count as one quick burst")
+    parser.add_argument("--debounce-window", type=float, default=0.3)
+    parser.add_argument("--turn-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    openai_fake = FakeOpenAI(llm_latency=args.llm_latency, embedding_latency=args.embedding_latency).start()
+    chatwoot_fake = FakeChatwoot(latency=args.chatwoot_latency).start()
+
+    # Everything the app writes locally (token file, embedding cache, index snapshot) goes to a scratch dir
+    workdir = tempfile.mkdtemp(prefix="bench-load-")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    os.environ.update({
+        "OPENAI_BASE_URL": f"{openai_fake.url}/v1",
+        "OPENAI_API_KEY": "bench",
+        "CHATWOOT_BASE_URL": chatwoot_fake.url,
+        "CHATWOOT_EMAIL": "bench@example.com",
+        "CHATWOOT_PASSWORD": "bench",
+        "PIPELINE_MODE": args.pipeline,
+        "STREAM_ANSWERS": "0" if args.no_stream else "1",
+        "DEBOUNCE_WINDOW_SECONDS": str(args.debounce_window),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "RAG_INDEX_DIR": os.path.join(workdir, "index_snapshot"),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+
+    import rag
+    from text_utils import content_hash
+    from vector_codec import encode_vector
+
+    pool = SQLitePool(os.path.join(workdir, "bench.sqlite3"))
+    rag.get_db_pool = lambda: pool
+    seed_knowledge(pool, synthetic_corpus(rng, args.corpus), encode_vector, content_hash)
+
+    import app  # loads the index from the seeded pool on import
+    client = app.app.test_client()
+
+    pool.queries = 0
+    openai_fake.calls.clear()
+    chatwoot_fake.calls.clear()
+
+    conversations = queue.Queue()
+    for i in range(args.conversations):
+        conversations.put((f"bench-{i}", synthetic_conversation(rng, i, args.burst)))
+
+    turn_latencies, first_reply_latencies = [], []
+    errors, rejected = [0], [0]
+    message_ids = iter(range(1, 10 ** 9))
+    results_lock = threading.Lock()
+
+    def run_conversations():
+        while True:
+            try:
+                convo_id, script = conversations.get_nowait()
+            except queue.Empty:
+                return
+            expected = 0
+            for step in script:
+                started = time.perf_counter()
+                for message in step:
+                    with results_lock:
+                        message_id = next(message_ids)
+                    while True:
+                        response = client.post("/ask", json={
+                            "id": message_id, "content": message, "message_type": "incoming",
+                            "conversation": {"id": convo_id},
+                        })
+                        if response.status_code != 429:
+                            break
+                        with results_lock:
+                            rejected[0] += 1
+                        time.sleep(float(response.headers.get("Retry-After", "1")))
+                expected += 2  # answer_only + question_ask_next
+                arrivals = chatwoot_fake.wait_for(convo_id, expected, args.turn_timeout)
+                with results_lock:
+                    if arrivals is None:
+                        errors[0] += 1
+                        expected = len(chatwoot_fake.messages[convo_id])
+                        continue
+                    turn_latencies.append(arrivals[-1] - started)
+                    first_reply_latencies.append(arrivals[-2] - started)
+
+    started = time.perf_counter()
+    runners = [threading.Thread(target=run_conversations) for _ in range(args.concurrency)]
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+    elapsed = time.perf_counter() - started
+
+    turns = len(turn_latencies)
+    per_turn = max(turns, 1)
+    calls = openai_fake.calls
+    print(f"pipeline={args.pipeline} stream={not args.no_stream} burst={args.burst} debounce={args.debounce_window}s "
+          f"conversations={args.conversations} concurrency={args.concurrency} corpus={args.corpus} "
+          f"llm_latency={args.llm_latency}s")
+    print(f"turns: {turns} ok, {errors[0]} timed out, {rejected[0]} rejected with 429")
+    print(f"throughput: {next(message_ids) - 1} messages in {turns} turns, {turns / elapsed:.1f} turns/s over {elapsed:.1f}s")
+    print(f"turn latency (until last reply): {percentiles(turn_latencies)}")
+    print(f"time to first reply:             {percentiles(first_reply_latencies)}")
+    print(f"per turn: {calls['chat_completions'] / per_turn:.2f} chat completions "
+          f"(answer {calls['chat_answer'] / per_turn:.2f}, intent {calls['chat_intent'] / per_turn:.2f}, "
+          f"state {calls['chat_incremental_state'] / per_turn:.2f}, full state {calls['chat_missing_info'] / per_turn:.2f}), "
+          f"{calls['embeddings'] / per_turn:.2f} embedding requests ({calls['embedded_texts'] / per_turn:.2f} texts), "
+          f"{pool.queries / per_turn:.2f} DB queries, {chatwoot_fake.calls['messages'] / per_turn:.2f} Chatwoot messages")
+
+    app.worker_pool.shutdown(5)
+
+
+if __name__ == "__main__":
+    main()
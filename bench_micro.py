@@ -0,0 +1,127 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from bench_fakes import SQLitePool
+
+# Microbenchmarks of the retrieval hot path on a SQLite stand-in for MySQL:
+# load_all_embeddings, index build and RAG.search (vector global and conversation-scoped,
+# lexical and hybrid). Query embeddings are preloaded into the embedding cache, so no
+# API call is timed.
+#   python bench_micro.py --sizes 1000 10000 100000 --index-type flat
+
+VOCAB = [
+    "áo", "quần", "bộ", "bé", "trai", "gái", "cotton", "mát", "giá", "size", "cỡ", "màu", "trắng", "hồng",
+    "xanh", "cốm", "đen", "giao", "hàng", "ship", "đổi", "trả", "thanh", "toán", "khuyến", "mãi", "chất",
+    "liệu", "vải", "mềm", "tuổi", "cân", "nặng", "chiều", "cao", "mùa", "hè", "đông", "ngủ", "mặc", "nhà",
+]
+
+
+def timed(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    return np.array(latencies) * 1000
+
+
+def seed(pool, n, dim, rng, encode_vector, content_hash, dtype):
+    vecs = rng.standard_normal((n, dim)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    texts = [f"tài liệu {i}: " + " ".join(rng.choice(VOCAB, 12)) for i in range(n)]
+    conn = pool.get_connection()
+    cursor = conn.cursor()
+    rows = [(t, content_hash(t), encode_vector(v, dtype)) for t, v in zip(texts, vecs)]
+    cursor.executemany("INSERT INTO knowledge (content, content_hash, embedding) VALUES (%s, %s, %s)", rows)
+    conn.commit()
+    cursor.close()
+    return vecs, texts
+
+
+def p50_p95(latencies):
+    return f"{np.percentile(latencies, 50):>8.2f}/{np.percentile(latencies, 95):<9.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark load_all_embeddings, index build and RAG.search")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--metric", default="l2")
+    parser.add_argument("--storage-dtype", default="float32", help="vector_codec dtype of the seeded rows")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--scope", type=int, default=50, help="knowledge rows linked to the scoped conversation")
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-micro-")
+    os.environ.update({
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "RAG_INDEX_DIR": "",  # in-process index only, no snapshot files
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+
+    import rag
+    from lexical_index import LexicalIndex
+    from text_utils import content_hash
+    from vector_codec import encode_vector
+
+    rng = np.random.default_rng(0)
+    print(f"{'rows':>8} {'load_s':>8} {'build_s':>8} {'lex_build_s':>11} {'search p50/p95 ms':>18} "
+          f"{'scoped p50/p95 ms':>18} {'lexical p50/p95 ms':>18} {'hybrid p50/p95 ms':>18}")
+    for n in args.sizes:
+        pool = SQLitePool(os.path.join(workdir, f"micro-{n}.sqlite3"))
+        rag.get_db_pool = lambda: pool
+        vecs, texts = seed(pool, n, args.dim, rng, encode_vector, content_hash, args.storage_dtype)
+
+        started = time.perf_counter()
+        ids, _, _ = rag.load_all_embeddings(args.dim)
+        load_seconds = time.perf_counter() - started
+
+        # load_from_db reads the rows again, so the build time is what it adds on top of the load
+        index = rag.RAG(dim=args.dim, index_type=args.index_type, metric=args.metric)
+        build_seconds = index.load_from_db()["seconds"] - load_seconds
+
+        started = time.perf_counter()
+        index.lexical = LexicalIndex()
+        index.lexical.build(index.texts.items())
+        lexical_build_seconds = time.perf_counter() - started
+
+        # Link a slice of the corpus to one conversation for the scoped search
+        conn = pool.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO conversation_link (conversation_id, knowledge_id, from_source) VALUES (%s, %s, %s)",
+            [("bench", int(i), "user") for i in ids[:args.scope]],
+        )
+        conn.commit()
+        cursor.close()
+
+        queries = []
+        for i in range(args.queries):
+            target = rng.integers(0, n)
+            q = vecs[target] + 0.1 * rng.standard_normal(args.dim).astype(np.float32)
+            # A few words of the target row, so lexical and vector search look for the same thing
+            text = f"câu hỏi {n}-{i} " + " ".join(rng.choice(texts[target].split(": ")[1].split(), 4))
+            rag.embedding_cache.put(rag.EMBEDDING_MODEL, text, q / np.linalg.norm(q))
+            queries.append(text)
+
+        it = iter(queries * 2)
+        search = timed(lambda: index.search(next(it)), args.queries)
+        it = iter(queries * 2)
+        index.search(queries[0], convo_id="bench")  # first call loads the conversation scope
+        scoped = timed(lambda: index.search(next(it), convo_id="bench"), args.queries)
+        it = iter(queries)
+        lexical = timed(lambda: index.search(next(it), mode="lexical"), args.queries)
+        it = iter(queries)
+        hybrid = timed(lambda: index.search(next(it), mode="hybrid"), args.queries)
+
+        print(f"{n:>8} {load_seconds:>8.2f} {build_seconds:>8.2f} {lexical_build_seconds:>11.2f} "
+              f"{p50_p95(search)} {p50_p95(scoped)} {p50_p95(lexical)} {p50_p95(hybrid)}")
+
+
+if __name__ == "__main__":
+    main()
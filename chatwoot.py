@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+from metrics import span, traced, get_logger, log_event
+
+load_dotenv()
+
+log = get_logger("chatwoot")
+
+CHATWOOT_EMAIL = os.getenv("CHATWOOT_EMAIL")
+CHATWOOT_PASSWORD = os.getenv("CHATWOOT_PASSWORD")
+CHATWOOT_BASE_URL = os.getenv("CHATWOOT_BASE_URL")
+TOKEN_FILE = "chatwoot_token.txt"
+
+CHATWOOT_AUTH_TTL = float(os.getenv("CHATWOOT_AUTH_TTL", "3600"))
+CHATWOOT_HTTP_TIMEOUT = float(os.getenv("CHATWOOT_HTTP_TIMEOUT", "10"))
+CHATWOOT_HTTP_POOL_SIZE = int(os.getenv("CHATWOOT_HTTP_POOL_SIZE", "20"))
+CHATWOOT_HTTP_RETRIES = int(os.getenv("CHATWOOT_HTTP_RETRIES", "3"))
+
+# ------------------- Keep-alive session -------------------
+def _build_session():
+    # Connection errors are retried for every method; 5xx/429 only for GET, so a
+    # message POST that may have gone through is never sent twice
+    retry = Retry(
+        total=CHATWOOT_HTTP_RETRIES,
+        connect=CHATWOOT_HTTP_RETRIES,
+        read=CHATWOOT_HTTP_RETRIES,
+        status=CHATWOOT_HTTP_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=CHATWOOT_HTTP_POOL_SIZE, pool_maxsize=CHATWOOT_HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+session = _build_session()
+
+def get_saved_token():
+    if os.path.exists(TOKEN_FILE):
+        with open(TOKEN_FILE, 'r') as f:
+            return f.read().strip()
+    return None
+
+def save_token(token):
+    with open(TOKEN_FILE, 'w') as f:
+        f.write(token)
+
+def login_to_chatwoot():
+    url = f"{CHATWOOT_BASE_URL}/auth/sign_in"
+    response = session.post(url, json={
+        "email": CHATWOOT_EMAIL,
+        "password": CHATWOOT_PASSWORD
+    }, timeout=CHATWOOT_HTTP_TIMEOUT)
+    response.raise_for_status()
+    token = response.json()["data"]["access_token"]
+    save_token(token)
+    return token
+
+@traced("chatwoot_validate")
+def validate_token(token):
+    url = f"{CHATWOOT_BASE_URL}/api/v1/profile"
+    headers = {"api_access_token": token}
+    
+    try:
+        response = session.get(url, headers=headers, timeout=CHATWOOT_HTTP_TIMEOUT)
+        if response.status_code == 200:
+            profile_data = response.json()
+            return True, profile_data.get("account_id")
+        else:
+            return False, None
+    except Exception as e:
+        log_event(log, logging.WARNING, "token_validation_failed", error=repr(e))
+        return False, None
+
+# ------------------- Cached auth -------------------
+class ChatwootAuth:
+    # Token and account_id are cached in memory for CHATWOOT_AUTH_TTL seconds. Only one
+    # thread re-validates or logs in at a time; the others wait and reuse its result.
+    def __init__(self, ttl=CHATWOOT_AUTH_TTL):
+        self.ttl = ttl
+        self.token = None
+        self.account_id = None
+        self.expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.token and time.monotonic() < self.expires_at:
+            return self.token, self.account_id
+        with self._lock:
+            if not self.token or time.monotonic() >= self.expires_at:
+                self._refresh(self.token or get_saved_token())
+            return self.token, self.account_id
+
+    def invalidate(self, rejected_token):
+        # Called after a 401. If another thread already replaced the token, just use the new one.
+        with self._lock:
+            if self.token == rejected_token:
+                self._refresh(None)
+            return self.token, self.account_id
+
+    def _refresh(self, token):
+        is_valid, account_id = validate_token(token) if token else (False, None)
+        if not is_valid or not account_id:
+            token = login_to_chatwoot()
+            is_valid, account_id = validate_token(token)
+            if not is_valid or not account_id:
+                self.token, self.expires_at = None, 0.0
+                raise RuntimeError("Chatwoot authentication failed")
+        self.token = token
+        self.account_id = account_id
+        self.expires_at = time.monotonic() + self.ttl
+
+chatwoot_auth = ChatwootAuth()
+
+# ------------------- Messages -------------------
+def _message_request(account_id, conversation_id, message, token):
+    url = f"{CHATWOOT_BASE_URL}/api/v1/accounts/{account_id}/conversations/{conversation_id}/messages"
+    headers = {
+        "api_access_token": f"{token}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "content": message,
+        "message_type": "outgoing",
+        "private": False,
+        "content_type": "text"
+    }
+    return url, headers, payload
+
+def send_message_to_chatwoot(conversation_id, message):
+    try:
+        token, account_id = chatwoot_auth.get()
+        with span("chatwoot_send"):
+            url, headers, payload = _message_request(account_id, conversation_id, message, token)
+            response = session.post(url, headers=headers, json=payload, timeout=CHATWOOT_HTTP_TIMEOUT)
+            if response.status_code == 401:
+                token, account_id = chatwoot_auth.invalidate(token)
+                url, headers, payload = _message_request(account_id, conversation_id, message, token)
+                response = session.post(url, headers=headers, json=payload, timeout=CHATWOOT_HTTP_TIMEOUT)
+            response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, RuntimeError) as e:
+        log_event(log, logging.ERROR, "send_failed", convo_id=conversation_id, error=repr(e))
+        return None
+
+# ------------------- Async variant (httpx.AsyncClient) -------------------
+async def send_message_to_chatwoot_async(client, conversation_id, message):
+    # Auth is shared with the sync path; refreshes block, so they run off the event loop
+    try:
+        token, account_id = await asyncio.to_thread(chatwoot_auth.get)
+        with span("chatwoot_send"):
+            url, headers, payload = _message_request(account_id, conversation_id, message, token)
+            response = await client.post(url, headers=headers, json=payload)
+            if response.status_code == 401:
+                token, account_id = await asyncio.to_thread(chatwoot_auth.invalidate, token)
+                url, headers, payload = _message_request(account_id, conversation_id, message, token)
+                response = await client.post(url, headers=headers, json=payload)
+            response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        log_event(log, logging.ERROR, "send_failed", convo_id=conversation_id, error=repr(e))
+        return None
@@ -0,0 +1,86 @@
+import json
+import re
+
+from text_utils import content_hash
+
+MUST_KNOW_CONTEXT = [
+    "Giá mỗi bộ là 175,000 VNĐ. Mua từ 2 set giá còn 170k",
+    "trả lời ngắn gọn, lịch sự, xưng hô là em, khách hàng là chị",
+    "bắt đầu câu trả lời bằng từ Dạ",
+    "các câu khách hỏi giá như bao nhiêu, ib, inbox, xin giá ...",
+]
+
+EXTRA_CONTEXT_MAP = {
+    "kích thước": [
+        "hỏi kích thước thì hỏi chiều cao, cân nặng, độ tuổi của bé",
+        "có các cỡ 80, 90, 100, 110, 120, 130, 140",
+        "80=>1-2tuổi,9-11kg,90cm",
+        "90=>2-3tuổi,11-14kg,95cm",
+        "100=>3-4tuổi,14-16kg,104cm",
+        "110=>4-5tuổi,17-20kg,112cm",
+        "120=>5-6tuổi,20-23kg,120cm",
+        "130=>6-7tuổi,23-26kg,126cm",
+        "140=>8-9tuổi,27-30kg,134cm",
+        "phải nói là bé nhà mình phù hợp với cỡ xx và xx ạ (chọn 2 cỡ phù hợp nhất gồm cỡ vừa nhất và cỡ lớn hơn 1 cỡ)"
+        "sau khi khách hàng đã báo thông tin thì mới hỏi 2 cỡ phù hợp nhất cho khách hàng chọn ví dụ 90 100 chị chọn cỡ nào ạ",
+        "nếu khách đã báo thông tin chiều cao cân nặng rồi thì không hỏi chiều cao cân nặng độ tuổi nữa mà chỉ hỏi confirm cỡ thôi",
+        "câu hỏi thì để trong biến question_ask_next, ko để trong biến answer_only"
+    ],
+    "màu sắc": [
+        "Sản phẩm có các màu: Trắng, Hồng, Xanh cốm."
+    ],
+    "số bộ": [],
+    "số điện thoại": [
+        "Dùng mẫu câu: Chị cho em xin số điện thoại và địa chỉ để em gửi chị ạ",
+        "Số điện thoại sẽ dùng để bên vận chuyển liên hệ khi giao hàng."
+    ],
+    "địa chỉ giao hàng": [
+        "Em cần địa chỉ đầy đủ để giao hàng chính xác, gồm: số nhà, tên đường, phường/xã, quận/huyện, tỉnh/thành."
+    ]
+}
+
+# Cached LLM answers were built from these; any change to prices or rules gives a new version
+CONTEXT_VERSION = content_hash(json.dumps([MUST_KNOW_CONTEXT, EXTRA_CONTEXT_MAP], ensure_ascii=False, sort_keys=True))
+
+def get_next_missing_field(info_status):
+    order_fields = ["kích thước", "màu sắc", "số bộ"]
+    global_fields = ["số điện thoại", "địa chỉ giao hàng"]
+
+    # Ensure there's at least one order to validate
+    orders = info_status.get("đơn hàng", [])
+    if not orders:
+        orders = [{
+            "kích thước": None,
+            "màu sắc": None,
+            "số bộ": 1
+        }]
+
+    for i, order in enumerate(orders):
+        for field in order_fields:
+            if order.get(field) is None:
+                return f"đơn hàng {i + 1}: {field}"
+
+    for field in global_fields:
+        if info_status.get(field) is None:
+            return field
+
+    return None  # All info present
+
+def normalize_missing(next_missing):
+    if next_missing is None:
+        return ""
+    return re.sub(r"^đơn hàng \d+:\s*", "", next_missing).strip()
+
+def build_turn_contexts(next_missing, info_status, context_texts):
+    normalized_missing = normalize_missing(next_missing)
+
+    # MUST_KNOW_CONTEXT is part of the static answer prompt; these are the per-turn contexts,
+    # slot-specific hints first so they survive the token budget before retrieval hits do
+    combined_contexts = list(EXTRA_CONTEXT_MAP.get(normalized_missing, []))
+    combined_contexts.extend(context_texts)
+
+    # Logic to override next_missing if needed
+    if normalized_missing == "số điện thoại" and info_status.get("địa chỉ giao hàng") is None:
+        next_missing = "số điện thoại & địa chỉ giao hàng"
+
+    return combined_contexts, next_missing
@@ -0,0 +1,197 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+from worker_pool import QueueFull
+
+
+class TurnSuperseded(Exception):
+    pass
+
+
+def _merge(older, newer):
+    # Older messages first, each message key once
+    keys = {key for key, _ in older}
+    return list(older) + [(key, text) for key, text in newer if key not in keys]
+
+
+class Turn:
+    """Handle for one dispatched turn, passed to the pipeline.
+
+    Newer input cancels the turn until it commits; the pipeline commits right before its
+    first lasting side effect (saving the order state), after which it always runs to the end.
+    """
+
+    def __init__(self, convo_id, messages):
+        self.convo_id = convo_id
+        self.messages = messages  # [(message key, text), ...]
+        self.cancelled = False
+        self.committed = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.cancelled:
+            raise TurnSuperseded(self.convo_id)
+
+    def commit(self):
+        with self._lock:
+            if self.cancelled:
+                raise TurnSuperseded(self.convo_id)
+            self.committed = True
+
+    def supersede(self):
+        # True when the turn was still cancellable, so its messages have to be replayed
+        with self._lock:
+            if self.committed:
+                return False
+            self.cancelled = True
+            return True
+
+
+class MessageDebouncer:
+    """Coalesces bursts of messages per conversation into a single turn.
+
+    A turn is dispatched `window` seconds after the last message of a burst (at most
+    `max_wait` after the first). Webhook redeliveries are dropped by Chatwoot message id.
+    Input arriving while a turn is in flight cancels that turn if it has not committed
+    yet, and its messages are merged into the next one.
+    """
+
+    def __init__(self, submit, window=1.5, max_wait=6.0, retry_after=1.0, seen_max=100000):
+        self.submit = submit  # submit(convo_id, query, turn); may raise QueueFull
+        self.window = window
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.seen_max = seen_max
+
+        self._cond = threading.Condition()
+        self._buffers = {}  # convo_id -> {"messages": [...], "first_at": t, "deadline": t}
+        self._inflight = {}  # convo_id -> Turn
+        self._heap = []  # (deadline, convo_id); stale entries are skipped
+        self._seen = OrderedDict()  # Chatwoot message ids, oldest first
+        self._local_keys = 0  # keys for messages that came without an id
+        self._dispatching = 0
+        self._closed = False
+
+        self.stats_counts = {
+            "received": 0, "duplicates": 0, "turns": 0, "merged": 0, "superseded": 0, "requeued": 0, "dropped": 0,
+        }
+
+    def start(self):
+        threading.Thread(target=self._run, name="message-debouncer", daemon=True).start()
+        return self
+
+    def add(self, convo_id, text, message_id=None):
+        # Returns False for a redelivered message id
+        now = time.monotonic()
+        with self._cond:
+            if message_id is not None:
+                if message_id in self._seen:
+                    self.stats_counts["duplicates"] += 1
+                    return False
+                self._seen[message_id] = None
+                if len(self._seen) > self.seen_max:
+                    self._seen.popitem(last=False)
+            else:
+                self._local_keys += 1
+                message_id = ("local", self._local_keys)
+            self.stats_counts["received"] += 1
+
+            buffer = self._buffers.get(convo_id)
+            if buffer is None:
+                buffer = self._buffers[convo_id] = {"messages": [], "first_at": now}
+                inflight = self._inflight.get(convo_id)
+                if inflight is not None and inflight.supersede():
+                    # The running turn has not replied yet: stop it and answer everything together
+                    self.stats_counts["superseded"] += 1
+                    buffer["messages"] = _merge(inflight.messages, buffer["messages"])
+            buffer["messages"].append((message_id, text))
+            buffer["deadline"] = min(now + self.window, buffer["first_at"] + self.max_wait)
+            heapq.heappush(self._heap, (buffer["deadline"], convo_id))
+            self._cond.notify()
+        return True
+
+    def finished(self, turn):
+        with self._cond:
+            if self._inflight.get(turn.convo_id) is turn:
+                del self._inflight[turn.convo_id]
+
+    def wrap(self, handler):
+        # Worker-pool handler: runs the turn and clears it from the in-flight table
+        def run(query, convo_id, turn):
+            try:
+                handler(query, convo_id, turn)
+            finally:
+                self.finished(turn)
+        return run
+
+    def shutdown(self, timeout=5):
+        # Dispatches whatever is still buffered right away; call before the worker pool shuts down
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._closed = True
+            for buffer in self._buffers.values():
+                buffer["deadline"] = 0.0
+            self._heap = [(0.0, convo_id) for convo_id in self._buffers]
+            self._cond.notify_all()
+            while (self._buffers or self._dispatching) and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.stats_counts)
+            stats["buffered_conversations"] = len(self._buffers)
+            stats["inflight_turns"] = len(self._inflight)
+        stats["messages_per_turn"] = (stats["received"] / stats["turns"]) if stats["turns"] else 0.0
+        return stats
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        if self._closed:
+                            return
+                        self._cond.wait()
+                        continue
+                    deadline, convo_id = self._heap[0]
+                    buffer = self._buffers.get(convo_id)
+                    if buffer is None or buffer["deadline"] != deadline:
+                        heapq.heappop(self._heap)  # superseded by a later message or already dispatched
+                        continue
+                    wait = deadline - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                heapq.heappop(self._heap)
+                messages = self._buffers.pop(convo_id)["messages"]
+                turn = Turn(convo_id, messages)
+                self._inflight[convo_id] = turn
+                self._dispatching += 1
+
+            try:
+                self.submit(convo_id, "\n".join(text for _, text in messages), turn)
+                ok = True
+            except QueueFull:
+                ok = False
+
+            with self._cond:
+                self._dispatching -= 1
+                if ok:
+                    self.stats_counts["turns"] += 1
+                    self.stats_counts["merged"] += len(messages) - 1
+                else:
+                    if self._inflight.get(convo_id) is turn:
+                        del self._inflight[convo_id]
+                    if self._closed:
+                        self.stats_counts["dropped"] += len(messages)
+                    else:
+                        # Keep the burst and try again shortly instead of dropping the customer's messages.
+                        # add() may already have carried them over when it superseded this turn.
+                        self.stats_counts["requeued"] += 1
+                        buffer = self._buffers.setdefault(convo_id, {"messages": [], "first_at": time.monotonic()})
+                        buffer["messages"] = _merge(messages, buffer["messages"])
+                        buffer["deadline"] = time.monotonic() + self.retry_after
+                        heapq.heappush(self._heap, (buffer["deadline"], convo_id))
+                self._cond.notify_all()
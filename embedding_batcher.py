@@ -0,0 +1,72 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+# Coalesces single-text embedding requests coming from concurrent threads into one
+# batched call. The first request opens a window of `window` seconds; everything that
+# arrives before it closes (up to max_batch texts) is embedded together.
+class EmbeddingBatcher:
+    def __init__(self, embed_fn, window=0.01, max_batch=256):
+        self.embed_fn = embed_fn
+        self.window = window
+        self.max_batch = max_batch
+        self.requests = 0
+        self.batches = 0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def embed(self, text, timeout=None):
+        if self.window <= 0:
+            return self.embed_fn([text])[0]
+
+        future = Future()
+        self._ensure_started()
+        self._queue.put((text, future))
+        return future.result(timeout)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(pending)
+
+    def _flush(self, pending):
+        texts = list(dict.fromkeys(text for text, _ in pending))
+        self.requests += len(pending)
+        self.batches += 1
+        try:
+            vectors = dict(zip(texts, self.embed_fn(texts)))
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+
+        for text, future in pending:
+            future.set_result(vectors[text])
@@ -0,0 +1,116 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from text_utils import content_hash
+
+
+# Two tiers: an in-process LRU in front of a persistent SQLite table.
+# Keys are (model, hash of normalized text), so the same string is never embedded twice.
+class EmbeddingCache:
+    def __init__(self, path=None, max_memory_items=10000, max_disk_items=500000):
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._db = None
+        self._disk_count = 0
+
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used)")
+            self._db.commit()
+            self._disk_count = self._db.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, text):
+        return f"{model}:{content_hash(text)}"
+
+    def get(self, model, text):
+        key = self.make_key(model, text)
+        with self._lock:
+            vec = self._memory.get(key)
+            if vec is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vec
+
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embedding_cache WHERE key = ?", (key,)).fetchone()
+                if row:
+                    self._db.execute("UPDATE embedding_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    vec = self._freeze(np.frombuffer(row[0], dtype=np.float32))
+                    self._remember(key, vec)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vec
+
+            self.misses += 1
+            return None
+
+    def put(self, model, text, vec):
+        key = self.make_key(model, text)
+        vec = self._freeze(np.array(vec, dtype=np.float32))
+        with self._lock:
+            self._remember(key, vec)
+            if self._db is not None:
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO embedding_cache (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                    (key, model, vec.tobytes(), time.time())
+                )
+                self._disk_count += cursor.rowcount
+                if self._disk_count > self.max_disk_items:
+                    self._evict_disk()
+                self._db.commit()
+        return vec
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_items": self._disk_count,
+            }
+
+    def _remember(self, key, vec):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        # Drop the least recently used ~10% in one go so we don't evict on every insert
+        excess = self._disk_count - self.max_disk_items + max(1, self.max_disk_items // 10)
+        self._db.execute("""
+            DELETE FROM embedding_cache WHERE key IN (
+                SELECT key FROM embedding_cache ORDER BY last_used ASC LIMIT ?
+            )
+        """, (excess,))
+        self._disk_count = self._db.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+    @staticmethod
+    def _freeze(vec):
+        # Cached arrays are shared between callers, so make them read-only
+        vec.setflags(write=False)
+        return vec
@@ -0,0 +1,143 @@
+import copy
+import re
+import threading
+
+from text_utils import fold_diacritics, normalize_text
+
+# Everything here runs on diacritic-folded, lowercased text (see text_utils.fold_diacritics)
+SIZES = ("80", "90", "100", "110", "120", "130", "140")
+
+_PHONE_RE = re.compile(r"(?<!\d)(?:\+?84|0)[35789](?:[\s.\-]?\d){8}(?!\d)")
+_SIZE_RE = re.compile(r"\b(?:size|sz|co|side)\s*(" + "|".join(SIZES) + r")\b")
+_BARE_SIZE_RE = re.compile(r"^\s*(" + "|".join(SIZES) + r")\s*$")
+_COUNT_RE = re.compile(r"\b(\d{1,2})\s*(?:bo|set|cai)\b")
+
+# Folded colour names are ambiguous ("hong" is also slang for "không"), so without the
+# "màu" keyword a colour only counts when typed with its diacritics
+_COLORS = {
+    "trắng": "trắng",
+    "hồng": "hồng",
+    "xanh cốm": "xanh cốm",
+    "đen": "đen",
+}
+_FOLDED_COLORS = {fold_diacritics(k): v for k, v in _COLORS.items()}
+_COLOR_RE = re.compile(r"\b(" + "|".join(sorted(_COLORS, key=len, reverse=True)) + r")\b")
+_FOLDED_COLOR_RE = re.compile(r"\bmau\s+(" + "|".join(sorted(_FOLDED_COLORS, key=len, reverse=True)) + r")\b")
+
+_CONFIRM_RE = re.compile(
+    r"^(?:(?:ok|oke|okie|okela|uh|u|um|vang|da|duoc|dc|chot|dong y|lay|dat|len don)"
+    r"(?:\s+(?:nhe|nha|a|em|luon|lun|di|don|chi))*\s*[.!]*)+$"
+)
+# "dạ", "vâng", "được" alone are acknowledgements; closing the order needs one of these
+_CONFIRM_WORD_RE = re.compile(r"\b(?:ok|oke|okie|okela|chot|dong y|lay|dat|len don)\b")
+
+# Filler that may surround a slot without making the message ambiguous
+_FILLER = {
+    "chi", "c", "em", "e", "oi", "a", "da", "nhe", "nha", "ne", "nhu", "vay", "roi", "ok", "oke",
+    "size", "sz", "co", "side", "mau", "bo", "set", "cai", "so", "sdt", "dt", "dien", "thoai",
+    "cho", "lay", "minh", "la", "voi", "di", "con", "be", "cua", "va",
+}
+# "thêm 2 bộ" adds an order rather than filling the current one, which only the LLM update handles
+_ADDITIVE = {"them"}
+
+_lock = threading.Lock()
+_stats = {"slot_hits": 0, "slot_misses": 0, "intent_hits": 0, "intent_misses": 0}
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+def fast_path_stats():
+    with _lock:
+        stats = dict(_stats)
+    slots = stats["slot_hits"] + stats["slot_misses"]
+    intents = stats["intent_hits"] + stats["intent_misses"]
+    stats["slot_hit_rate"] = stats["slot_hits"] / slots if slots else 0.0
+    stats["intent_hit_rate"] = stats["intent_hits"] / intents if intents else 0.0
+    return stats
+
+
+def extract_slots(message):
+    # Returns {slot: value} when every word of the message is accounted for, else None
+    original = normalize_text(message).lower()
+    folded = fold_diacritics(message)
+    slots = {}
+    spans = []
+
+    for m in _PHONE_RE.finditer(folded):
+        digits = re.sub(r"\D", "", m.group(0))
+        slots["số điện thoại"] = "0" + digits[2:] if digits.startswith("84") else digits
+        spans.append(m.span())
+
+    size = _SIZE_RE.search(folded) or _BARE_SIZE_RE.search(folded)
+    if size:
+        slots["kích thước"] = size.group(1)
+        spans.append(size.span())
+
+    color = _COLOR_RE.search(original)
+    if color:
+        slots["màu sắc"] = _COLORS[color.group(1)]
+        # Folding keeps the character count for NFC Vietnamese, so spans line up
+        spans.append(color.span())
+    else:
+        color = _FOLDED_COLOR_RE.search(folded)
+        if color:
+            slots["màu sắc"] = _FOLDED_COLORS[color.group(1)]
+            spans.append(color.span())
+
+    count = _COUNT_RE.search(folded)
+    if count and 0 < int(count.group(1)) <= 20:
+        slots["số bộ"] = int(count.group(1))
+        spans.append(count.span())
+
+    if not slots or len(original) != len(folded) or _ADDITIVE & set(re.findall(r"[a-z0-9]+", folded)):
+        _count("slot_misses")
+        return None
+
+    residue = list(folded)
+    for start, end in spans:
+        residue[start:end] = " " * (end - start)
+    words = re.findall(r"[a-z0-9]+", "".join(residue))
+    if any(w not in _FILLER for w in words):
+        _count("slot_misses")
+        return None
+
+    _count("slot_hits")
+    return slots
+
+
+def apply_slots(state, slots):
+    # Only unambiguous updates: at most one order in the state. Returns None otherwise.
+    orders = state.get("đơn hàng") or []
+    if len(orders) > 1 and any(k in slots for k in ("kích thước", "màu sắc", "số bộ")):
+        return None
+
+    new_state = copy.deepcopy(state)
+    if any(k in slots for k in ("kích thước", "màu sắc", "số bộ")):
+        if not new_state.get("đơn hàng"):
+            new_state["đơn hàng"] = [{"kích thước": None, "màu sắc": None, "số bộ": None}]
+        order = new_state["đơn hàng"][0]
+        for key in ("kích thước", "màu sắc", "số bộ"):
+            if key in slots:
+                order[key] = slots[key]
+    if "số điện thoại" in slots:
+        new_state["số điện thoại"] = slots["số điện thoại"]
+    new_state.setdefault("số điện thoại", None)
+    new_state.setdefault("địa chỉ giao hàng", None)
+    return new_state
+
+
+def classify_intent(message):
+    # "1" (giving phone/address), "2" (confirming the order) or None when unsure
+    folded = fold_diacritics(message)
+    if _PHONE_RE.search(folded):
+        _count("intent_hits")
+        return "1"
+    cleaned = re.sub(r"[^a-z0-9 .!]", " ", folded).strip()
+    if len(folded.split()) <= 6 and _CONFIRM_RE.match(cleaned) and _CONFIRM_WORD_RE.search(cleaned):
+        _count("intent_hits")
+        return "2"
+    _count("intent_misses")
+    return None
@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Per-conversation message history, mirroring conversation_message. Loaded from MySQL
+# once per conversation, then kept current by transcript.append_messages (write-through),
+# so history reads for active conversations stay in memory. The TTL, counted from the
+# last load, bounds how long writes made by other worker processes can go unseen.
+class ConversationHistoryCache:
+    def __init__(self, load, max_conversations=10000, ttl=600):
+        self.load = load  # load(convo_id) -> [text, ...] oldest first
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # convo_id -> (loaded_at, [text, ...]), most recent last
+
+    def get(self, convo_id):
+        # Returns a copy of the conversation's messages, oldest first
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(convo_id)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(convo_id)
+                self.hits += 1
+                return list(entry[1])
+            self.misses += 1
+
+        # Turns of one conversation are serialized by the worker pool, so no write-through
+        # for this conversation can land between this read and the insert below
+        messages = list(self.load(convo_id))
+        with self._lock:
+            self._entries[convo_id] = (now, messages)
+            self._entries.move_to_end(convo_id)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+        return list(messages)
+
+    def messages(self, convo_id, last_n=None):
+        messages = self.get(convo_id)
+        return messages[-last_n:] if last_n else messages
+
+    def append(self, convo_id, texts):
+        # Write-through after a committed insert. Conversations that are not cached are
+        # left alone and loaded on the next read.
+        with self._lock:
+            entry = self._entries.get(convo_id)
+            if entry is None:
+                return
+            # The load time is kept: the TTL counts from the last DB read, since only a
+            # read picks up what other workers wrote
+            entry[1].extend(texts)
+            self._entries.move_to_end(convo_id)
+            self.writes += 1
+
+    def invalidate(self, convo_id=None):
+        with self._lock:
+            if convo_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(convo_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "conversations": len(self._entries),
+                "messages": sum(len(messages) for _, messages in self._entries.values()),
+            }
@@ -0,0 +1,83 @@
+import logging
+
+import faiss
+import numpy as np
+
+from metrics import get_logger, log_event
+
+log = get_logger("index")
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "opq_ivf_pq")
+METRICS = ("l2", "ip", "cosine")
+
+# faiss warns below ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def default_nlist(n):
+    return int(np.clip(4 * np.sqrt(max(n, 1)), 1, 65536))
+
+
+def index_spec(kind, nlist, pq_m=64, hnsw_m=32):
+    if kind == "flat":
+        return "Flat"
+    if kind == "hnsw":
+        return f"HNSW{hnsw_m}"
+    if kind == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if kind == "ivf_pq":
+        return f"IVF{nlist},PQ{pq_m}"
+    if kind == "opq_ivf_pq":
+        return f"OPQ{pq_m},IVF{nlist},PQ{pq_m}"
+    raise ValueError(f"Unknown index type {kind!r}, expected one of {INDEX_TYPES}")
+
+
+def metric_type(metric):
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+    return faiss.METRIC_L2 if metric == "l2" else faiss.METRIC_INNER_PRODUCT
+
+
+def build_index(kind, dim, metric="l2", vectors=None, nlist=0, pq_m=64, hnsw_m=32, ef_construction=200):
+    # Returns a trained IndexIDMap2 keyed by knowledge id. IVF variants are trained on
+    # `vectors` and fall back to Flat when there are too few of them.
+    n = 0 if vectors is None else len(vectors)
+    if kind in ("ivf_flat", "ivf_pq", "opq_ivf_pq"):
+        nlist = nlist or default_nlist(n)
+        if n < max(nlist * MIN_POINTS_PER_CENTROID, 256):
+            log_event(log, logging.WARNING, "index_fallback_flat", rows=n, kind=kind, nlist=nlist)
+            kind = "flat"
+
+    index = faiss.index_factory(dim, index_spec(kind, nlist, pq_m, hnsw_m), metric_type(metric))
+    if kind == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = ef_construction
+
+    index = faiss.IndexIDMap2(index)
+    if not index.is_trained:
+        index.train(vectors)
+    return index
+
+
+def index_kind(index):
+    index = faiss.downcast_index(index)
+    while isinstance(index, (faiss.IndexIDMap, faiss.IndexPreTransform)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def search_params(index, selector=None, nprobe=16, ef_search=64):
+    # IVF/HNSW read nprobe/efSearch from the params object whenever one is passed,
+    # so the params type has to match the index
+    kind = index_kind(index)
+    extra = {"sel": selector} if selector is not None else {}
+    if kind == "ivf":
+        return faiss.SearchParametersIVF(nprobe=nprobe, **extra)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search, **extra)
+    if selector is not None:
+        return faiss.SearchParameters(**extra)
+    return None
@@ -0,0 +1,141 @@
+import fcntl
+import json
+import os
+import struct
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+from vector_codec import encode_vector, decode_vector
+
+# Delta log record: id i64 | text_len u32 | vec_len u32 | text (utf-8) | encoded vector
+_RECORD = struct.Struct("<qII")
+
+
+# On-disk snapshot of the vector index shared by every worker process.
+#
+#   meta.json           current generation
+#   index-<g>.faiss     FAISS index, opened with mmap so workers share the page cache
+#   ids-<g>.npy         knowledge ids aligned with the index rows
+#   texts-<g>.json      knowledge contents aligned with the index rows
+#   delta-<g>.log       vectors appended since snapshot <g> was written
+#
+# Appends and compactions serialize on an flock; readers only need the meta file.
+class IndexStore:
+    def __init__(self, directory, mmap=True):
+        self.directory = directory
+        self.mmap = mmap
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def lock(self, blocking=True):
+        with open(self._path(".lock"), "a") as f:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(f, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def generation(self):
+        try:
+            with open(self._path("meta.json")) as f:
+                return json.load(f)["generation"]
+        except FileNotFoundError:
+            return None
+
+    def load_snapshot(self):
+        generation = self.generation()
+        if generation is None:
+            return None
+
+        path = self._path(f"index-{generation}.faiss")
+        if self.mmap:
+            try:
+                index = faiss.read_index(path, faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0))
+            except RuntimeError:
+                # IVF inverted lists can't be mapped with IO_FLAG_MMAP_IFC ("mmap only supported
+                # for File objects"); plain IO_FLAG_MMAP still maps them
+                index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+        else:
+            index = faiss.read_index(path)
+        ids = np.load(self._path(f"ids-{generation}.npy")).tolist()
+        with open(self._path(f"texts-{generation}.json"), encoding="utf-8") as f:
+            texts = json.load(f)
+        return generation, index, ids, texts
+
+    def read_index(self, generation):
+        # A private in-memory copy of a snapshot's index. Mapped indexes can't be cloned
+        # (faiss asserts the storage is owned, IVF lists refuse) or added to.
+        return faiss.read_index(self._path(f"index-{generation}.faiss"))
+
+    def write_snapshot(self, index, ids, texts):
+        # Caller must hold lock(). Files are written first and meta.json is swapped in
+        # last, so readers either see the old generation or a complete new one.
+        previous = self.generation()
+        generation = (previous or 0) + 1
+
+        tmp = self._path(f"index-{generation}.faiss.tmp")
+        faiss.write_index(index, tmp)
+        os.replace(tmp, self._path(f"index-{generation}.faiss"))
+
+        np.save(self._path(f"ids-{generation}.npy"), np.asarray(ids, dtype=np.int64))
+        with open(self._path(f"texts-{generation}.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(texts, f, ensure_ascii=False)
+        os.replace(self._path(f"texts-{generation}.json.tmp"), self._path(f"texts-{generation}.json"))
+        open(self._path(f"delta-{generation}.log"), "ab").close()
+
+        with open(self._path("meta.json.tmp"), "w") as f:
+            json.dump({"generation": generation, "count": len(texts)}, f)
+        os.replace(self._path("meta.json.tmp"), self._path("meta.json"))
+
+        # Workers that still map the old files keep their open handles until they reload
+        if previous is not None:
+            for name in (f"index-{previous}.faiss", f"ids-{previous}.npy", f"texts-{previous}.json", f"delta-{previous}.log"):
+                try:
+                    os.remove(self._path(name))
+                except FileNotFoundError:
+                    pass
+        return generation
+
+    def append_delta(self, id, text, vec):
+        text_bytes = text.encode("utf-8")
+        vec_bytes = encode_vector(vec, "float32")
+        record = _RECORD.pack(id, len(text_bytes), len(vec_bytes)) + text_bytes + vec_bytes
+        with self.lock():
+            generation = self.generation()
+            with open(self._path(f"delta-{generation}.log"), "ab") as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+        return generation
+
+    def read_delta(self, generation, offset=0):
+        try:
+            with open(self._path(f"delta-{generation}.log"), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+
+        records = []
+        pos = 0
+        while pos + _RECORD.size <= len(data):
+            id, text_len, vec_len = _RECORD.unpack_from(data, pos)
+            end = pos + _RECORD.size + text_len + vec_len
+            if end > len(data):
+                break  # Partially written record, picked up on the next read
+            text_start = pos + _RECORD.size
+            text = data[text_start:text_start + text_len].decode("utf-8")
+            vec = decode_vector(data[text_start + text_len:end]).copy()
+            records.append((id, text, vec))
+            pos = end
+        return records, offset + pos
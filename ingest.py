@@ -0,0 +1,349 @@
+import argparse
+import csv
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import openai
+
+from index_store import IndexStore
+from prompt_builder import count_tokens
+from rag import (
+    RAG, connect_db, embedding_cache, mark_curated,
+    EMBEDDING_MODEL, EMBEDDING_STORAGE_DTYPE, EMBEDDING_MAX_TOKENS_PER_REQUEST, RAG_INDEX_DIR,
+)
+from text_utils import content_hash, normalize_text
+from vector_codec import encode_vector
+
+# Bulk knowledge ingestion: files -> chunks -> dedup -> parallel batched embeddings ->
+# executemany into knowledge -> one FAISS build. Progress is checkpointed after every
+# committed window, and embeddings go through the shared embedding cache, so an
+# interrupted run resumes without re-embedding.
+#   python ingest.py catalog.csv faq.jsonl --fields name description --workers 8
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+# ------------------- Readers -------------------
+def _record_text(record, fields):
+    if fields:
+        values = [str(record.get(f) or "").strip() for f in fields]
+        return "\n".join(v for v in values if v)
+    return "\n".join(f"{k}: {v}" for k, v in record.items() if v not in (None, ""))
+
+
+def read_documents(path, fmt="auto", fields=None):
+    # Yields one text per document: a blank-line separated block (txt), a row (csv) or a line (jsonl)
+    if fmt == "auto":
+        fmt = os.path.splitext(path)[1].lstrip(".").lower()
+        fmt = fmt if fmt in ("csv", "jsonl") else "txt"
+
+    with open(path, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                yield _record_text(row, fields)
+        elif fmt == "jsonl":
+            for line in f:
+                if line.strip():
+                    yield _record_text(json.loads(line), fields)
+        else:
+            block = []
+            for line in f:
+                if line.strip():
+                    block.append(line.rstrip("\n"))
+                elif block:
+                    yield "\n".join(block)
+                    block = []
+            if block:
+                yield "\n".join(block)
+
+
+def chunk_text(text, max_tokens=400, overlap=1):
+    # Packs whole sentences up to max_tokens; the last `overlap` sentences repeat in the next chunk
+    sentences = [s.strip() for s in _SENTENCE_RE.split(text) if s.strip()]
+    chunks, current, tokens = [], [], 0
+    for sentence in sentences:
+        n = count_tokens(sentence)
+        if current and tokens + n > max_tokens:
+            chunks.append(" ".join(current))
+            current = current[-overlap:] if overlap else []
+            tokens = sum(count_tokens(s) for s in current)
+        current.append(sentence)
+        tokens += n
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+# ------------------- Rate-limit-aware embedding -------------------
+class AdaptiveLimiter:
+    # AIMD concurrency: halved on a 429, raised by one after `limit` successful requests in a row
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, rate_limited=False):
+        with self._cond:
+            self.active -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+def _retry_after(error, attempt):
+    header = getattr(getattr(error, "response", None), "headers", {}).get("retry-after")
+    try:
+        return float(header)
+    except (TypeError, ValueError):
+        return min(60.0, 2 ** attempt)
+
+
+def embed_batch(client, texts, limiter, max_attempts=8):
+    # Returns (vectors, tokens); 429s shrink the concurrency, other transient errors just back off
+    for attempt in range(max_attempts):
+        limiter.acquire()
+        try:
+            response = client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+        except openai.RateLimitError as e:
+            limiter.release(rate_limited=True)
+            time.sleep(_retry_after(e, attempt))
+            continue
+        except (openai.APIConnectionError, openai.InternalServerError) as e:
+            limiter.release()
+            if attempt == max_attempts - 1:
+                raise
+            time.sleep(_retry_after(e, attempt))
+            continue
+        limiter.release()
+        vectors = [np.array(d.embedding, dtype=np.float32) for d in sorted(response.data, key=lambda d: d.index)]
+        return vectors, response.usage.total_tokens
+    raise RuntimeError(f"Embedding batch still rate limited after {max_attempts} attempts")
+
+
+def _request_batches(texts, batch_size):
+    batch, tokens = [], 0
+    for text in texts:
+        n = count_tokens(text)
+        if batch and (len(batch) >= batch_size or tokens + n > EMBEDDING_MAX_TOKENS_PER_REQUEST):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(text)
+        tokens += n
+    if batch:
+        yield batch
+
+
+# ------------------- Checkpoint -------------------
+class Checkpoint:
+    # {file key: chunks committed}; a file key changes when the file or the chunking does
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = json.load(f)
+
+    @staticmethod
+    def key(path, args):
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}|{stat.st_size}|{int(stat.st_mtime)}|{args.chunk_tokens}|{args.chunk_overlap}"
+
+    def save(self, key, chunks_done):
+        self.done[key] = chunks_done
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.done, f)
+        os.replace(tmp, self.path)
+
+
+# ------------------- Ingestion -------------------
+def _existing_hashes(cursor, hashes):
+    found = set()
+    hashes = list(hashes)
+    for i in range(0, len(hashes), 1000):
+        part = hashes[i:i + 1000]
+        placeholders = ", ".join(["%s"] * len(part))
+        cursor.execute(f"SELECT content_hash FROM knowledge WHERE content_hash IN ({placeholders})", tuple(part))
+        found.update(row[0] for row in cursor.fetchall())
+    return found
+
+
+class Ingestor:
+    def __init__(self, args):
+        self.args = args
+        self.client = openai.OpenAI(max_retries=0)  # retries and backoff are handled by embed_batch
+        self.limiter = AdaptiveLimiter(args.workers)
+        self.executor = ThreadPoolExecutor(max_workers=args.workers)
+        self.stats = {"documents": 0, "chunks": 0, "duplicates": 0, "inserted": 0, "cached": 0, "tokens": 0}
+        self.started = time.perf_counter()
+
+    def embed(self, texts):
+        # Cached embeddings (an earlier run, or the bot itself) are reused; the rest go out as
+        # parallel rate-limited requests and are written to the cache as they come back
+        vectors = {t: embedding_cache.get(EMBEDDING_MODEL, t) for t in texts}
+        missing = [t for t, vec in vectors.items() if vec is None]
+        self.stats["cached"] += len(texts) - len(missing)
+        batches = list(_request_batches(missing, self.args.batch_size))
+        results = self.executor.map(lambda b: embed_batch(self.client, b, self.limiter), batches)
+        for batch, (vecs, tokens) in zip(batches, results):
+            self.stats["tokens"] += tokens
+            for text, vec in zip(batch, vecs):
+                vectors[text] = embedding_cache.put(EMBEDDING_MODEL, text, vec)
+        return [vectors[t] for t in texts]
+
+    def ingest_window(self, chunks):
+        # Dedup against the table, embed with no connection held, then one short
+        # transaction for the executemany
+        unique = list({content_hash(c): c for c in chunks}.values())
+        db = connect_db()
+        cursor = db.cursor()
+        try:
+            existing = _existing_hashes(cursor, (content_hash(c) for c in unique))
+            mark_curated(cursor, existing)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+            db.close()
+        new = [c for c in unique if content_hash(c) not in existing]
+        self.stats["duplicates"] += len(chunks) - len(new)
+        if not new:
+            return
+
+        rows = [
+            (text, content_hash(text), encode_vector(vec, EMBEDDING_STORAGE_DTYPE))
+            for text, vec in zip(new, self.embed(new))
+        ]
+        db = connect_db()
+        cursor = db.cursor()
+        try:
+            # Rows another writer added since the dedup query are left as they are
+            cursor.executemany(
+                "INSERT INTO knowledge (content, content_hash, embedding) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE id = id",
+                rows
+            )
+            db.commit()
+            self.stats["inserted"] += len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+            db.close()
+
+    def ingest_file(self, path, checkpoint):
+        key = Checkpoint.key(path, self.args)
+        skip = checkpoint.done.get(key, 0)
+        if skip:
+            print(f"[Ingest] {path}: resuming after {skip} committed chunks")
+
+        position, window = 0, []
+        for document in read_documents(path, self.args.format, self.args.fields):
+            chunks = chunk_text(document, self.args.chunk_tokens, self.args.chunk_overlap)
+            if position + len(chunks) > skip:
+                self.stats["documents"] += 1  # documents already committed before a resume are not counted
+            for chunk in chunks:
+                position += 1
+                chunk = normalize_text(chunk)
+                if position <= skip or not chunk:
+                    continue
+                window.append(chunk)
+                if len(window) >= self.args.window:
+                    self._commit_window(window, key, position, checkpoint)
+                    window = []
+        if window:
+            self._commit_window(window, key, position, checkpoint)
+
+    def _commit_window(self, window, key, position, checkpoint):
+        self.ingest_window(window)
+        self.stats["chunks"] += len(window)
+        checkpoint.save(key, position)
+        self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        s = self.stats
+        print(f"[Ingest] {'Done' if final else 'Progress'}: {s['documents']} docs, {s['chunks']} chunks "
+              f"({s['inserted']} new, {s['duplicates']} duplicates, {s['cached']} embeddings cached) in {elapsed:.1f}s - "
+              f"{s['documents'] / elapsed:.1f} docs/s, {s['chunks'] / elapsed:.1f} chunks/s, "
+              f"{s['tokens'] / elapsed:.0f} tokens/s, concurrency {self.limiter.limit}/{self.limiter.max_concurrency}")
+
+
+def publish_index():
+    # Build the index from the whole table in one pass and publish it as a new snapshot;
+    # running workers switch to it on their next refresh
+    if not RAG_INDEX_DIR:
+        print("[Ingest] RAG_INDEX_DIR is not set, workers will build the index from MySQL on startup")
+        return
+    store = IndexStore(RAG_INDEX_DIR)
+    rag = RAG(store=store)
+    # Built without the store lock so workers keep appending meanwhile; what they appended
+    # is folded in under the lock, right before the new snapshot replaces their delta log
+    generation = store.generation()
+    stats = rag.load_from_db()
+    with store.lock():
+        if store.generation() != generation:
+            # Another snapshot was published during the build and rows appended before it
+            # are no longer in any log we can read: rebuild, this time holding the lock
+            stats = rag.load_from_db()
+            appended = 0
+        else:
+            appended = rag.add_records(store.read_delta(generation)[0])
+        generation = store.write_snapshot(rag.index, list(rag.texts), list(rag.texts.values()))
+    print(f"[Ingest] Indexed {stats['rows']} rows in {stats['seconds']:.1f}s (+{appended} appended during the build), "
+          f"published generation {generation}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest knowledge from txt / CSV / JSONL files")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--format", choices=["auto", "txt", "csv", "jsonl"], default="auto")
+    parser.add_argument("--fields", nargs="+", help="CSV columns / JSON keys to ingest (default: all as 'key: value')")
+    parser.add_argument("--chunk-tokens", type=int, default=400)
+    parser.add_argument("--chunk-overlap", type=int, default=1, help="sentences repeated between chunks")
+    parser.add_argument("--batch-size", type=int, default=256, help="texts per embedding request")
+    parser.add_argument("--workers", type=int, default=4, help="max concurrent embedding requests")
+    parser.add_argument("--window", type=int, default=1000, help="chunks per DB transaction and checkpoint")
+    parser.add_argument("--checkpoint", default="ingest.checkpoint.json")
+    parser.add_argument("--no-index", action="store_true", help="skip publishing a new index snapshot")
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    ingestor = Ingestor(args)
+    try:
+        for path in args.paths:
+            ingestor.ingest_file(path, checkpoint)
+    finally:
+        ingestor.executor.shutdown()
+    ingestor.report(final=True)
+
+    if not args.no_index:
+        publish_index()
+
+
+if __name__ == '__main__':
+    main()
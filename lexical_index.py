@@ -0,0 +1,156 @@
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from rwlock import ReadWriteLock
+from text_utils import fold_diacritics
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text, ngram=3):
+    # Vietnamese is written one syllable per word, so terms are the folded syllables,
+    # syllable bigrams ("xanh_com") for compounds and char n-grams ("#ch", "cho", "ho#")
+    # so that typos and missing tones still share most of their terms
+    words = _WORD_RE.findall(fold_diacritics(text))
+    terms = [("w", w) for w in words]
+    terms += [("b", f"{a}_{b}") for a, b in zip(words, words[1:])]
+    if ngram:
+        for w in words:
+            padded = f"#{w}#"
+            terms += [("c", padded[i:i + ngram]) for i in range(max(1, len(padded) - ngram + 1))]
+    return terms
+
+
+# Okapi BM25 over the terms produced by tokenize, keyed by knowledge id. Documents can
+# be added at any time; each term's postings are turned into numpy arrays on first use
+# after a change, so scoring a query is a handful of vectorized updates.
+class LexicalIndex:
+    def __init__(self, k1=1.2, b=0.75, ngram=3, weights=None):
+        self.k1 = k1
+        self.b = b
+        self.ngram = ngram
+        # Char n-grams are many and weak, so they count for less than whole words
+        self.weights = weights or {"w": 1.0, "b": 1.0, "c": 0.3}
+
+        self.lock = ReadWriteLock()
+        self._ids = []  # position -> knowledge id
+        self._positions = {}  # knowledge id -> position
+        self._lengths = []
+        self._lengths_array = None
+        self._total_length = 0
+        self._postings = {}  # term -> ([positions], [term frequencies])
+        self._arrays = {}  # term -> (positions, tfs) as numpy arrays, rebuilt after the term changes
+        self._arrays_lock = threading.Lock()
+
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def build(self, items):
+        # Replaces the whole index with [(knowledge_id, text), ...]
+        fresh = LexicalIndex(self.k1, self.b, self.ngram, self.weights)
+        for doc_id, text in items:
+            fresh._add(doc_id, text)
+        with self.lock.write():
+            self._ids, self._positions = fresh._ids, fresh._positions
+            self._lengths, self._total_length = fresh._lengths, fresh._total_length
+            self._postings, self._arrays, self._lengths_array = fresh._postings, {}, None
+
+    def add(self, doc_id, text):
+        with self.lock.write():
+            self._add(doc_id, text)
+
+    def _add(self, doc_id, text):
+        if doc_id in self._positions:
+            return
+        position = len(self._ids)
+        terms = Counter(tokenize(text, self.ngram))
+        self._ids.append(doc_id)
+        self._positions[doc_id] = position
+        length = sum(terms.values())
+        self._lengths.append(length)
+        self._lengths_array = None
+        self._total_length += length
+        for term, tf in terms.items():
+            positions, tfs = self._postings.setdefault(term, ([], []))
+            positions.append(position)
+            tfs.append(tf)
+            self._arrays.pop(term, None)
+
+    def search(self, query, k=5, allowed=None):
+        # [(knowledge_id, score)] best first; `allowed` restricts the hits to a set of ids
+        started = time.perf_counter()
+        query_terms = Counter(tokenize(query, self.ngram))
+        with self.lock.read():
+            n = len(self._ids)
+            if not n or not query_terms:
+                return []
+            lengths = self._lengths_array
+            if lengths is None:
+                lengths = np.asarray(self._lengths, dtype=np.float32)
+                with self._arrays_lock:
+                    self._lengths_array = lengths
+            norm = self.k1 * (1 - self.b + self.b * lengths / (self._total_length / n))
+            scores = np.zeros(n, dtype=np.float32)
+            for term, count in query_terms.items():
+                arrays = self._term_arrays(term)
+                if arrays is None:
+                    continue
+                positions, tfs = arrays
+                idf = math.log(1 + (n - len(positions) + 0.5) / (len(positions) + 0.5))
+                scores[positions] += self.weights[term[0]] * count * idf * tfs * (self.k1 + 1) / (tfs + norm[positions])
+
+            if allowed is not None:
+                mask = np.zeros(n, dtype=bool)
+                mask[[self._positions[i] for i in allowed if i in self._positions]] = True
+                scores[~mask] = 0
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+            candidates = candidates[np.argsort(-scores[candidates])]
+            hits = [(self._ids[p], float(scores[p])) for p in candidates]
+
+        elapsed = time.perf_counter() - started
+        with self._arrays_lock:
+            self.queries += 1
+            self.query_seconds += elapsed
+        return hits
+
+    def _term_arrays(self, term):
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self._postings.get(term)
+            if postings is None:
+                return None
+            arrays = (np.asarray(postings[0], dtype=np.int64), np.asarray(postings[1], dtype=np.float32))
+            with self._arrays_lock:
+                self._arrays[term] = arrays
+        return arrays
+
+    def stats(self):
+        with self.lock.read():
+            documents, terms = len(self._ids), len(self._postings)
+        return {
+            "documents": documents,
+            "terms": terms,
+            "queries": self.queries,
+            "avg_query_ms": 1000 * self.query_seconds / self.queries if self.queries else 0.0,
+        }
+
+
+def reciprocal_rank_fusion(rankings, k=5, rrf_k=60):
+    # rankings: lists of (label, anything) ordered best first. Returns the top k labels
+    # as [(label, -score)], so lower is better like a distance.
+    scores = {}
+    for ranking in rankings:
+        for rank, (label, _) in enumerate(ranking):
+            scores[label] = scores.get(label, 0.0) + 1.0 / (rrf_k + rank + 1)
+    fused = sorted(scores.items(), key=lambda x: -x[1])[:k]
+    return [(label, -score) for label, score in fused]
@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Share of DEBUG events (full prompts, raw model output) that are actually written
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "stage_seconds": ("histogram", "Latency of one pipeline stage"),
+    "stage_errors_total": ("counter", "Exceptions raised inside a pipeline stage"),
+    "llm_tokens_total": ("counter", "Tokens reported by the OpenAI API"),
+}
+
+
+# ------------------- Metrics -------------------
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._sources = {}  # prefix -> callable returning a dict of numbers
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def register_source(self, prefix, stats_fn):
+        # stats_fn() is called on every scrape; its numeric values become gauges
+        self._sources[prefix] = stats_fn
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(hist) for key, hist in self._histograms.items()}
+
+        described = set()
+
+        def describe(name):
+            if name not in described and name in HELP:
+                kind, text = HELP[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+            described.add(name)
+
+        for (name, labels), value in sorted(counters.items()):
+            describe(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for (name, labels), hist in sorted(histograms.items()):
+            describe(name)
+            for bound, count in zip(self.buckets, hist):
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {hist[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {hist[-2]}")
+            lines.append(f"{name}_count{_labels(labels)} {hist[-1]}")
+
+        for prefix, stats_fn in sorted(self._sources.items()):
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                log_event(logger, logging.WARNING, "metrics_source_failed", source=prefix, error=repr(e))
+                continue
+            for key, value in sorted(stats.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{str(v)}"' for k, v in labels)
+    return "{" + body + "}"
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def span(stage, **labels):
+    # Times the block into stage_seconds{stage=...}; exceptions are counted and re-raised
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.inc("stage_errors_total", stage=stage, **labels)
+        raise
+    finally:
+        registry.observe("stage_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+
+def traced(stage, **labels):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_usage(call, usage):
+    # usage is the `usage` object of an OpenAI response (None when the API did not report it)
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if value:
+            registry.inc("llm_tokens_total", value, call=call, kind=kind.split("_")[0])
+
+
+# ------------------- Logging -------------------
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def get_logger(name):
+    global _configured
+    if not _configured:
+        with _configure_lock:
+            if not _configured:
+                handler = logging.StreamHandler()
+                handler.setFormatter(_JsonFormatter())
+                root = logging.getLogger("chatbot")
+                root.addHandler(handler)
+                root.setLevel(LOG_LEVEL.upper())
+                root.propagate = False
+                _configured = True
+    return logging.getLogger(f"chatbot.{name}")
+
+
+def log_event(log, level, event, **fields):
+    if log.isEnabledFor(level):
+        log.log(level, event, extra={"fields": fields})
+
+
+def log_debug(log, event, **fields):
+    # DEBUG events carry whole prompts and model outputs, so only a sample is written;
+    # the level check comes first so nothing is formatted when DEBUG is off
+    if log.isEnabledFor(logging.DEBUG) and random.random() < LOG_DEBUG_SAMPLE_RATE:
+        log.debug(event, extra={"fields": fields})
+
+
+logger = get_logger("metrics")
@@ -0,0 +1,263 @@
+import argparse
+import pickle
+
+from rag import connect_db, EMBEDDING_STORAGE_DTYPE
+from text_utils import content_hash
+from vector_codec import DTYPES, encode_vector, is_legacy_pickle
+
+
+# ------------------- Embeddings: pickle -> vector_codec -------------------
+def migrate_embeddings(dtype=EMBEDDING_STORAGE_DTYPE, batch_size=1000):
+    db = connect_db()
+    read_cursor = db.cursor()
+    write_cursor = db.cursor()
+
+    last_id = 0
+    converted = 0
+    while True:
+        read_cursor.execute(
+            "SELECT id, embedding FROM knowledge WHERE id > %s ORDER BY id LIMIT %s",
+            (last_id, batch_size)
+        )
+        rows = read_cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        # Only rows written by the old code are unpickled; this is trusted data from our own DB
+        updates = [
+            (encode_vector(pickle.loads(blob), dtype), id)
+            for id, blob in rows if is_legacy_pickle(blob)
+        ]
+        if updates:
+            write_cursor.executemany("UPDATE knowledge SET embedding = %s WHERE id = %s", updates)
+            db.commit()
+            converted += len(updates)
+            print(f"[Migrate] Converted {converted} embeddings (up to id={last_id})")
+
+    read_cursor.close()
+    write_cursor.close()
+    db.close()
+    print(f"[Migrate] Done, {converted} embeddings converted to {dtype}")
+
+
+# ------------------- conversation_link: unique (conversation_id, knowledge_id) -------------------
+def migrate_link_unique():
+    # store_and_link_many relies on this key for INSERT ... ON DUPLICATE KEY
+    db = connect_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        DELETE cl FROM conversation_link cl
+        JOIN conversation_link keep
+          ON keep.conversation_id = cl.conversation_id
+         AND keep.knowledge_id = cl.knowledge_id
+         AND keep.id < cl.id
+    """)
+    print(f"[Migrate] Removed {cursor.rowcount} duplicate links")
+    cursor.execute("ALTER TABLE conversation_link ADD UNIQUE KEY uq_conversation_link (conversation_id, knowledge_id)")
+    db.commit()
+    cursor.close()
+    db.close()
+    print("[Migrate] Added uq_conversation_link")
+
+
+# ------------------- knowledge: content_hash column -------------------
+def migrate_content_hash(batch_size=1000):
+    db = connect_db()
+    read_cursor = db.cursor()
+    write_cursor = db.cursor()
+
+    read_cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'knowledge' AND column_name = 'content_hash'
+    """)
+    if not read_cursor.fetchone()[0]:
+        write_cursor.execute("ALTER TABLE knowledge ADD COLUMN content_hash CHAR(40) NULL AFTER content")
+        print("[Migrate] Added knowledge.content_hash")
+
+    # Backfill, remembering the first (lowest) id seen for every hash
+    first_id = {}
+    duplicates = []
+    last_id = 0
+    while True:
+        read_cursor.execute(
+            "SELECT id, content FROM knowledge WHERE id > %s ORDER BY id LIMIT %s",
+            (last_id, batch_size)
+        )
+        rows = read_cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        updates = []
+        for id, content in rows:
+            digest = content_hash(content)
+            if digest in first_id:
+                duplicates.append((id, first_id[digest]))
+            else:
+                first_id[digest] = id
+                updates.append((digest, id))
+        write_cursor.executemany("UPDATE knowledge SET content_hash = %s WHERE id = %s", updates)
+        db.commit()
+        print(f"[Migrate] Hashed knowledge up to id={last_id}")
+
+    # Point links at the surviving row, then drop the duplicates
+    for duplicate_id, keep_id in duplicates:
+        write_cursor.execute(
+            "UPDATE IGNORE conversation_link SET knowledge_id = %s WHERE knowledge_id = %s",
+            (keep_id, duplicate_id)
+        )
+        write_cursor.execute("DELETE FROM conversation_link WHERE knowledge_id = %s", (duplicate_id,))
+        write_cursor.execute("DELETE FROM knowledge WHERE id = %s", (duplicate_id,))
+    db.commit()
+    print(f"[Migrate] Merged {len(duplicates)} duplicate knowledge rows")
+
+    write_cursor.execute("ALTER TABLE knowledge MODIFY content_hash CHAR(40) NOT NULL")
+    write_cursor.execute("ALTER TABLE knowledge ADD UNIQUE KEY uq_knowledge_content_hash (content_hash)")
+    db.commit()
+    read_cursor.close()
+    write_cursor.close()
+    db.close()
+    print("[Migrate] Added uq_knowledge_content_hash")
+    if duplicates:
+        print("[Migrate] Delete RAG_INDEX_DIR so the index snapshot is rebuilt without the merged rows")
+
+
+# ------------------- conversation_state table -------------------
+def migrate_conversation_state():
+    db = connect_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            conversation_id VARCHAR(64) PRIMARY KEY,
+            state JSON NOT NULL,
+            turns INT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+    db.commit()
+    cursor.close()
+    db.close()
+    print("[Migrate] conversation_state is ready")
+
+
+# ------------------- conversation_message table -------------------
+def migrate_transcripts(batch_size=5000):
+    # Creates the transcript table and copies the old history (conversation_link JOIN
+    # knowledge, in link order) into it. The chat rows stay in knowledge until
+    # `python transcript.py compact` drops them (see knowledge-origin) and rebuilds the index.
+    db = connect_db()
+    read_cursor = db.cursor()
+    write_cursor = db.cursor()
+    write_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_message (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            conversation_id VARCHAR(64) NOT NULL,
+            from_source VARCHAR(16) NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            KEY ix_conversation_message_history (conversation_id, id),
+            KEY ix_conversation_message_created (created_at)
+        )
+    """)
+    db.commit()
+
+    read_cursor.execute("SELECT COUNT(*) FROM conversation_message")
+    if read_cursor.fetchone()[0]:
+        print("[Migrate] conversation_message already has rows, skipping the backfill")
+    else:
+        last_id = 0
+        copied = 0
+        while True:
+            read_cursor.execute("""
+                SELECT cl.id, cl.conversation_id, cl.from_source, k.content
+                FROM conversation_link cl
+                JOIN knowledge k ON cl.knowledge_id = k.id
+                WHERE cl.id > %s
+                ORDER BY cl.id
+                LIMIT %s
+            """, (last_id, batch_size))
+            rows = read_cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            write_cursor.executemany(
+                "INSERT INTO conversation_message (conversation_id, from_source, content) VALUES (%s, %s, %s)",
+                [row[1:] for row in rows]
+            )
+            db.commit()
+            copied += len(rows)
+            print(f"[Migrate] Copied {copied} messages (up to link id={last_id})")
+        print(f"[Migrate] Done, {copied} messages copied to conversation_message")
+
+    read_cursor.close()
+    write_cursor.close()
+    db.close()
+
+
+# ------------------- knowledge: origin column -------------------
+def migrate_knowledge_origin(linked_as_chat=False):
+    # transcript.py compaction only deletes rows with origin 'chat'. Existing rows default
+    # to 'curated'; --linked-as-chat marks every row linked to a conversation as chat,
+    # which is only right if no curated text was ever linked (see `transcript.py compact`).
+    db = connect_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'knowledge' AND column_name = 'origin'
+    """)
+    if cursor.fetchone()[0]:
+        print("[Migrate] knowledge.origin already exists")
+    else:
+        cursor.execute("ALTER TABLE knowledge ADD COLUMN origin VARCHAR(16) NOT NULL DEFAULT 'curated' AFTER embedding")
+        print("[Migrate] Added knowledge.origin")
+    if linked_as_chat:
+        cursor.execute("""
+            UPDATE knowledge k
+            JOIN (SELECT DISTINCT knowledge_id FROM conversation_link) cl ON cl.knowledge_id = k.id
+            SET k.origin = 'chat'
+        """)
+        print(f"[Migrate] Marked {cursor.rowcount} linked rows as chat")
+    db.commit()
+    cursor.close()
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Database migrations for the RAG chatbot")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    embeddings = commands.add_parser("embeddings", help="Convert pickled embeddings to the binary vector format")
+    embeddings.add_argument("--dtype", choices=sorted(DTYPES), default=EMBEDDING_STORAGE_DTYPE)
+    embeddings.add_argument("--batch-size", type=int, default=1000)
+
+    commands.add_parser("link-unique", help="Deduplicate conversation_link and add its unique key")
+
+    hashes = commands.add_parser("content-hash", help="Add knowledge.content_hash, merge duplicates and index it")
+    hashes.add_argument("--batch-size", type=int, default=1000)
+
+    commands.add_parser("conversation-state", help="Create the per-conversation order state table")
+
+    origin = commands.add_parser("knowledge-origin", help="Add knowledge.origin (curated | chat) used by compaction")
+    origin.add_argument("--linked-as-chat", action="store_true", help="mark rows linked to a conversation as chat")
+
+    transcripts = commands.add_parser("transcripts", help="Create conversation_message and copy the linked history into it")
+    transcripts.add_argument("--batch-size", type=int, default=5000)
+
+    args = parser.parse_args()
+    if args.command == "embeddings":
+        migrate_embeddings(args.dtype, args.batch_size)
+    elif args.command == "link-unique":
+        migrate_link_unique()
+    elif args.command == "content-hash":
+        migrate_content_hash(args.batch_size)
+    elif args.command == "conversation-state":
+        migrate_conversation_state()
+    elif args.command == "knowledge-origin":
+        migrate_knowledge_origin(args.linked_as_chat)
+    elif args.command == "transcripts":
+        migrate_transcripts(args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import os
+
+import openai
+
+from fast_path import extract_slots, apply_slots
+from prompt_builder import PromptTemplate, compact_json
+from metrics import span, traced, record_usage, get_logger, log_event
+from rag import connect_db, detect_missing_info, missing_info_request, read_missing_info, MISSING_INFO_COMPLETION
+
+# Below this self-reported confidence the incremental update is discarded and the
+# whole conversation is re-extracted with detect_missing_info
+ORDER_STATE_MIN_CONFIDENCE = float(os.getenv("ORDER_STATE_MIN_CONFIDENCE", "0.6"))
+# Force a full re-extraction every N turns to correct drift (0 = never)
+ORDER_STATE_FULL_EVERY = int(os.getenv("ORDER_STATE_FULL_EVERY", "0"))
+# Messages re-read after a low-confidence update; the stored state stands in for older ones
+ORDER_STATE_RECENT_MESSAGES = int(os.getenv("ORDER_STATE_RECENT_MESSAGES", "20"))
+
+CONFIDENCE_KEY = "độ tin cậy"
+
+log = get_logger("order_state")
+
+# ------------------- Persistence -------------------
+@traced("db_read", query="order_state")
+def load_order_state(convo_id):
+    db = connect_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT state, turns FROM conversation_state WHERE conversation_id = %s", (convo_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    db.close()
+    if not row:
+        return None, 0
+    return json.loads(row[0]), row[1]
+
+@traced("db_write", query="order_state")
+def save_order_state(convo_id, state, turns):
+    db = connect_db()
+    cursor = db.cursor()
+    cursor.execute(
+        "INSERT INTO conversation_state (conversation_id, state, turns) VALUES (%s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE state = VALUES(state), turns = VALUES(turns)",
+        (convo_id, json.dumps(state, ensure_ascii=False), turns)
+    )
+    db.commit()
+    cursor.close()
+    db.close()
+
+# ------------------- Incremental extraction -------------------
+INCREMENTAL_TEMPLATE = PromptTemplate("incremental_state", f"""
+Bạn là một trợ lý bán hàng. Dưới đây là thông tin đơn hàng đã ghi nhận (JSON) và tin nhắn mới nhất của khách.
+
+Hãy cập nhật thông tin đơn hàng dựa trên tin nhắn mới:
+- Giữ nguyên các giá trị cũ nếu tin nhắn mới không nhắc tới.
+- Nếu khách thay đổi thông tin (ví dụ đổi màu, đổi cỡ), ghi đè giá trị cũ.
+- Nếu khách đặt thêm đơn hàng, thêm vào danh sách "đơn hàng".
+- Thêm trường "{CONFIDENCE_KEY}" là số từ 0 đến 1, để thấp nếu tin nhắn mơ hồ hoặc không rõ thuộc đơn hàng nào.
+
+Trả về JSON cùng định dạng với thông tin đơn hàng hiện tại và trường "{CONFIDENCE_KEY}".
+
+""")
+
+def build_incremental_prompt(state, message):
+    return INCREMENTAL_TEMPLATE.render(
+        ("state", f"Thông tin đơn hàng hiện tại:\n{compact_json(state)}\n\n"),
+        ("message", f"Tin nhắn mới của khách:\n{message}\n"),
+    )
+
+def parse_incremental(result):
+    # Returns (state, confidence); confidence 0 when the output is unusable
+    try:
+        state = json.loads(result)
+    except json.JSONDecodeError:
+        log_event(log, logging.WARNING, "incremental_parse_failed", raw=result)
+        return None, 0.0
+    if not isinstance(state, dict):
+        return None, 0.0
+    try:
+        confidence = float(state.pop(CONFIDENCE_KEY, 0) or 0)
+    except (TypeError, ValueError):
+        confidence = 0.0
+    return state, confidence
+
+def _needs_full_extraction(state, turns):
+    return state is None or (ORDER_STATE_FULL_EVERY and turns % ORDER_STATE_FULL_EVERY == 0)
+
+def _history_window(state, full):
+    # Arguments for load_history: everything for a full re-extraction, otherwise the
+    # recent messages behind a summary of what was already extracted
+    if full or state is None:
+        return ()
+    return ORDER_STATE_RECENT_MESSAGES, f"Thông tin đơn hàng đã ghi nhận từ các tin nhắn trước: {compact_json(state)}"
+
+def _fast_update(state, message):
+    # "size 90", "màu hồng", "2 bộ", a phone number... filled locally without the LLM
+    slots = extract_slots(message)
+    return apply_slots(state, slots) if slots else None
+
+def _incremental_request(state, message):
+    return {"messages": [{"role": "user", "content": build_incremental_prompt(state, message)}], **MISSING_INFO_COMPLETION}
+
+def _read_incremental(convo_id, response):
+    # The updated state, or None when it is too unsure to keep and the conversation must be re-extracted
+    record_usage("incremental_state", response.usage)
+    new_state, confidence = parse_incremental(response.choices[0].message.content.strip())
+    if confidence < ORDER_STATE_MIN_CONFIDENCE:
+        log_event(log, logging.INFO, "low_confidence_reextract", convo_id=convo_id, confidence=confidence)
+        return None
+    return new_state
+
+def update_order_state(convo_id, message, load_history, before_save=None):
+    # load_history(last_n=None, summary=None) is only called when the state has to be re-extracted.
+    # before_save() may raise to keep the new state from being stored.
+    state, turns = load_order_state(convo_id)
+    turns += 1
+
+    full = _needs_full_extraction(state, turns)
+    new_state = None if full else _fast_update(state, message)
+
+    if new_state is None and not full:
+        with span("llm", call="incremental_state"):
+            response = openai.chat.completions.create(**_incremental_request(state, message))
+        new_state = _read_incremental(convo_id, response)
+
+    if new_state is None:
+        new_state = detect_missing_info(load_history(*_history_window(state, full)) + [message])
+
+    if before_save:
+        before_save()
+    save_order_state(convo_id, new_state, turns)
+    return new_state
+
+async def update_order_state_async(client, convo_id, message, load_history, before_save=None):
+    # Same steps as update_order_state; only the DB and LLM calls differ
+    state, turns = await asyncio.to_thread(load_order_state, convo_id)
+    turns += 1
+
+    full = _needs_full_extraction(state, turns)
+    new_state = None if full else _fast_update(state, message)
+
+    if new_state is None and not full:
+        with span("llm", call="incremental_state"):
+            response = await client.chat.completions.create(**_incremental_request(state, message))
+        new_state = _read_incremental(convo_id, response)
+
+    if new_state is None:
+        history = await asyncio.to_thread(load_history, *_history_window(state, full))
+        with span("llm", call="missing_info"):
+            response = await client.chat.completions.create(**missing_info_request(history + [message]))
+        new_state = read_missing_info(response)
+
+    if before_save:
+        before_save()
+    await asyncio.to_thread(save_order_state, convo_id, new_state, turns)
+    return new_state
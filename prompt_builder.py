@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+from functools import lru_cache
+
+from metrics import get_logger, log_event
+from text_utils import content_hash
+
+# Token budgets for the variable parts of a prompt
+PROMPT_CONTEXT_TOKEN_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKEN_BUDGET", "1500"))
+PROMPT_HISTORY_TOKEN_BUDGET = int(os.getenv("PROMPT_HISTORY_TOKEN_BUDGET", "6000"))
+
+log = get_logger("prompt")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")  # gpt-4.1 family
+except Exception:  # not installed, or the encoding file can't be downloaded: use a character estimate
+    _encoding = None
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # Rough upper bound for Vietnamese text with BPE tokenizers
+    return len(text) // 2 + 1
+
+
+def compact_json(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def fit_to_budget(texts, budget):
+    # texts are in relevance order: blank texts and duplicates are dropped, then whatever no longer fits
+    kept, seen, used = [], set(), 0
+    for text in texts:
+        if not text or not text.strip():
+            continue
+        key = content_hash(text)
+        if key in seen:
+            continue
+        seen.add(key)
+        n = count_tokens(text)
+        if used + n > budget:
+            continue
+        kept.append(text)
+        used += n
+    return kept
+
+
+def fit_tail_to_budget(lines, budget):
+    # Keeps the most recent lines of a transcript that fit, in their original order
+    kept, used = [], 0
+    for line in reversed(lines):
+        n = count_tokens(line)
+        if used + n > budget:
+            break
+        kept.append(line)
+        used += n
+    kept.reverse()
+    return kept
+
+
+class PromptTemplate:
+    """A prompt with a static prefix and per-turn sections appended after it.
+
+    The prefix is built once, so it is byte-identical across calls and can be served
+    from the provider's prompt cache; its token count is computed at import time.
+    """
+
+    def __init__(self, name, prefix):
+        self.name = name
+        self.prefix = prefix
+        self.prefix_tokens = count_tokens(prefix)
+
+    def render(self, *sections):
+        # sections: (name, text) pairs, appended in order
+        prompt = self.prefix + "".join(text for _, text in sections)
+        if log.isEnabledFor(logging.INFO):
+            counts = {f"{name}_tokens": count_tokens(text) for name, text in sections}
+            log_event(log, logging.INFO, "prompt_built", template=self.name, prefix_tokens=self.prefix_tokens, **counts)
+        return prompt
@@ -4,95 +4,293 @@ import openai
 import faiss
 import numpy as np
 import mysql.connector
-import pickle
+from mysql.connector import pooling
 import json
 import re
+import threading
+import time
+import logging
+from collections import OrderedDict
+from embedding_cache import EmbeddingCache
+from embedding_batcher import EmbeddingBatcher
+from rwlock import ReadWriteLock
+from text_utils import content_hash
+from fast_path import classify_intent
+from stream_json import JsonFieldStream
+from conversation import MUST_KNOW_CONTEXT
+from prompt_builder import (
+    PromptTemplate, compact_json, fit_to_budget, fit_tail_to_budget,
+    PROMPT_CONTEXT_TOKEN_BUDGET, PROMPT_HISTORY_TOKEN_BUDGET,
+)
+from vector_codec import encode_vector, decode_vector, is_legacy_pickle
+from index_store import IndexStore
+from index_factory import build_index, index_kind, search_params
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from metrics import span, traced, record_usage, get_logger, log_event, log_debug
 
 # Load .env file
 load_dotenv()
 
+log = get_logger("rag")
+
 # Use environment variables
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 EMBEDDING_MODEL = 'text-embedding-3-small'
+EMBEDDING_DIM = 1536
+
+# float32 | float16 | int8 — format used when writing the knowledge.embedding column
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+EMBEDDING_LOAD_BATCH_SIZE = int(os.getenv("EMBEDDING_LOAD_BATCH_SIZE", "5000"))
+
+# On-disk index snapshot shared by all workers (empty = rebuild from MySQL on every boot)
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", "index_snapshot")
+RAG_INDEX_COMPACT_THRESHOLD = int(os.getenv("RAG_INDEX_COMPACT_THRESHOLD", "1000"))
+RAG_INDEX_REFRESH_SECONDS = float(os.getenv("RAG_INDEX_REFRESH_SECONDS", "1"))
+
+# flat | hnsw | ivf_flat | ivf_pq | opq_ivf_pq, with l2 | ip | cosine metric
+RAG_INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "flat")
+RAG_INDEX_METRIC = os.getenv("RAG_INDEX_METRIC", "l2")
+RAG_IVF_NLIST = int(os.getenv("RAG_IVF_NLIST", "0"))  # 0 = 4 * sqrt(rows)
+RAG_PQ_M = int(os.getenv("RAG_PQ_M", "64"))
+RAG_HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+RAG_HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "200"))
+RAG_NPROBE = int(os.getenv("RAG_NPROBE", "16"))
+RAG_EF_SEARCH = int(os.getenv("RAG_EF_SEARCH", "64"))
+
+# vector (embedding + FAISS) | lexical (local BM25, no API call) | hybrid (both, fused with RRF)
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "vector")
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+RAG_FUSION_CANDIDATES = int(os.getenv("RAG_FUSION_CANDIDATES", "20"))  # hits taken from each side before fusing
+
+# Conversation-scoped search: cached knowledge id sets per conversation_id
+RAG_SCOPE_CACHE_SIZE = int(os.getenv("RAG_SCOPE_CACHE_SIZE", "10000"))
+RAG_SCOPE_TTL_SECONDS = float(os.getenv("RAG_SCOPE_TTL_SECONDS", "300"))
+RAG_SCOPED_BRUTE_FORCE_MAX = int(os.getenv("RAG_SCOPED_BRUTE_FORCE_MAX", "512"))
+
+# Set EMBEDDING_CACHE_PATH to an empty string to keep the cache in memory only
+embedding_cache = EmbeddingCache(
+    path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3"),
+    max_memory_items=int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "10000")),
+    max_disk_items=int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "500000")),
+)
+
+# OpenAI accepts up to 2048 inputs and ~300k tokens per embeddings request
+EMBEDDING_MAX_INPUTS_PER_REQUEST = int(os.getenv("EMBEDDING_MAX_INPUTS_PER_REQUEST", "2048"))
+EMBEDDING_MAX_TOKENS_PER_REQUEST = int(os.getenv("EMBEDDING_MAX_TOKENS_PER_REQUEST", "250000"))
+
+# ------------------- DB connection pool -------------------
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))  # mysql-connector caps pools at 32
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_RECONNECT_ATTEMPTS = int(os.getenv("DB_RECONNECT_ATTEMPTS", "3"))
+# Connections borrowed again within this many seconds skip the health check ping
+DB_PING_IDLE_SECONDS = float(os.getenv("DB_PING_IDLE_SECONDS", "30"))
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+_db_borrowed_at = {}  # id of the pooled connection -> monotonic time of its last borrow
+
+def get_db_pool():
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = pooling.MySQLConnectionPool(
+                    pool_name="rag",
+                    pool_size=DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    host=os.getenv("DB_HOST"),
+                    user=os.getenv("DB_USER"),
+                    password=os.getenv("DB_PASSWORD"),
+                    database=os.getenv("DB_NAME")
+                )
+    return _db_pool
 
 def connect_db():
-    return mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME")
-    )
+    # Borrow a pooled connection; db.close() returns it to the pool instead of disconnecting
+    deadline = time.monotonic() + DB_POOL_TIMEOUT
+    while True:
+        try:
+            db = get_db_pool().get_connection()
+            break
+        except mysql.connector.errors.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+
+    # Health check: reconnects connections the server dropped while they sat idle in the
+    # pool. A connection used moments ago is still alive, so it is spared the round trip.
+    key = id(getattr(db, "_cnx", db))  # the pool hands out a new wrapper around the same connection
+    now = time.monotonic()
+    if now - _db_borrowed_at.get(key, now) > DB_PING_IDLE_SECONDS:
+        try:
+            db.ping(reconnect=True, attempts=DB_RECONNECT_ATTEMPTS, delay=1)
+        except mysql.connector.Error:
+            db.close()
+            raise
+    _db_borrowed_at[key] = now
+    return db
+
+def _estimate_tokens(text):
+    # Rough upper bound for Vietnamese text with cl100k-style tokenizers
+    return len(text) // 2 + 1
+
+def _iter_request_batches(texts):
+    batch, tokens = [], 0
+    for text in texts:
+        n = _estimate_tokens(text)
+        if batch and (len(batch) >= EMBEDDING_MAX_INPUTS_PER_REQUEST or tokens + n > EMBEDDING_MAX_TOKENS_PER_REQUEST):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(text)
+        tokens += n
+    if batch:
+        yield batch
+
+def _embed_uncached(texts):
+    embeddings = []
+    for batch in _iter_request_batches(texts):
+        with span("embedding"):
+            response = openai.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=batch
+            )
+        record_usage("embedding", response.usage)
+        for item in sorted(response.data, key=lambda d: d.index):
+            embeddings.append(np.array(item.embedding, dtype=np.float32))
+    return [embedding_cache.put(EMBEDDING_MODEL, t, e) for t, e in zip(texts, embeddings)]
+
+# Single-text calls from concurrent webhook threads are coalesced into one request
+embedding_batcher = EmbeddingBatcher(
+    _embed_uncached,
+    window=float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "10")) / 1000,
+    max_batch=int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "256")),
+)
 
 def embed_text(text):
-    response = openai.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=text
-    )
-    return np.array(response.data[0].embedding, dtype=np.float32)
+    cached = embedding_cache.get(EMBEDDING_MODEL, text)
+    if cached is not None:
+        return cached
+    return embedding_batcher.embed(text)
+
+def embed_texts(texts):
+    results = [embedding_cache.get(EMBEDDING_MODEL, t) for t in texts]
+    missing = list(dict.fromkeys(t for t, r in zip(texts, results) if r is None))
+    if missing:
+        fresh = dict(zip(missing, _embed_uncached(missing)))
+        results = [r if r is not None else fresh[t] for t, r in zip(texts, results)]
+    return results
 
 # ------------------- Store / Load from DB -------------------
 def store_knowledge(content):
-    embedding = embed_text(content)
-    serialized = pickle.dumps(embedding)
-
+    # Check if already exists (before embedding, so duplicates cost no API call)
+    digest = content_hash(content)
     db = connect_db()
     cursor = db.cursor()
-
-    # Check if already exists
-    cursor.execute("SELECT id FROM knowledge WHERE content = %s", (content,))
-    if cursor.fetchone():
-        print(f"[Info] Already exists in DB: \"{content[:50]}...\"")
+    try:
+        cursor.execute("SELECT id FROM knowledge WHERE content_hash = %s", (digest,))
+        row = cursor.fetchone()
+        if row:
+            log_event(log, logging.DEBUG, "knowledge_exists", content=content[:50])
+            mark_curated(cursor, [digest])
+            db.commit()
+            return row[0]
+    finally:
         cursor.close()
         db.close()
-        return
-
-    cursor.execute("INSERT INTO knowledge (content, embedding) VALUES (%s, %s)", (content, serialized))
-    db.commit()
-    cursor.close()
-    db.close()
-    print(f"[Saved] \"{content[:50]}...\"")
 
-def load_all_embeddings():
+    # Embedded with no connection held, so a slow API call doesn't keep a pool slot
+    embedding = embed_text(content)
+    serialized = encode_vector(embedding, EMBEDDING_STORAGE_DTYPE)
     db = connect_db()
     cursor = db.cursor()
-    cursor.execute("SELECT id, content, embedding FROM knowledge")
-    rows = cursor.fetchall()
-    cursor.close()
-    db.close()
-
-    results = []
-    for row in rows:
-        id, content, emb_blob = row
-        embedding = pickle.loads(emb_blob)
-        results.append((id, content, embedding))
-    return results
+    try:
+        # LAST_INSERT_ID(id) makes lastrowid the existing row if another writer won the race
+        cursor.execute(
+            "INSERT INTO knowledge (content, content_hash, embedding) VALUES (%s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)",
+            (content, digest, serialized)
+        )
+        knowledge_id = cursor.lastrowid
+        db.commit()
+    finally:
+        cursor.close()
+        db.close()
+    log_event(log, logging.INFO, "knowledge_saved", knowledge_id=knowledge_id, content=content[:50])
+    return knowledge_id
+
+def mark_curated(cursor, hashes):
+    # A text added as knowledge that a chat already stored must survive transcript compaction
+    hashes = list(hashes)
+    for i in range(0, len(hashes), 1000):
+        part = hashes[i:i + 1000]
+        cursor.execute(
+            f"UPDATE knowledge SET origin = 'curated' WHERE origin = 'chat' AND content_hash IN ({', '.join(['%s'] * len(part))})",
+            tuple(part)
+        )
 
-def get_conversation_history(convo_id):
+def _lookup_knowledge_ids(cursor, texts):
+    if not texts:
+        return {}
+    # Several raw texts can normalize to the same hash
+    by_hash = {}
+    for text in texts:
+        by_hash.setdefault(content_hash(text), []).append(text)
+
+    placeholders = ", ".join(["%s"] * len(by_hash))
+    cursor.execute(f"SELECT id, content_hash FROM knowledge WHERE content_hash IN ({placeholders})", tuple(by_hash))
+    ids = {}
+    for id, digest in cursor.fetchall():
+        for text in by_hash[digest]:
+            ids[text] = id
+    return ids
+
+def load_all_embeddings(dim=EMBEDDING_DIM):
     db = connect_db()
     cursor = db.cursor()
+    cursor.execute("SELECT COUNT(*) FROM knowledge")
+    expected = cursor.fetchone()[0]
+    cursor.close()
 
-    # Get linked knowledge content for this conversation
-    cursor.execute("""
-        SELECT k.content 
-        FROM conversation_link cl
-        JOIN knowledge k ON cl.knowledge_id = k.id
-        WHERE cl.conversation_id = %s
-        ORDER BY cl.id ASC
-    """, (convo_id,))
-    
-    history = [row[0] for row in cursor.fetchall()]
+    # Decode straight into one preallocated matrix; rows are streamed, never fetchall()'d
+    ids = np.empty(expected, dtype=np.int64)
+    matrix = np.empty((expected, dim), dtype=np.float32)
+    texts = []
+    legacy = 0
 
+    cursor = db.cursor()
+    cursor.execute("SELECT id, content, embedding FROM knowledge ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(EMBEDDING_LOAD_BATCH_SIZE)
+        if not rows:
+            break
+        for id, content, emb_blob in rows:
+            if is_legacy_pickle(emb_blob):
+                legacy += 1
+                continue
+            n = len(texts)
+            if n == len(ids):
+                # Table grew between COUNT(*) and the scan
+                ids = np.resize(ids, max(1, n * 2))
+                matrix = np.resize(matrix, (max(1, n * 2), dim))
+            decode_vector(emb_blob, out=matrix[n])
+            ids[n] = id
+            texts.append(content)
     cursor.close()
     db.close()
 
-    return history
+    if legacy:
+        log_event(log, logging.WARNING, "legacy_embeddings_skipped", rows=legacy,
+                  hint="run `python migrate.py embeddings` to convert them")
+
+    n = len(texts)
+    return ids[:n], texts, matrix[:n]
 
 expected_info = ["kích thước", "màu sắc", "số bộ", "số điện thoại", "địa chỉ giao hàng"]
 
-def detect_missing_info(convo_texts):
-    joined_history = "\n".join(convo_texts)
-    prompt = f"""
+MISSING_INFO_COMPLETION = {"model": "gpt-4.1-nano", "temperature": 0, "max_tokens": 1000}
+
+MISSING_INFO_TEMPLATE = PromptTemplate("missing_info", """
 Bạn là một trợ lý bán hàng. Dưới đây là lịch sử cuộc trò chuyện với khách hàng.
 
 Khách hàng có thể đặt **nhiều đơn hàng**, mỗi đơn gồm:
@@ -109,275 +307,690 @@ Nếu thiếu thông tin nào, để giá trị là null.
 
 Trả về kết quả dưới dạng JSON như sau:
 
-{{
+{
   "đơn hàng": [
-    {{
+    {
       "kích thước": "60" | "70" | "80" | null,
       "màu sắc": "trắng" | "đen" | null,
       "số bộ": 1 | 2 | 3 | null
-    }},
+    },
     ...
   ],
   "số điện thoại": "0123456789" | null,
   "địa chỉ giao hàng": "địa chỉ đầy đủ" | null
-}}
+}
 
 Lịch sử hội thoại:
-{joined_history}
-"""
-
-    response = openai.chat.completions.create(
-        model="gpt-4.1-nano",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0,
-        max_tokens=1000,
-    )
+""")
 
-    result = response.choices[0].message.content.strip()
+def build_missing_info_prompt(convo_texts):
+    # Oldest messages are dropped first when the history outgrows the budget
+    history = fit_tail_to_budget(convo_texts, PROMPT_HISTORY_TOKEN_BUDGET)
+    return MISSING_INFO_TEMPLATE.render(("history", "\n".join(history) + "\n"))
 
+def parse_missing_info(result):
     try:
         return json.loads(result)
     except json.JSONDecodeError:
-        print("❌ Lỗi parse JSON:", result)
+        log_event(log, logging.WARNING, "missing_info_parse_failed", raw=result)
         return {}
 
+# Request kwargs and response handling are shared with the async pipeline, which only swaps the client
+def missing_info_request(convo_texts):
+    return {"messages": [{"role": "user", "content": build_missing_info_prompt(convo_texts)}], **MISSING_INFO_COMPLETION}
+
+def read_missing_info(response):
+    record_usage("missing_info", response.usage)
+    return parse_missing_info(response.choices[0].message.content.strip())
+
+def detect_missing_info(convo_texts):
+    with span("llm", call="missing_info"):
+        response = openai.chat.completions.create(**missing_info_request(convo_texts))
+    return read_missing_info(response)
+
 
 # ------------------- RAG Class -------------------
 class RAG:
-    def __init__(self, dim=1536):
-        self.index = faiss.IndexFlatL2(dim)
-        self.texts = []
-
-        # Load from DB
-        #entries = load_all_embeddings()
-        #if entries:
-        #    vecs = [e[2] for e in entries]
-        #    self.index.add(np.array(vecs))
-        #    self.texts = [e[1] for e in entries]
-        #    print(f"[Loaded] {len(self.texts)} entries from DB.")
+    def __init__(self, dim=EMBEDDING_DIM, store=None, index_type=RAG_INDEX_TYPE, metric=RAG_INDEX_METRIC,
+                 retrieval_mode=RAG_RETRIEVAL_MODE):
+        self.dim = dim
+        self.store = store
+        self.index_type = index_type
+        self.metric = metric
+        self.retrieval_mode = retrieval_mode
+        # BM25 over the same rows as the FAISS indexes, only kept when a mode needs it
+        self.lexical = LexicalIndex() if retrieval_mode != "vector" else None
+        # Both indexes are keyed by knowledge.id; the snapshot one is mmap'd and never written to
+        self.index = self._new_index()
+        self.delta_index = self._new_index()
+        self.delta_ids = set()
+        self.texts = {}
+        # content_hash -> knowledge id, mirrors knowledge.content_hash for O(1) dedup
+        self.hash_to_id = {}
+        self.lock = ReadWriteLock()
+        self.load_stats = None
+
+        # conversation_id -> (loaded_at, knowledge ids, IDSelectorBatch), most recent last
+        self._scopes = OrderedDict()
+        self._scopes_lock = threading.Lock()
+
+        self._generation = None
+        self._delta_offset = 0
+        self._last_refresh = 0.0
+        self._compacting = threading.Lock()
+
+    @property
+    def generation(self):
+        # Snapshot generation the indexes were loaded from; None when built from MySQL
+        return self._generation
+
+    def _new_index(self, kind="flat", vectors=None):
+        # IDMap2 so that rows can be reconstructed by knowledge id for scoped scoring.
+        # The delta index is always exact; only the snapshot uses the configured type.
+        return build_index(
+            kind, self.dim, self.metric, vectors,
+            nlist=RAG_IVF_NLIST, pq_m=RAG_PQ_M, hnsw_m=RAG_HNSW_M, ef_construction=RAG_HNSW_EF_CONSTRUCTION,
+        )
 
-    def add(self, text):
-        if text in self.texts:
-            print(f"[Skip] Already added to FAISS: \"{text[:50]}...\"")
+    def _prepare(self, vecs):
+        vecs = np.array(vecs, dtype=np.float32, ndmin=2)
+        if self.metric == "cosine":
+            faiss.normalize_L2(vecs)
+        return vecs
+
+    def _to_distance(self, D):
+        # Inner products of unit vectors map onto squared L2, so every source can be merged
+        return D if self.metric == "l2" else 2 - 2 * D
+
+    def load(self):
+        if self.store is None:
+            return self.load_from_db()
+
+        with self.store.lock():
+            if self.store.generation() is None:
+                # First boot: build from MySQL once and publish it for the other workers
+                stats = self.load_from_db()
+                self._generation = self.store.write_snapshot(self.index, list(self.texts), list(self.texts.values()))
+                self._delta_offset = 0
+                log_event(log, logging.INFO, "snapshot_written", generation=self._generation, directory=self.store.directory)
+                return stats
+        return self.load_from_snapshot()
+
+    def load_from_db(self):
+        started = time.perf_counter()
+        ids, texts, matrix = load_all_embeddings(self.dim)
+        matrix = self._prepare(matrix)
+        index = self._new_index(self.index_type, matrix)
+        index.add_with_ids(matrix, ids)
+        with self.lock.write():
+            self.index = index
+            self.delta_index.reset()
+            self.delta_ids = set()
+            self.texts = dict(zip(ids.tolist(), texts))
+            self.hash_to_id = {content_hash(t): i for i, t in self.texts.items()}
+        if self.lexical is not None:
+            self.lexical.build(zip(ids.tolist(), texts))
+        self.load_stats = {"source": "db", "rows": len(texts), "seconds": time.perf_counter() - started}
+        log_event(log, logging.INFO, "index_loaded", **self.load_stats)
+        return self.load_stats
+
+    def load_from_snapshot(self):
+        started = time.perf_counter()
+        generation, index, ids, texts = self.store.load_snapshot()
+        with self.lock.write():
+            self.index = index
+            self.delta_index.reset()
+            self.delta_ids = set()
+            self.texts = dict(zip(ids, texts))
+            self.hash_to_id = {content_hash(t): i for i, t in self.texts.items()}
+            self._generation = generation
+            self._delta_offset = 0
+        if self.lexical is not None:
+            self.lexical.build(zip(ids, texts))
+        self.refresh(force=True)
+        self.load_stats = {"source": "snapshot", "rows": len(self.texts), "seconds": time.perf_counter() - started}
+        log_event(log, logging.INFO, "index_loaded", generation=generation, **self.load_stats)
+        return self.load_stats
+
+    def refresh(self, force=False):
+        # Pick up vectors other workers appended to the delta log, or a newer snapshot
+        if self.store is None:
             return
+        now = time.monotonic()
+        if not force and now - self._last_refresh < RAG_INDEX_REFRESH_SECONDS:
+            return
+        self._last_refresh = now
 
-        store_knowledge(text)  # Will skip if already in DB
-        vec = embed_text(text)
-        self.index.add(np.array([vec]))
-        self.texts.append(text)
-        print(f"[Added] To FAISS: \"{text[:50]}...\"")
-
-    def search(self, query, texts=None, k=5):
-        if texts is None:
-            texts = self.texts
-            vecs = self.index
-            return self._search_faiss(query, texts, vecs, k)
-        else:
-            # Combine provided texts with self.texts
-            combined_texts = self.texts + texts
-            vecs = [embed_text(t) for t in combined_texts]
-            q_vec = embed_text(query)
-            sims = [(t, np.linalg.norm(q_vec - v)) for t, v in zip(combined_texts, vecs)]
-            sims.sort(key=lambda x: x[1])
-            return sims[:k]
-
-    
-    def _search_faiss(self, query, texts, vecs, k):
-        q_vec = embed_text(query)
-        D, I = self.index.search(np.array([q_vec]), k)
-        return [(texts[i], D[0][idx]) for idx, i in enumerate(I[0]) if i != -1]
-
-    def get_conversation_knowledge(self, convo_id):
-        db = connect_db()
-        cursor = db.cursor()
-        cursor.execute("""
-            SELECT k.content 
-            FROM conversation_link cl
-            JOIN knowledge k ON cl.knowledge_id = k.id
-            WHERE cl.conversation_id = %s
-        """, (convo_id,))
-        texts = [row[0] for row in cursor.fetchall()]
-        cursor.close()
-        db.close()
-        return texts
+        if self.store.generation() != self._generation:
+            self.load_from_snapshot()
+            return
 
-    def store_and_link_query(self, convo_id, text, source='user'):
-        db = connect_db()
-        cursor = db.cursor()
+        self._apply_delta()
+
+        if self.delta_index.ntotal >= RAG_INDEX_COMPACT_THRESHOLD and self._compacting.acquire(blocking=False):
+            threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _apply_delta(self):
+        with self.lock.write():
+            records, self._delta_offset = self.store.read_delta(self._generation, self._delta_offset)
+            for id, text, vec in records:
+                if id in self.texts:
+                    continue
+                self.delta_index.add_with_ids(self._prepare(vec), np.array([id], dtype=np.int64))
+                self.delta_ids.add(id)
+                self.texts[id] = text
+                self.hash_to_id[content_hash(text)] = id
+                if self.lexical is not None:
+                    self.lexical.add(id, text)
+
+    def compact(self):
+        # Fold the delta log into a new snapshot; only one worker at a time gets the lock
+        with self.store.lock(blocking=False) as acquired:
+            if not acquired:
+                return None
+            if self.store.generation() != self._generation:
+                return None  # Another worker compacted first, we will reload on refresh
+
+            self._apply_delta()
+
+            # Nobody can append while we hold the store lock, so a read lock is enough here
+            with self.lock.read():
+                delta_vecs = np.empty((0, self.dim), dtype=np.float32)
+                if self.delta_index.ntotal:
+                    delta_vecs = faiss.downcast_index(self.delta_index.index).reconstruct_n(0, self.delta_index.ntotal)
+                delta_ids = faiss.vector_to_array(self.delta_index.id_map)
+                if index_kind(self.index) == "flat" and self.index_type != "flat":
+                    # The snapshot fell back to flat while the table was too small to train on
+                    base_vecs = faiss.downcast_index(self.index.index).reconstruct_n(0, self.index.ntotal)
+                    vecs = np.concatenate([base_vecs, delta_vecs])
+                    merged = self._new_index(self.index_type, vecs)
+                    merged.add_with_ids(vecs, np.concatenate([faiss.vector_to_array(self.index.id_map), delta_ids]))
+                else:
+                    merged = self.store.read_index(self._generation)
+                    if len(delta_ids):
+                        merged.add_with_ids(delta_vecs, delta_ids)
+                generation = self.store.write_snapshot(merged, list(self.texts), list(self.texts.values()))
+        log_event(log, logging.INFO, "snapshot_compacted", rows=len(self.texts), generation=generation)
+        self.refresh(force=True)
+        return generation
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            log_event(log, logging.ERROR, "snapshot_compaction_failed", error=repr(e))
+        finally:
+            self._compacting.release()
+
+    def _append(self, knowledge_id, text, vec):
+        if self.store is not None:
+            # Goes through the log so every worker (including this one) sees the same order
+            self.store.append_delta(knowledge_id, text, vec)
+            self.refresh(force=True)
+            return
+        with self.lock.write():
+            if knowledge_id in self.texts:
+                return
+            self.index.add_with_ids(self._prepare(vec), np.array([knowledge_id], dtype=np.int64))
+            self.texts[knowledge_id] = text
+            self.hash_to_id[content_hash(text)] = knowledge_id
+            if self.lexical is not None:
+                self.lexical.add(knowledge_id, text)
+
+    def add_records(self, records):
+        # Folds (id, text, vec) records, e.g. from a delta log, into the main index;
+        # ids already indexed are skipped. Returns how many were added.
+        with self.lock.write():
+            records = [(id, text, vec) for id, text, vec in records if id not in self.texts]
+            if not records:
+                return 0
+            self.index.add_with_ids(self._prepare([vec for _, _, vec in records]),
+                                    np.array([id for id, _, _ in records], dtype=np.int64))
+            for id, text, _ in records:
+                self.texts[id] = text
+                self.hash_to_id[content_hash(text)] = id
+                if self.lexical is not None:
+                    self.lexical.add(id, text)
+        return len(records)
 
-        # Step 1: Check if knowledge already exists
-        cursor.execute("SELECT id FROM knowledge WHERE content = %s", (text,))
-        row = cursor.fetchone()
+    def add(self, text):
+        with self.lock.read():
+            exists = content_hash(text) in self.hash_to_id
+        if exists:
+            log_event(log, logging.DEBUG, "index_add_skipped", content=text[:50])
+            return
 
-        if row:
-            knowledge_id = row[0]
-            print(f"[Info] Already in knowledge DB")
+        knowledge_id = store_knowledge(text)  # Will skip if already in DB
+        vec = embed_text(text)  # Served from embedding_cache when store_knowledge just embedded it
+        self._append(knowledge_id, text, vec)
+        log_event(log, logging.INFO, "index_added", knowledge_id=knowledge_id, content=text[:50])
+
+    def search(self, query, texts=None, k=5, convo_id=None, mode=None):
+        # [(text, rank key)], lower is better: the squared L2 distance in vector mode,
+        # the negated BM25 or RRF score otherwise
+        mode = mode or self.retrieval_mode
+        if mode == "vector" or self.lexical is None:
+            return self._search_vector(query, texts, k, convo_id)
+        if mode == "lexical":
+            return self._search_lexical(query, texts, k, convo_id)
+
+        lexical = self._search_lexical(query, texts, RAG_FUSION_CANDIDATES, convo_id)
+        try:
+            vector = self._search_vector(query, texts, RAG_FUSION_CANDIDATES, convo_id)
+        except (openai.APIConnectionError, openai.APITimeoutError) as e:
+            # The embedding API is unreachable: answer from the local index alone
+            log_event(log, logging.WARNING, "hybrid_search_lexical_only", error=repr(e))
+            return lexical[:k]
+        return reciprocal_rank_fusion([vector, lexical], k, RAG_RRF_K)
+
+    def _search_lexical(self, query, texts, k, convo_id):
+        self.refresh()
+        with span("lexical_search"):
+            hits = self.lexical.search(query, k)
+            if convo_id is not None:
+                ids, _ = self._conversation_scope(convo_id)
+                if len(ids):
+                    hits += self.lexical.search(query, k, allowed=ids.tolist())
+            with self.lock.read():
+                hits = [(self.texts[i], score) for i, score in hits if i in self.texts]
+            if texts:
+                extra = LexicalIndex()
+                extra.build(enumerate(texts))
+                hits += [(texts[i], score) for i, score in extra.search(query, k)]
+
+        best = {}
+        for t, score in hits:
+            if t not in best or score > best[t]:
+                best[t] = score
+        return [(t, -score) for t, score in sorted(best.items(), key=lambda x: -x[1])[:k]]
+
+    def _search_vector(self, query, texts, k, convo_id):
+        # Distances are squared L2 everywhere so hits from every source can be merged
+        q_vec = self._prepare(embed_text(query))[0]
+        with span("faiss_search"):
+            hits = self._search_faiss(q_vec, k)
+            if convo_id is not None:
+                hits += self._search_conversation(q_vec, convo_id, k)
+        if texts:
+            hits += self._top_k(q_vec, self._prepare(embed_texts(texts)), k, texts)
+
+        sims = {}
+        for t, d in hits:
+            if t not in sims or d < sims[t]:
+                sims[t] = d
+        return sorted(sims.items(), key=lambda x: x[1])[:k]
+
+    def _search_faiss(self, q_vec, k, selector=None):
+        self.refresh()
+        q = np.array([q_vec], dtype=np.float32)
+        with self.lock.read():
+            hits = []
+            for index in (self.index, self.delta_index):
+                if index.ntotal == 0:
+                    continue
+                params = search_params(index, selector, nprobe=RAG_NPROBE, ef_search=RAG_EF_SEARCH)
+                D, I = index.search(q, k, params=params)
+                # Slots faiss couldn't fill (k > hits) are padded with id -1 and ±FLT_MAX
+                found = I[0] != -1
+                hits.extend(zip([self.texts[i] for i in I[0][found]], self._to_distance(D[0][found])))
+        hits.sort(key=lambda x: x[1])
+        return hits[:k]
+
+    def _search_conversation(self, q_vec, convo_id, k):
+        ids, selector = self._conversation_scope(convo_id)
+        if len(ids) == 0:
+            return []
+
+        # Flat and HNSW keep full vectors; IVF/PQ rows can't be reconstructed exactly
+        if len(ids) <= RAG_SCOPED_BRUTE_FORCE_MAX and index_kind(self.index) in ("flat", "hnsw"):
+            # Few candidates: pull the rows out of the index and score them in one numpy pass
+            with self.lock.read():
+                ids = [i for i in ids if i in self.texts]
+                if not ids:
+                    return []
+                vecs = np.stack([
+                    (self.delta_index if i in self.delta_ids else self.index).reconstruct(int(i))
+                    for i in ids
+                ])
+                texts = [self.texts[i] for i in ids]
+            return self._top_k(q_vec, vecs, k, texts)
+
+        return self._search_faiss(q_vec, k, selector=selector)
+
+    @staticmethod
+    def _top_k(q_vec, vecs, k, labels):
+        dists = ((vecs - q_vec) ** 2).sum(axis=1)
+        if len(dists) > k:
+            top = np.argpartition(dists, k)[:k]
+            top = top[np.argsort(dists[top])]
         else:
-            # Insert new knowledge
-            embedding = embed_text(text)
-            serialized = pickle.dumps(embedding)
-            cursor.execute(
-                "INSERT INTO knowledge (content, embedding) VALUES (%s, %s)",
-                (text, serialized)
-            )
-            knowledge_id = cursor.lastrowid
-            self.index.add(np.array([embedding]))
-            self.texts.append(text)
-            print(f"[Saved + FAISS] \"{text[:50]}...\"")
+            top = np.argsort(dists)
+        return [(labels[i], float(dists[i])) for i in top]
 
-        # Step 2: Link to conversation with 'from' column
-        cursor.execute(
-            "SELECT 1 FROM conversation_link WHERE conversation_id = %s AND knowledge_id = %s",
-            (convo_id, knowledge_id)
-        )
-        if not cursor.fetchone():
-            cursor.execute(
-                "INSERT INTO conversation_link (conversation_id, knowledge_id, from_source) VALUES (%s, %s, %s)",
-                (convo_id, knowledge_id, source)
-            )
-            print(f"[Linked] query to conversation_id={convo_id} from={source}")
+    def _conversation_scope(self, convo_id):
+        now = time.monotonic()
+        with self._scopes_lock:
+            scope = self._scopes.get(convo_id)
+            if scope and now - scope[0] < RAG_SCOPE_TTL_SECONDS:
+                self._scopes.move_to_end(convo_id)
+                return scope[1], scope[2]
 
-        db.commit()
+        db = connect_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT knowledge_id FROM conversation_link WHERE conversation_id = %s", (convo_id,))
+        ids = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
         cursor.close()
         db.close()
-        return knowledge_id
-
-def answer_question(question, contexts, next_missing=None, info_status=None):
-    context_block = "\n".join(contexts)
-
-    if next_missing is None:
-        # Gửi prompt để phân loại intent
-        intent_prompt = f"""
-    Bạn là một trợ lý bán hàng. Phân loại câu của khách vào 1 trong 3 nhóm sau (chỉ trả về đúng số):
-    1. Khách đang cung cấp thêm thông tin đơn hàng (số điện thoại và địa chỉ)
-    2. Khách xác nhận muốn đặt hàng
-    3. Câu nói không liên quan hoặc chưa rõ ý định
-
-    Câu của khách: "{question}"
-
-    Chỉ trả lời bằng 1, 2 hoặc 3.
-    """
-        print("🔍 [DEBUG] intent_prompt:\n", intent_prompt)
-
-        intent_response = openai.chat.completions.create(
-            model="gpt-4.1-nano",
-            messages=[{"role": "user", "content": intent_prompt}],
-            max_tokens=10,
-            temperature=0
-        )
-
-        intent = intent_response.choices[0].message.content.strip()
-        print("🔍 [DEBUG] intent_response:", intent_response)
-        print("🔍 [DEBUG] intent:", intent)
-
-        don_hang_list = info_status.get('đơn hàng', [])
-        print("📦 [DEBUG] Tổng số đơn hàng:", len(don_hang_list))
-        print("📦 [DEBUG] Danh sách đơn hàng:", don_hang_list)
+        return self._set_scope(convo_id, ids)
+
+    def _set_scope(self, convo_id, ids):
+        selector = faiss.IDSelectorBatch(ids)
+        with self._scopes_lock:
+            self._scopes[convo_id] = (time.monotonic(), ids, selector)
+            self._scopes.move_to_end(convo_id)
+            while len(self._scopes) > RAG_SCOPE_CACHE_SIZE:
+                self._scopes.popitem(last=False)
+        return ids, selector
+
+    def _link_scope(self, convo_id, knowledge_id):
+        with self._scopes_lock:
+            scope = self._scopes.get(convo_id)
+        if scope is not None and knowledge_id not in scope[1]:
+            self._set_scope(convo_id, np.append(scope[1], np.int64(knowledge_id)))
 
-        def get_first_valid_value(key):
-            for dh in don_hang_list:
-                val = dh.get(key)
-                if val not in (None, "", "chưa rõ"):
-                    return val
-            return "chưa rõ"
+    def get_conversation_knowledge(self, convo_id):
+        # Indexed rows linked to the conversation (its embedded questions); the transcript is in transcript.py
+        ids, _ = self._conversation_scope(convo_id)
+        with self.lock.read():
+            return [self.texts[i] for i in ids.tolist() if i in self.texts]
 
-        # Tổng số bộ = tổng cộng 'số bộ' trong các đơn hàng, bỏ qua None hoặc giá trị không hợp lệ
-        total_so_bo = 0
-        for dh in don_hang_list:
+    def store_and_link_query(self, convo_id, text, source='user'):
+        return self.store_and_link_many(convo_id, [(text, source)])[0]
+
+    @traced("db_write", query="store_and_link")
+    def store_and_link_many(self, convo_id, items):
+        # items: [(text, source), ...] for one turn, stored and linked in a single transaction
+        # (embedding happens before it, so the transaction holds no API call)
+        texts = list(dict.fromkeys(text for text, _ in items))
+
+        # Step 1: Look up which texts already exist, in memory first and then by hash in the DB
+        ids = {}
+        with self.lock.read():
+            for text in texts:
+                knowledge_id = self.hash_to_id.get(content_hash(text))
+                if knowledge_id is not None:
+                    ids[text] = knowledge_id
+        missing = [t for t in texts if t not in ids]
+        if missing:
+            db = connect_db()
+            cursor = db.cursor()
             try:
-                so_bo = int(dh.get("số bộ", 0) or 0)
-                print(f"🔢 [DEBUG] số bộ đơn hàng: {so_bo}")
-                total_so_bo += so_bo
-            except (ValueError, TypeError):
-                print("⚠️ [DEBUG] Không parse được số bộ:", dh.get("số bộ"))
-                continue
-        if total_so_bo == 0:
-            total_so_bo = 1  # mặc định 1 nếu không có số bộ hợp lệ
+                ids.update(_lookup_knowledge_ids(cursor, missing))
+            finally:
+                cursor.close()
+                db.close()
 
-        print("🔢 [DEBUG] Tổng số bộ:", total_so_bo)
+        # Step 2: Embed the new ones (one row per hash) in one batch, with no connection held
+        missing = [t for t in texts if t not in ids]
+        new_texts = list({content_hash(t): t for t in missing}.values())
+        new_vecs = embed_texts(new_texts) if new_texts else []
 
-        order_info = {
-            "kích thước": get_first_valid_value("kích thước"),
-            "màu sắc": get_first_valid_value("màu sắc"),
-            "số bộ": total_so_bo,
-            "số điện thoại": info_status.get("số điện thoại") or "chưa rõ",
-            "địa chỉ giao hàng": info_status.get("địa chỉ giao hàng") or "chưa rõ",
+        db = connect_db()
+        cursor = db.cursor()
+        try:
+            if new_texts:
+                cursor.executemany(
+                    "INSERT INTO knowledge (content, content_hash, embedding, origin) VALUES (%s, %s, %s, 'chat') "
+                    "ON DUPLICATE KEY UPDATE id = id",
+                    [(t, content_hash(t), encode_vector(v, EMBEDDING_STORAGE_DTYPE)) for t, v in zip(new_texts, new_vecs)]
+                )
+                ids.update(_lookup_knowledge_ids(cursor, missing))
+                log_event(log, logging.INFO, "knowledge_saved", rows=len(new_texts))
+
+            # Step 3: Link to conversation with 'from' column (uq_conversation_link skips existing links)
+            cursor.executemany(
+                "INSERT INTO conversation_link (conversation_id, knowledge_id, from_source) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE knowledge_id = knowledge_id",
+                [(convo_id, ids[text], source) for text, source in items]
+            )
+            db.commit()
+            log_event(log, logging.DEBUG, "conversation_linked", convo_id=convo_id, rows=len(items))
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+            db.close()
+
+        # Only index after commit so the shared index never holds rows that were rolled back
+        for text, vec in zip(new_texts, new_vecs):
+            self._append(ids[text], text, vec)
+        for text in texts:
+            self._link_scope(convo_id, ids[text])
+        return [ids[text] for text, _ in items]
+
+# ------------------- Shared index -------------------
+_shared_rag = None
+_shared_rag_lock = threading.Lock()
+
+def get_shared_rag():
+    # One index per process, loaded from the knowledge table on first use and shared by all request threads
+    global _shared_rag
+    if _shared_rag is None:
+        with _shared_rag_lock:
+            if _shared_rag is None:
+                rag = RAG(store=IndexStore(RAG_INDEX_DIR) if RAG_INDEX_DIR else None)
+                rag.load()
+                _shared_rag = rag
+    return _shared_rag
+
+INTENT_COMPLETION = {"model": "gpt-4.1-nano", "max_tokens": 10, "temperature": 0}
+# Strict structured output: the model can only produce this object, in this field order,
+# so answer_only is complete (and can be sent) before question_ask_next starts streaming
+ANSWER_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "answer",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "answer_only": {"type": "string"},
+                "question_ask_next": {"type": "string"},
+            },
+            "required": ["answer_only", "question_ask_next"],
+            "additionalProperties": False,
+        },
+    },
+}
+ANSWER_COMPLETION = {
+    "model": "gpt-4.1-nano", "max_tokens": 500, "temperature": 0.1, "response_format": ANSWER_RESPONSE_FORMAT
+}
+
+# The question goes last so the instructions are a cacheable prefix
+INTENT_TEMPLATE = PromptTemplate("intent", """Bạn là một trợ lý bán hàng. Phân loại câu của khách vào 1 trong 3 nhóm sau (chỉ trả về đúng số):
+1. Khách đang cung cấp thêm thông tin đơn hàng (số điện thoại và địa chỉ)
+2. Khách xác nhận muốn đặt hàng
+3. Câu nói không liên quan hoặc chưa rõ ý định
+
+Chỉ trả lời bằng 1, 2 hoặc 3.
+
+""")
+
+def build_intent_prompt(question):
+    return INTENT_TEMPLATE.render(("question", f'Câu của khách: "{question}"'))
+
+def intent_reply(intent, info_status):
+    don_hang_list = info_status.get('đơn hàng', [])
+
+    def get_first_valid_value(key):
+        for dh in don_hang_list:
+            val = dh.get(key)
+            if val not in (None, "", "chưa rõ"):
+                return val
+        return "chưa rõ"
+
+    # Tổng số bộ = tổng cộng 'số bộ' trong các đơn hàng, bỏ qua None hoặc giá trị không hợp lệ
+    total_so_bo = 0
+    for dh in don_hang_list:
+        try:
+            so_bo = int(dh.get("số bộ", 0) or 0)
+            total_so_bo += so_bo
+        except (ValueError, TypeError):
+            log_debug(log, "order_count_unparsed", value=dh.get("số bộ"))
+            continue
+    if total_so_bo == 0:
+        total_so_bo = 1  # mặc định 1 nếu không có số bộ hợp lệ
+
+
+    order_info = {
+        "kích thước": get_first_valid_value("kích thước"),
+        "màu sắc": get_first_valid_value("màu sắc"),
+        "số bộ": total_so_bo,
+        "số điện thoại": info_status.get("số điện thoại") or "chưa rõ",
+        "địa chỉ giao hàng": info_status.get("địa chỉ giao hàng") or "chưa rõ",
+    }
+
+    # Tính tổng tiền theo số bộ
+    tong_tien = total_so_bo * (170000 if total_so_bo > 1 else 175000)
+    log_debug(log, "intent_reply", intent=intent, orders=don_hang_list, order_info=order_info, total=tong_tien)
+
+    if intent == "1":
+        answer = (
+            f"Dạ em đã ghi nhận đầy đủ thông tin đơn hàng của mình ạ:\n" +
+            "\n".join([f"- {k.capitalize()}: {v}" for k, v in order_info.items()]) +
+            f"\n👉 Tổng tiền: {tong_tien:,} VNĐ\n\n"
+            f"Dạ em gửi khoảng 3-4 ngày chị nhận được, chị nhận thanh toán giúp em {tong_tien:,} VNĐ và phí ship ạ"
+        )
+        return {
+            "answer_only": answer,
+            "question_ask_next": "Chị có cần em hỗ trợ gì thêm không ạ?"
         }
 
-        print("📦 [DEBUG] order_info:", order_info)
-
-        # Tính tổng tiền theo số bộ
-        tong_tien = total_so_bo * (170000 if total_so_bo > 1 else 175000)
-        print("💰 [DEBUG] Tổng tiền:", tong_tien)
-
-        if intent == "1":
-            answer = (
-                f"Dạ em đã ghi nhận đầy đủ thông tin đơn hàng của mình ạ:\n" +
-                "\n".join([f"- {k.capitalize()}: {v}" for k, v in order_info.items()]) +
-                f"\n👉 Tổng tiền: {tong_tien:,} VNĐ\n\n"
-                f"Dạ em gửi khoảng 3-4 ngày chị nhận được, chị nhận thanh toán giúp em {tong_tien:,} VNĐ và phí ship ạ"
-            )
-            print("✅ [DEBUG] Trường hợp intent 1 - cung cấp thêm thông tin")
-            return {
-                "answer_only": answer,
-                "question_ask_next": "Chị có cần em hỗ trợ gì thêm không ạ?"
-            }
-
-        elif intent == "2":
-            print("✅ [DEBUG] Trường hợp intent 2 - xác nhận đặt hàng")
-            return {
-                "answer_only": "Dạ em cảm ơn chị nhiều ạ 💖 Em sẽ tiến hành lên đơn ngay cho mình nhé!",
-                "question_ask_next": "Chị có cần đổi gì thêm không ạ, ví dụ số bộ hay màu sắc?"
-            }
+    elif intent == "2":
+        return {
+            "answer_only": "Dạ em cảm ơn chị nhiều ạ 💖 Em sẽ tiến hành lên đơn ngay cho mình nhé!",
+            "question_ask_next": "Chị có cần đổi gì thêm không ạ, ví dụ số bộ hay màu sắc?"
+        }
 
-        else:
-            print("❓ [DEBUG] Trường hợp intent 3 - chưa rõ ý định")
-            return {
-                "answer_only": "Chị chờ em chút ạ 🫶",
-                "question_ask_next": "Không biết chị muốn cung cấp thêm thông tin hay xác nhận đặt hàng ạ?"
-            }
+    else:
+        return {
+            "answer_only": "Chị chờ em chút ạ 🫶",
+            "question_ask_next": "Không biết chị muốn cung cấp thêm thông tin hay xác nhận đặt hàng ạ?"
+        }
 
-    # 🧠 Trường hợp thiếu thông tin → tiếp tục hỏi
-    base_prompt = f"""
-Bạn là một trợ lý bán hàng chuyên nghiệp. Hãy thực hiện 3 việc:
+# Instructions and the fixed shop rules/prices come first so the prefix is identical on every turn
+ANSWER_TEMPLATE = PromptTemplate("answer", f"""Bạn là một trợ lý bán hàng chuyên nghiệp. Hãy thực hiện 3 việc:
 1. Trả lời khách một cách thân thiện.
 2. Nếu thiếu thông tin, hãy hỏi tiếp khách về thông tin còn thiếu.
 3. Trả về kết quả dưới dạng JSON với 2 trường: answer_only, question_ask_next
 
-Trả lời dựa trên thông tin đơn hàng ở dạng JSON dưới đây và câu hỏi của khách hàng.
-
-Thông tin đơn hàng:
-{json.dumps(info_status, ensure_ascii=False, indent=2)}
-Thông tin cần biết tiếp theo: {next_missing}
+Thông tin cố định:
+{chr(10).join(MUST_KNOW_CONTEXT)}
 
-Thông tin thêm:
-{context_block}
+Trả lời dựa trên thông tin đơn hàng ở dạng JSON dưới đây và câu hỏi của khách hàng.
 
-Câu của khách: {question}
-Kết quả trả về (JSON):""".strip()
+""")
 
-    response = openai.chat.completions.create(
-        model="gpt-4.1-nano",
-        messages=[{"role": "user", "content": base_prompt}],
-        max_tokens=500,
-        temperature=0.1
+def build_answer_prompt(question, contexts, next_missing, info_status):
+    # contexts: slot-specific hints then retrieval hits, most relevant first
+    context_block = "\n".join(fit_to_budget(contexts, PROMPT_CONTEXT_TOKEN_BUDGET))
+    return ANSWER_TEMPLATE.render(
+        ("order", f"Thông tin đơn hàng:\n{compact_json(info_status)}\nThông tin cần biết tiếp theo: {next_missing}\n\n"),
+        ("context", f"Thông tin thêm:\n{context_block}\n\n"),
+        ("question", f"Câu của khách: {question}\nKết quả trả về (JSON):"),
     )
 
-    print("🔍 prompt:", base_prompt)
-
-    raw_output = response.choices[0].message.content.strip()
-    print("🔍 raw model output:", raw_output)
-
+def parse_answer(raw_output):
     try:
-        result = json.loads(raw_output)
+        return json.loads(raw_output)
     except Exception:
         # fallback: try to parse manually if model doesn't return valid JSON
-        result = False
+        return False
+
+def local_intent_reply(question, info_status):
+    # Câu rõ ràng (số điện thoại, "ok chốt"...) được phân loại ngay, không cần gọi LLM
+    intent = classify_intent(question)
+    return intent_reply(intent, info_status) if intent is not None else None
+
+def intent_request(question):
+    return {"messages": [{"role": "user", "content": build_intent_prompt(question)}], **INTENT_COMPLETION}
+
+def read_intent(request, response, info_status):
+    record_usage("intent", response.usage)
+    intent = response.choices[0].message.content.strip()
+    log_debug(log, "intent_classified", prompt=request["messages"][0]["content"], intent=intent)
+    return intent_reply(intent, info_status)
+
+def answer_request(question, contexts, next_missing, info_status, stream=False):
+    request = {
+        "messages": [{"role": "user", "content": build_answer_prompt(question, contexts, next_missing, info_status)}],
+        **ANSWER_COMPLETION
+    }
+    if stream:
+        request.update(stream=True, stream_options={"include_usage": True})
+    return request
+
+def read_answer(request, response):
+    record_usage("answer", response.usage)
+    raw_output = response.choices[0].message.content.strip()
+    log_debug(log, "answer_generated", prompt=request["messages"][0]["content"], raw=raw_output)
+    return parse_answer(raw_output)
+
+class AnswerStream:
+    """Accumulates a streamed answer; feed() returns the JSON fields completed by each chunk."""
+
+    def __init__(self, request):
+        self.request = request
+        self.parser = JsonFieldStream()
+        self.chunks = []
+
+    def feed(self, event):
+        if not event.choices:
+            record_usage("answer", event.usage)  # the final chunk carries usage and no choices
+            return []
+        delta = event.choices[0].delta.content or ""
+        self.chunks.append(delta)
+        return self.parser.feed(delta)
+
+    def result(self):
+        raw_output = "".join(self.chunks).strip()
+        log_debug(log, "answer_generated", prompt=self.request["messages"][0]["content"], raw=raw_output)
+        return parse_answer(raw_output) or (self.parser.fields if self.parser.done else False)
+
+def answer_question(question, contexts, next_missing=None, info_status=None):
+    if next_missing is None:
+        reply = local_intent_reply(question, info_status)
+        if reply is not None:
+            return reply
+
+        # Gửi prompt để phân loại intent
+        request = intent_request(question)
+        with span("llm", call="intent"):
+            response = openai.chat.completions.create(**request)
+        return read_intent(request, response, info_status)
+
+    # 🧠 Trường hợp thiếu thông tin → tiếp tục hỏi
+    request = answer_request(question, contexts, next_missing, info_status)
+    with span("llm", call="answer"):
+        response = openai.chat.completions.create(**request)
+    return read_answer(request, response)
+
+def answer_question_stream(question, contexts, next_missing=None, info_status=None, on_field=None):
+    # Same result as answer_question, but on_field(name, value) fires as each JSON field completes
+    if next_missing is None:
+        return answer_question(question, contexts, next_missing, info_status)
 
-    return result
+    answer = AnswerStream(answer_request(question, contexts, next_missing, info_status, stream=True))
+    with span("llm", call="answer_stream"):
+        for event in openai.chat.completions.create(**answer.request):
+            for name, value in answer.feed(event):
+                if on_field:
+                    on_field(name, value)
+    return answer.result()
 
 if __name__ == '__main__':
-    rag = RAG()
+    rag = get_shared_rag()
 
     query = "quần áo cỡ 70 là cho đối tượng nào"
     results = rag.search(query)
@@ -0,0 +1,135 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from conversation import CONTEXT_VERSION
+from text_utils import content_hash
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+
+
+# Reuses an earlier {answer_only, question_ask_next} when a new query is semantically close
+# to a cached one asked in the same situation: same next missing slot and same relevant
+# order info. Phone and address only count as present/absent so answers are shared
+# between customers, and answers that quote either are never cached. Numbers in the
+# query are part of the key too: "size 90" and "size 100" embed almost the same.
+class SemanticResponseCache:
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=5000, version=None):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = version
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # entry id -> (bucket, vec, answer, created_at, latency)
+        self._buckets = {}  # bucket -> {"ids": [...], "matrix": np.ndarray}
+        self._next_id = 0
+
+    @staticmethod
+    def bucket_key(query, next_missing, info_status):
+        orders = [
+            [o.get("kích thước"), o.get("màu sắc"), o.get("số bộ")]
+            for o in (info_status.get("đơn hàng") or [])
+        ]
+        relevant = {
+            "đơn hàng": orders,
+            "số điện thoại": bool(info_status.get("số điện thoại")),
+            "địa chỉ giao hàng": bool(info_status.get("địa chỉ giao hàng")),
+        }
+        numbers = re.findall(r"\d+", query)
+        return next_missing or "", " ".join(numbers), content_hash(json.dumps(relevant, ensure_ascii=False, sort_keys=True))
+
+    def set_version(self, version):
+        # Drop everything when the context the answers were built from changes: the static
+        # context (prices, rules) or the published knowledge snapshot
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self._buckets.clear()
+                self.version = version
+
+    def lookup(self, query, q_vec, next_missing, info_status):
+        bucket = self.bucket_key(query, next_missing, info_status)
+        q = self._unit(q_vec)
+        now = time.monotonic()
+        with self._lock:
+            group = self._buckets.get(bucket)
+            if group:
+                sims = group["matrix"] @ q
+                best = int(np.argmax(sims))
+                entry_id = group["ids"][best]
+                _, _, answer, created_at, latency = self._entries[entry_id]
+                if now - created_at > self.ttl:
+                    self._remove(entry_id)
+                elif sims[best] >= self.threshold:
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    self.saved_seconds += latency
+                    return dict(answer)
+            self.misses += 1
+            return None
+
+    def store(self, query, q_vec, next_missing, info_status, answer, latency):
+        text = f"{answer.get('answer_only', '')} {answer.get('question_ask_next', '')}"
+        for private in (info_status.get("số điện thoại"), info_status.get("địa chỉ giao hàng")):
+            if private and str(private) in text:
+                return
+
+        bucket = self.bucket_key(query, next_missing, info_status)
+        vec = self._unit(q_vec)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (bucket, vec, dict(answer), time.monotonic(), latency)
+            group = self._buckets.setdefault(bucket, {"ids": [], "matrix": np.empty((0, len(vec)), dtype=np.float32)})
+            group["ids"].append(entry_id)
+            group["matrix"] = np.vstack([group["matrix"], vec])
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "entries": len(self._entries),
+                "buckets": len(self._buckets),
+            }
+
+    def _remove(self, entry_id):
+        bucket = self._entries.pop(entry_id)[0]
+        group = self._buckets[bucket]
+        i = group["ids"].index(entry_id)
+        del group["ids"][i]
+        group["matrix"] = np.delete(group["matrix"], i, axis=0)
+        if not group["ids"]:
+            del self._buckets[bucket]
+
+    @staticmethod
+    def _unit(vec):
+        vec = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+
+response_cache = SemanticResponseCache(
+    threshold=RESPONSE_CACHE_THRESHOLD,
+    ttl=RESPONSE_CACHE_TTL,
+    max_entries=RESPONSE_CACHE_SIZE,
+    version=CONTEXT_VERSION,
+) if RESPONSE_CACHE_ENABLED else None
@@ -0,0 +1,37 @@
+-- Tables used by rag.py. Existing databases: see `python migrate.py --help`.
+
+CREATE TABLE IF NOT EXISTS knowledge (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    content TEXT NOT NULL,
+    content_hash CHAR(40) NOT NULL,  -- text_utils.content_hash(content)
+    embedding BLOB NOT NULL,  -- vector_codec format
+    origin VARCHAR(16) NOT NULL DEFAULT 'curated',  -- curated | chat (inserted by a conversation, see transcript.py)
+    UNIQUE KEY uq_knowledge_content_hash (content_hash)
+);
+
+-- Only conversations' embedded questions are linked (TRANSCRIPT_EMBED_QUESTIONS)
+CREATE TABLE IF NOT EXISTS conversation_link (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    conversation_id VARCHAR(64) NOT NULL,
+    knowledge_id INT NOT NULL,
+    from_source VARCHAR(16) NOT NULL DEFAULT 'user',
+    UNIQUE KEY uq_conversation_link (conversation_id, knowledge_id)
+);
+
+-- Chat transcript, append-only and never embedded (transcript.py)
+CREATE TABLE IF NOT EXISTS conversation_message (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    conversation_id VARCHAR(64) NOT NULL,
+    from_source VARCHAR(16) NOT NULL,  -- user | bot
+    content TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY ix_conversation_message_history (conversation_id, id),  -- history reads in order
+    KEY ix_conversation_message_created (created_at)  -- retention
+);
+
+CREATE TABLE IF NOT EXISTS conversation_state (
+    conversation_id VARCHAR(64) PRIMARY KEY,
+    state JSON NOT NULL,  -- order info as returned by detect_missing_info
+    turns INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
@@ -0,0 +1,102 @@
+import json
+
+# States of the top-level object scanner
+_BEFORE_OBJECT, _BEFORE_KEY, _IN_KEY, _BEFORE_COLON, _BEFORE_VALUE, _IN_STRING, _IN_OTHER, _AFTER_VALUE, _DONE = range(9)
+
+
+class JsonFieldStream:
+    """Incremental parser for a flat JSON object arriving in chunks.
+
+    feed() returns the (key, value) pairs completed by that chunk, so a field can be
+    acted on while the model is still generating the ones after it.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self._state = _BEFORE_OBJECT
+        self._token = []
+        self._key = None
+        self._escape = False
+        self._depth = 0
+        self._quoted = False
+
+    def feed(self, chunk):
+        completed = []
+        for ch in chunk:
+            state = self._state
+            if state == _BEFORE_OBJECT:
+                if ch == "{":
+                    self._state = _BEFORE_KEY
+            elif state == _BEFORE_KEY:
+                if ch == '"':
+                    self._token = [ch]
+                    self._state = _IN_KEY
+                elif ch == "}":
+                    self._state = _DONE
+            elif state in (_IN_KEY, _IN_STRING):
+                self._token.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    text = json.loads("".join(self._token))
+                    if state == _IN_KEY:
+                        self._key = text
+                        self._state = _BEFORE_COLON
+                    else:
+                        completed.append(self._complete(text))
+            elif state == _BEFORE_COLON:
+                if ch == ":":
+                    self._state = _BEFORE_VALUE
+            elif state == _BEFORE_VALUE:
+                if ch == '"':
+                    self._token = [ch]
+                    self._state = _IN_STRING
+                elif not ch.isspace():
+                    # Numbers, literals and nested values are collected until the next top-level , or }
+                    self._token = []
+                    self._depth = 0
+                    self._quoted = False
+                    self._state = _IN_OTHER
+                    completed.extend(self._other(ch))
+            elif state == _IN_OTHER:
+                completed.extend(self._other(ch))
+            elif state == _AFTER_VALUE:
+                if ch == ",":
+                    self._state = _BEFORE_KEY
+                elif ch == "}":
+                    self._state = _DONE
+        return completed
+
+    @property
+    def done(self):
+        return self._state == _DONE
+
+    def _complete(self, value):
+        self.fields[self._key] = value
+        self._state = _AFTER_VALUE
+        return self._key, value
+
+    def _other(self, ch):
+        if self._quoted:
+            self._token.append(ch)
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._quoted = False
+            return []
+        if self._depth == 0 and ch in ",}":
+            pair = self._complete(json.loads("".join(self._token)))
+            self._state = _BEFORE_KEY if ch == "," else _DONE
+            return [pair]
+        self._token.append(ch)
+        if ch == '"':
+            self._quoted = True
+        elif ch in "[{":
+            self._depth += 1
+        elif ch in "]}":
+            self._depth -= 1
+        return []
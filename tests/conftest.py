@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Modules live at the repository root; keep caches and snapshots off the working tree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("EMBEDDING_CACHE_PATH", "")
+os.environ.setdefault("RAG_INDEX_DIR", "")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,221 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import async_pipeline
+import order_state
+import rag
+import turn_steps
+from bench_fakes import fake_embedding
+from debounce import Turn
+from response_cache import SemanticResponseCache
+
+ANSWER = {"answer_only": "Dạ bé nhà mình mặc cỡ 90 ạ", "question_ask_next": "Chị lấy màu nào ạ?"}
+INFO_STATUS = {"đơn hàng": [{"kích thước": "90", "màu sắc": None, "số bộ": 1}],
+               "số điện thoại": None, "địa chỉ giao hàng": None}
+
+
+def _response(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+def _stream_events(content, size=7):
+    events = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[i:i + size]))])
+              for i in range(0, len(content), size)]
+    return events + [SimpleNamespace(choices=[], usage=None)]
+
+
+class FakeLLM:
+    # Answers every request with the next queued reply; records the request kwargs
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=self)
+
+    def _next(self, kwargs):
+        self.requests.append(kwargs)
+        content = self.replies.pop(0)
+        return _stream_events(content) if kwargs.get("stream") else _response(content)
+
+    def create(self, **kwargs):
+        return self._next(kwargs)
+
+
+class FakeAsyncLLM(FakeLLM):
+    async def create(self, **kwargs):
+        result = self._next(kwargs)
+        if not kwargs.get("stream"):
+            return result
+
+        async def events():
+            for event in result:
+                await asyncio.sleep(0)
+                yield event
+        return events()
+
+
+@pytest.fixture
+def sync_llm(monkeypatch):
+    def install(*replies):
+        llm = FakeLLM(*replies)
+        monkeypatch.setattr(rag, "openai", llm)
+        monkeypatch.setattr(order_state, "openai", llm)
+        return llm
+    return install
+
+
+@pytest.mark.parametrize("next_missing, question", [
+    ("đơn hàng 1: màu sắc", "bé 2 tuổi 12kg mặc cỡ nào"),
+    (None, "để em xem lại đã"),
+])
+def test_async_answer_matches_sync(sync_llm, next_missing, question):
+    reply = json.dumps(ANSWER, ensure_ascii=False) if next_missing else "3"
+    sync = sync_llm(reply)
+    expected = rag.answer_question(question, ["Size 90 cho bé 11-14kg"], next_missing, INFO_STATUS)
+
+    llm = FakeAsyncLLM(reply)
+    result = asyncio.run(async_pipeline.answer_question_async(
+        llm, question, ["Size 90 cho bé 11-14kg"], next_missing, INFO_STATUS
+    ))
+    assert result == expected
+    assert llm.requests == sync.requests
+
+
+def test_clear_intent_is_answered_without_the_llm():
+    llm = FakeAsyncLLM()
+    result = asyncio.run(async_pipeline.answer_question_async(llm, "0912345678", [], None, INFO_STATUS))
+    assert result == rag.intent_reply("1", INFO_STATUS)
+    assert llm.requests == []
+
+
+def test_stream_reports_fields_as_they_complete(sync_llm):
+    reply = json.dumps(ANSWER, ensure_ascii=False)
+    sync_fields = []
+    sync = sync_llm(reply)
+    expected = rag.answer_question_stream("cỡ nào", [], "đơn hàng 1: màu sắc", INFO_STATUS,
+                                          lambda name, value: sync_fields.append((name, value)))
+
+    fields = []
+
+    async def on_field(name, value):
+        fields.append((name, value))
+
+    llm = FakeAsyncLLM(reply)
+    result = asyncio.run(async_pipeline.answer_question_stream_async(
+        llm, "cỡ nào", [], "đơn hàng 1: màu sắc", INFO_STATUS, on_field
+    ))
+    assert result == expected == ANSWER
+    assert fields == sync_fields == list(ANSWER.items())
+    assert llm.requests == sync.requests
+    assert llm.requests[0]["stream"] is True
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    store = {"c": ({"đơn hàng": [{"kích thước": "90", "màu sắc": None, "số bộ": 1}]}, 1)}
+    monkeypatch.setattr(order_state, "load_order_state", lambda convo_id: store.get(convo_id, (None, 0)))
+    monkeypatch.setattr(order_state, "save_order_state", lambda convo_id, state, turns: store.__setitem__(convo_id, (state, turns)))
+    return store
+
+
+def test_low_confidence_update_is_re_extracted_like_sync(saved, sync_llm):
+    incremental = json.dumps({"đơn hàng": [{"kích thước": "100"}], "độ tin cậy": 0.2}, ensure_ascii=False)
+    extracted = json.dumps(INFO_STATUS, ensure_ascii=False)
+    history = lambda *args: ["chị lấy cỡ 90"]
+
+    before = saved["c"]
+    sync = sync_llm(incremental, extracted)
+    expected = order_state.update_order_state("c", "đổi cái kia nhé", history)
+    saved["c"] = before
+
+    llm = FakeAsyncLLM(incremental, extracted)
+    state = asyncio.run(order_state.update_order_state_async(llm, "c", "đổi cái kia nhé", history))
+    assert state == expected == INFO_STATUS
+    assert llm.requests == sync.requests
+    assert saved["c"] == (INFO_STATUS, 2)
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    # Everything around handle_chatwoot_message_async faked: records what was sent and stored
+    calls = {"sent": [], "recorded": []}
+
+    class FakeRag:
+        retrieval_mode = "hybrid"
+        generation = 1
+
+        def search(self, query, convo_id=None):
+            return [("Size 90 cho bé 11-14kg", 0.1)]
+
+    async def update_order_state_async(client, convo_id, message, load_history, before_save=None):
+        before_save()
+        return calls["info_status"]
+
+    async def send(http, convo_id, text):
+        calls["sent"].append(text)
+
+    calls["info_status"] = INFO_STATUS
+    calls["llm"] = FakeAsyncLLM()
+    monkeypatch.setattr(async_pipeline, "_clients", lambda: (calls["llm"], None))
+    monkeypatch.setattr(async_pipeline, "get_shared_rag", lambda: FakeRag())
+    monkeypatch.setattr(async_pipeline, "chatwoot_auth", SimpleNamespace(get=lambda: ("token", 1)))
+    monkeypatch.setattr(async_pipeline, "update_order_state_async", update_order_state_async)
+    monkeypatch.setattr(async_pipeline, "send_message_to_chatwoot_async", send)
+    monkeypatch.setattr(async_pipeline, "record_turn", lambda convo_id, items: calls["recorded"].append(items))
+    monkeypatch.setattr(async_pipeline, "embed_text", fake_embedding)
+    monkeypatch.setattr(turn_steps, "response_cache", SemanticResponseCache(threshold=0.95))
+    return calls
+
+
+def _run_turn(query, convo_id="c"):
+    turn = Turn(convo_id, [(1, query)])
+    asyncio.run(async_pipeline.handle_chatwoot_message_async(query, convo_id, turn))
+    return turn
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_turn_records_and_sends_the_answer(pipeline, monkeypatch, stream):
+    monkeypatch.setattr(async_pipeline, "STREAM_ANSWERS", stream)
+    pipeline["llm"].replies.append(json.dumps(ANSWER, ensure_ascii=False))
+
+    turn = _run_turn("bé 12kg mặc cỡ nào")
+    assert turn.committed
+    assert pipeline["sent"] == [ANSWER["answer_only"], ANSWER["question_ask_next"]]
+    assert pipeline["recorded"] == [turn_steps.transcript_messages("bé 12kg mặc cỡ nào", ANSWER)]
+
+
+def test_repeated_question_is_served_from_the_response_cache(pipeline):
+    pipeline["llm"].replies.append(json.dumps(ANSWER, ensure_ascii=False))
+    _run_turn("bé 12kg mặc cỡ nào")
+    _run_turn("bé 12kg mặc cỡ nào")
+    assert len(pipeline["llm"].requests) == 1
+    assert pipeline["sent"] == [ANSWER["answer_only"], ANSWER["question_ask_next"]] * 2
+
+
+def test_completed_order_is_answered_by_intent_without_caching(pipeline):
+    pipeline["info_status"] = {"đơn hàng": [{"kích thước": "90", "màu sắc": "hồng", "số bộ": 1}],
+                               "số điện thoại": "0912345678", "địa chỉ giao hàng": "Hà Nội"}
+    _run_turn("ok chốt nhé")
+    reply = rag.intent_reply("2", pipeline["info_status"])
+    assert pipeline["sent"] == [reply["answer_only"], reply["question_ask_next"]]
+    assert pipeline["llm"].requests == []
+    assert len(turn_steps.response_cache._entries) == 0
+
+
+def test_replies_skip_what_was_sent_early():
+    assert turn_steps.replies(ANSWER, set()) == [ANSWER["answer_only"], ANSWER["question_ask_next"]]
+    assert turn_steps.replies(ANSWER, {"answer_only"}) == [ANSWER["question_ask_next"]]
+    assert turn_steps.sends_early("answer_only", "Dạ")
+    assert not turn_steps.sends_early("answer_only", "")
+    assert not turn_steps.sends_early("question_ask_next", "Chị lấy màu nào ạ?")
+
+
+def test_response_cache_is_skipped_for_lexical_retrieval(monkeypatch):
+    monkeypatch.setattr(turn_steps, "response_cache", SemanticResponseCache())
+    lexical = SimpleNamespace(retrieval_mode="lexical", generation=1)
+    hybrid = SimpleNamespace(retrieval_mode="hybrid", generation=1)
+    assert turn_steps.turn_response_cache(lexical, "đơn hàng 1: màu sắc") is None
+    assert turn_steps.turn_response_cache(hybrid, None) is None
+    assert turn_steps.turn_response_cache(hybrid, "đơn hàng 1: màu sắc") is turn_steps.response_cache
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+import chatwoot
+from chatwoot import ChatwootAuth
+
+
+@pytest.fixture
+def server(monkeypatch):
+    state = {"valid": {"saved"}, "logins": 0, "validations": 0, "fail_login": False}
+
+    def validate_token(token):
+        state["validations"] += 1
+        time.sleep(0.01)
+        return (True, 7) if token in state["valid"] else (False, None)
+
+    def login_to_chatwoot():
+        state["logins"] += 1
+        if state["fail_login"]:
+            raise RuntimeError("Chatwoot authentication failed")
+        token = f"token-{state['logins']}"
+        state["valid"].add(token)
+        return token
+
+    monkeypatch.setattr(chatwoot, "validate_token", validate_token)
+    monkeypatch.setattr(chatwoot, "login_to_chatwoot", login_to_chatwoot)
+    monkeypatch.setattr(chatwoot, "get_saved_token", lambda: "saved")
+    return state
+
+
+def test_saved_token_is_validated_once_and_cached(server):
+    auth = ChatwootAuth(ttl=60)
+    assert auth.get() == ("saved", 7)
+    assert auth.get() == ("saved", 7)
+    assert server["validations"] == 1 and server["logins"] == 0
+
+
+def test_concurrent_callers_share_one_refresh(server):
+    server["valid"].clear()  # the saved token was revoked
+    auth = ChatwootAuth(ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(auth.get())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(2)
+    assert results == [("token-1", 7)] * 8
+    assert server["logins"] == 1
+
+
+def test_expired_entry_is_revalidated(server, monkeypatch):
+    auth = ChatwootAuth(ttl=60)
+    auth.get()
+    now = time.monotonic()
+    monkeypatch.setattr(chatwoot.time, "monotonic", lambda: now + 61)
+    auth.get()
+    assert server["validations"] == 2 and server["logins"] == 0
+
+
+def test_invalidate_logs_in_again_only_for_the_current_token(server):
+    auth = ChatwootAuth(ttl=60)
+    auth.get()
+    server["valid"].discard("saved")
+    assert auth.invalidate("saved") == ("token-1", 7)
+    assert auth.invalidate("saved") == ("token-1", 7)  # a second 401 from the same old token
+    assert server["logins"] == 1
+
+
+def test_failed_login_raises_and_is_retried_next_time(server):
+    server["valid"].clear()
+    server["fail_login"] = True
+    auth = ChatwootAuth(ttl=60)
+    with pytest.raises(RuntimeError):
+        auth.get()
+    server["fail_login"] = False
+    assert auth.get() == ("token-2", 7)
+
+
+def test_send_retries_once_with_a_fresh_token_after_401(server, monkeypatch):
+    monkeypatch.setattr(chatwoot, "chatwoot_auth", ChatwootAuth(ttl=60))
+    posts = []
+
+    class Response:
+        def __init__(self, status):
+            self.status_code = status
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"id": len(posts)}
+
+    def post(url, headers, json, timeout):
+        posts.append(headers["api_access_token"])
+        return Response(200 if headers["api_access_token"] in server["valid"] else 401)
+
+    monkeypatch.setattr(chatwoot.session, "post", post)
+    chatwoot.chatwoot_auth.get()
+    server["valid"].discard("saved")
+    assert chatwoot.send_message_to_chatwoot(1, "Dạ") == {"id": 2}
+    assert posts == ["saved", "token-1"]
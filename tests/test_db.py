@@ -0,0 +1,118 @@
+import mysql.connector
+import pytest
+
+import rag
+from bench_fakes import SQLitePool, fake_embedding
+
+DIM = 32
+
+
+class TrackingPool(SQLitePool):
+    # Counts borrowed connections still open and pings sent
+    def __init__(self, path):
+        super().__init__(path)
+        self.open = 0
+        self.pings = 0
+
+    def get_connection(self):
+        pool, conn = self, super().get_connection()
+
+        class Borrowed:
+            _cnx = conn._conn
+
+            def __getattr__(self, name):
+                return getattr(conn, name)
+
+            def ping(self, **kwargs):
+                pool.pings += 1
+
+            def close(self):
+                pool.open -= 1
+                conn.close()
+
+        self.open += 1
+        return Borrowed()
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    pool = TrackingPool(str(tmp_path / "test.sqlite3"))
+    monkeypatch.setattr(rag, "get_db_pool", lambda: pool)
+    monkeypatch.setattr(rag, "_db_borrowed_at", {})
+    embedded = []
+
+    def embed_texts(texts):
+        assert pool.open == 0, "embedding while holding a connection"
+        embedded.extend(texts)
+        return [fake_embedding(t, DIM) for t in texts]
+
+    monkeypatch.setattr(rag, "embed_texts", embed_texts)
+    monkeypatch.setattr(rag, "embed_text", lambda text: embed_texts([text])[0])
+    pool.embedded = embedded
+    return pool
+
+
+def test_connect_db_pings_only_after_idling(pool, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rag.time, "monotonic", lambda: now[0])
+    rag.connect_db().close()
+    now[0] += 5
+    rag.connect_db().close()
+    assert pool.pings == 0
+    now[0] += rag.DB_PING_IDLE_SECONDS + 1
+    rag.connect_db().close()
+    assert pool.pings == 1
+    rag.connect_db().close()
+    assert pool.pings == 1
+
+
+def test_connect_db_waits_for_a_free_connection_then_gives_up(monkeypatch):
+    class Exhausted:
+        calls = 0
+
+        def get_connection(self):
+            self.calls += 1
+            raise mysql.connector.errors.PoolError("pool exhausted")
+
+    exhausted = Exhausted()
+    monkeypatch.setattr(rag, "get_db_pool", lambda: exhausted)
+    monkeypatch.setattr(rag, "DB_POOL_TIMEOUT", 0.12)
+    with pytest.raises(mysql.connector.errors.PoolError):
+        rag.connect_db()
+    assert exhausted.calls >= 2
+
+
+def test_store_knowledge_embeds_outside_the_connection_and_only_once(pool):
+    first = rag.store_knowledge("Giá mỗi bộ 175k")
+    assert rag.store_knowledge("Giá mỗi bộ  175k") == first
+    assert pool.embedded == ["Giá mỗi bộ 175k"]
+    assert pool.open == 0
+
+
+def test_store_and_link_many_writes_one_batched_transaction(pool):
+    index = rag.RAG(dim=DIM)
+    index.load_from_db()
+    index.store_and_link_many("c", [("size 90", "user"), ("Dạ vâng", "bot")])
+    pool.queries = 0
+    ids = index.store_and_link_many("c", [("size 90", "user"), ("màu hồng", "user"), ("màu hồng", "user")])
+    # DB lookup of the unknown text, one executemany for knowledge, the id lookup, one for the links
+    assert pool.queries == 4
+    assert ids[1] == ids[2] and len(set(ids)) == 2
+    assert pool.embedded == ["size 90", "Dạ vâng", "màu hồng"]
+    assert pool.open == 0
+
+    cursor = pool.get_connection().cursor()
+    cursor.execute("SELECT COUNT(*) FROM conversation_link WHERE conversation_id = 'c'")
+    assert cursor.fetchone()[0] == 3
+
+
+def test_store_and_link_many_rolls_back_the_whole_turn(pool, monkeypatch):
+    index = rag.RAG(dim=DIM)
+    index.load_from_db()
+    monkeypatch.setattr(rag, "_lookup_knowledge_ids", lambda cursor, texts: {})  # links then hit a KeyError
+    with pytest.raises(KeyError):
+        index.store_and_link_many("c", [("size 90", "user")])
+    cursor = pool.get_connection().cursor()
+    cursor.execute("SELECT COUNT(*) FROM knowledge")
+    assert cursor.fetchone()[0] == 0
+    assert len(index.texts) == 0
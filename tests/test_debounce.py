@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from debounce import MessageDebouncer, Turn, TurnSuperseded
+from worker_pool import QueueFull
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+        self.event = threading.Event()
+
+    def __call__(self, convo_id, query, turn):
+        self.calls.append((convo_id, query, turn))
+        self.event.set()
+
+    def wait(self, count, timeout=5):
+        while len(self.calls) < count:
+            assert self.event.wait(timeout), f"only {len(self.calls)} turns dispatched"
+            self.event.clear()
+        return self.calls
+
+
+def test_turn_commit_and_supersede():
+    turn = Turn("c", [(1, "a")])
+    assert turn.supersede()
+    with pytest.raises(TurnSuperseded):
+        turn.check()
+    with pytest.raises(TurnSuperseded):
+        turn.commit()
+
+    committed = Turn("c", [(1, "a")])
+    committed.commit()
+    assert not committed.supersede()
+    committed.check()
+
+
+def test_burst_is_merged_into_one_turn():
+    submit = Recorder()
+    debouncer = MessageDebouncer(submit, window=0.05, max_wait=1).start()
+    for i, text in enumerate(["size 90", "màu hồng", "2 bộ"]):
+        debouncer.add("c", text, message_id=i)
+    (convo_id, query, turn), = submit.wait(1)
+    assert (convo_id, query) == ("c", "size 90\nmàu hồng\n2 bộ")
+    assert [key for key, _ in turn.messages] == [0, 1, 2]
+    assert debouncer.stats()["merged"] == 2
+
+
+def test_redelivered_message_id_is_dropped():
+    submit = Recorder()
+    debouncer = MessageDebouncer(submit, window=0.05).start()
+    assert debouncer.add("c", "size 90", message_id=7)
+    assert not debouncer.add("c", "size 90", message_id=7)
+    assert submit.wait(1)[0][1] == "size 90"
+    assert debouncer.stats()["duplicates"] == 1
+
+
+def test_new_message_supersedes_uncommitted_turn():
+    submit = Recorder()
+    debouncer = MessageDebouncer(submit, window=0.05).start()
+    debouncer.add("c", "size 90", message_id=1)
+    first = submit.wait(1)[0][2]
+
+    debouncer.add("c", "màu hồng", message_id=2)
+    assert first.cancelled
+    _, query, second = submit.wait(2)[1]
+    assert query == "size 90\nmàu hồng"
+
+    # Once committed, later input gets a turn of its own
+    second.commit()
+    debouncer.add("c", "2 bộ", message_id=3)
+    assert submit.wait(3)[2][1] == "2 bộ"
+    assert not second.cancelled
+
+
+def test_requeue_after_concurrent_supersede_does_not_duplicate():
+    submit = Recorder()
+    state = {"rejected": False}
+
+    def flaky_submit(convo_id, query, turn):
+        if not state["rejected"]:
+            state["rejected"] = True
+            # A message arrives while the rejected turn is still registered as in flight
+            debouncer.add(convo_id, "màu hồng", message_id=2)
+            raise QueueFull()
+        submit(convo_id, query, turn)
+
+    debouncer = MessageDebouncer(flaky_submit, window=0.05, retry_after=0.05).start()
+    debouncer.add("c", "size 90", message_id=1)
+    assert submit.wait(1)[0][1] == "size 90\nmàu hồng"
+    assert debouncer.stats()["requeued"] == 1
+
+
+def test_shutdown_flushes_buffered_messages():
+    submit = Recorder()
+    debouncer = MessageDebouncer(submit, window=60, max_wait=60).start()
+    debouncer.add("c", "size 90")
+    debouncer.shutdown(timeout=5)
+    assert submit.calls[0][1] == "size 90"
+    assert debouncer.stats()["buffered_conversations"] == 0
+
+
+def test_wrap_clears_inflight_turn():
+    debouncer = MessageDebouncer(lambda *args: None)
+    turn = Turn("c", [])
+    debouncer._inflight["c"] = turn
+    with pytest.raises(RuntimeError):
+        debouncer.wrap(lambda *args: (_ for _ in ()).throw(RuntimeError()))("q", "c", turn)
+    assert debouncer.stats()["inflight_turns"] == 0
@@ -0,0 +1,54 @@
+import threading
+
+import numpy as np
+import pytest
+
+from embedding_batcher import EmbeddingBatcher
+
+
+def fake_embed(calls):
+    def embed(texts):
+        calls.append(list(texts))
+        return [np.full(4, len(t), dtype=np.float32) for t in texts]
+    return embed
+
+
+def test_concurrent_requests_share_one_call_and_duplicates_are_sent_once():
+    calls = []
+    batcher = EmbeddingBatcher(fake_embed(calls), window=0.2, max_batch=16)
+    texts = ["a", "bb", "a", "ccc"]
+    results = [None] * len(texts)
+    start = threading.Barrier(len(texts))
+
+    def request(i):
+        start.wait()
+        results[i] = batcher.embed(texts[i], timeout=2)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(len(texts))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(2)
+    assert len(calls) == 1 and sorted(calls[0]) == ["a", "bb", "ccc"]
+    assert [r[0] for r in results] == [1, 2, 1, 3]
+    assert batcher.stats() == {"requests": 4, "batches": 1, "avg_batch_size": 4.0}
+
+
+def test_zero_window_embeds_inline():
+    calls = []
+    batcher = EmbeddingBatcher(fake_embed(calls), window=0)
+    assert batcher.embed("abcd")[0] == 4
+    assert calls == [["abcd"]]
+    assert batcher._thread is None
+
+
+def test_errors_reach_every_waiting_caller():
+    def embed(texts):
+        raise RuntimeError("api down")
+
+    batcher = EmbeddingBatcher(embed, window=0.01)
+    with pytest.raises(RuntimeError, match="api down"):
+        batcher.embed("a", timeout=2)
+    # The batcher thread survives and serves the next request
+    with pytest.raises(RuntimeError):
+        batcher.embed("b", timeout=2)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache
+
+
+def test_memory_tier_normalizes_keys_and_returns_read_only_vectors():
+    cache = EmbeddingCache(max_memory_items=10)
+    assert cache.get("m", "Size 90") is None
+    cache.put("m", "Size 90", [1, 2, 3])
+    vec = cache.get("m", " Size  90\n")
+    assert vec.tolist() == [1, 2, 3] and vec.dtype == np.float32
+    with pytest.raises(ValueError):
+        vec[0] = 5
+    assert cache.get("other-model", "Size 90") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_memory_tier_is_lru_bounded():
+    cache = EmbeddingCache(max_memory_items=2)
+    cache.put("m", "a", [1])
+    cache.put("m", "b", [2])
+    cache.get("m", "a")
+    cache.put("m", "c", [3])
+    assert cache.get("m", "b") is None
+    assert cache.get("m", "a") is not None
+    assert cache.stats()["memory_items"] == 2
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    EmbeddingCache(path).put("m", "xin chào", [0.5, 0.25])
+    cache = EmbeddingCache(path, max_memory_items=10)
+    assert cache.stats()["disk_items"] == 1
+    assert cache.get("m", "xin chào").tolist() == [0.5, 0.25]
+    assert cache.stats()["disk_hits"] == 1
+    cache.get("m", "xin chào")
+    assert cache.stats()["disk_hits"] == 1  # now served from memory
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_memory_items=1, max_disk_items=10)
+    for i in range(11):
+        cache.put("m", f"text {i}", [i])
+    assert cache.stats()["disk_items"] == 9  # 11 - (1 over + 10%)
+    assert cache.get("m", "text 0") is None
+    assert cache.get("m", "text 10").tolist() == [10]
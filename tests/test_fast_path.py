@@ -0,0 +1,70 @@
+import pytest
+
+from fast_path import apply_slots, classify_intent, extract_slots
+
+ONE_ORDER = {
+    "đơn hàng": [{"kích thước": "90", "màu sắc": "hồng", "số bộ": 1}],
+    "số điện thoại": None,
+    "địa chỉ giao hàng": None,
+}
+
+
+@pytest.mark.parametrize("message, slots", [
+    ("size 90", {"kích thước": "90"}),
+    ("100", {"kích thước": "100"}),
+    ("màu trắng nhé", {"màu sắc": "trắng"}),
+    ("mau xanh com", {"màu sắc": "xanh cốm"}),
+    ("lấy 2 bộ", {"số bộ": 2}),
+    ("sđt 0912 345 678", {"số điện thoại": "0912345678"}),
+    ("+84912345678", {"số điện thoại": "0912345678"}),
+    ("chị lấy size 110 màu đen 3 bộ", {"kích thước": "110", "màu sắc": "đen", "số bộ": 3}),
+])
+def test_extract_slots(message, slots):
+    assert extract_slots(message) == slots
+
+
+@pytest.mark.parametrize("message", [
+    "thêm 2 bộ màu trắng",  # a second order, not a change to the first
+    "lấy thêm 1 bộ",
+    "bộ này giá bao nhiêu",
+    "hong biết size nào",
+    "size 90 hay 100 vậy em",
+    "",
+])
+def test_extract_slots_leaves_ambiguous_messages_to_the_llm(message):
+    assert extract_slots(message) is None
+
+
+def test_apply_slots_updates_the_single_order():
+    state = apply_slots(ONE_ORDER, {"màu sắc": "trắng", "số bộ": 2})
+    assert state["đơn hàng"] == [{"kích thước": "90", "màu sắc": "trắng", "số bộ": 2}]
+    assert ONE_ORDER["đơn hàng"][0]["màu sắc"] == "hồng"  # input is not mutated
+
+
+def test_apply_slots_starts_an_order_and_keeps_phone():
+    state = apply_slots({}, {"kích thước": "80", "số điện thoại": "0912345678"})
+    assert state["đơn hàng"] == [{"kích thước": "80", "màu sắc": None, "số bộ": None}]
+    assert state["số điện thoại"] == "0912345678"
+    assert state["địa chỉ giao hàng"] is None
+
+
+def test_apply_slots_refuses_to_guess_between_orders():
+    state = {"đơn hàng": [ONE_ORDER["đơn hàng"][0], {"kích thước": "100", "màu sắc": None, "số bộ": 1}]}
+    assert apply_slots(state, {"màu sắc": "đen"}) is None
+    assert apply_slots(state, {"số điện thoại": "0912345678"})["số điện thoại"] == "0912345678"
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("0912345678", "1"),
+    ("sđt em 0912.345.678 nhé", "1"),
+    ("ok chốt đơn em nhé", "2"),
+    ("oke em", "2"),
+    ("Dạ ok chị", "2"),
+    ("chốt nhé", "2"),
+    ("dạ", None),  # an acknowledgement is not a confirmation
+    ("Dạ chị", None),
+    ("vâng", None),
+    ("shop ơi bộ này giá bao nhiêu", None),
+])
+def test_classify_intent(message, intent):
+    assert classify_intent(message) == intent
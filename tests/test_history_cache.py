@@ -0,0 +1,70 @@
+import history_cache
+from history_cache import ConversationHistoryCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(history_cache.time, "monotonic", clock)
+    table = {"a": ["hi"], "b": ["yo"], "c": []}
+    loads = []
+
+    def load(convo_id):
+        loads.append(convo_id)
+        return table[convo_id]
+
+    return ConversationHistoryCache(load, **kwargs), clock, loads
+
+
+def test_loads_once_then_serves_copies(monkeypatch):
+    cache, _, loads = make(monkeypatch)
+    first = cache.get("a")
+    first.append("mutated")
+    assert cache.get("a") == ["hi"]
+    assert cache.messages("a", last_n=1) == ["hi"]
+    assert loads == ["a"]
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_append_writes_through_only_cached_conversations(monkeypatch):
+    cache, _, loads = make(monkeypatch)
+    cache.append("a", ["not cached"])
+    cache.get("a")
+    cache.append("a", ["size 90", "Dạ vâng"])
+    assert cache.get("a") == ["hi", "size 90", "Dạ vâng"]
+    assert loads == ["a"]
+
+
+def test_rows_from_another_writer_show_up_after_the_ttl_despite_write_through(monkeypatch):
+    cache, clock, loads = make(monkeypatch, ttl=10)
+    table = {"a": ["hi"]}
+    cache.load = lambda convo_id: loads.append(convo_id) or list(table[convo_id])
+    cache.get("a")
+    for _ in range(3):
+        clock.now += 3
+        table["a"].append("ours")
+        cache.append("a", ["ours"])  # this worker's turns keep the entry busy
+    table["a"].append("from another worker")
+    assert "from another worker" not in cache.get("a")  # within the TTL
+    clock.now += 2  # 11s after the load, 2s after the last write-through
+    assert cache.get("a") == ["hi", "ours", "ours", "ours", "from another worker"]
+    assert len(loads) == 2
+
+
+def test_least_recently_used_conversation_is_evicted(monkeypatch):
+    cache, _, loads = make(monkeypatch, max_conversations=2)
+    cache.get("a")
+    cache.get("b")
+    cache.append("a", ["x"])  # a write counts as a use
+    cache.get("c")
+    assert cache.stats()["conversations"] == 2
+    cache.get("a")
+    cache.get("b")
+    assert loads == ["a", "b", "c", "b"]
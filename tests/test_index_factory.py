@@ -0,0 +1,61 @@
+import warnings
+
+import faiss
+import numpy as np
+import pytest
+
+import rag
+from index_factory import build_index, index_kind, index_spec, search_params
+
+DIM = 16
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    rng = np.random.default_rng(0)
+    vecs = rng.standard_normal((400, DIM)).astype(np.float32)
+    faiss.normalize_L2(vecs)
+    return vecs
+
+
+def test_index_spec_and_unknown_kind():
+    assert index_spec("opq_ivf_pq", 8, pq_m=4) == "OPQ4,IVF8,PQ4"
+    with pytest.raises(ValueError):
+        index_spec("annoy", 8)
+
+
+def test_ivf_falls_back_to_flat_without_enough_training_vectors(vectors):
+    assert index_kind(build_index("ivf_flat", DIM, vectors=vectors[:100], nlist=4)) == "flat"
+    assert index_kind(build_index("ivf_flat", DIM, vectors=vectors, nlist=4)) == "ivf"
+
+
+@pytest.mark.parametrize("kind, params_type", [
+    ("flat", faiss.SearchParameters), ("hnsw", faiss.SearchParametersHNSW), ("ivf_flat", faiss.SearchParametersIVF),
+])
+def test_selector_restricts_hits_for_every_kind(vectors, kind, params_type):
+    index = build_index(kind, DIM, "ip", vectors, nlist=4, hnsw_m=8)
+    ids = np.arange(1000, 1000 + len(vectors), dtype=np.int64)
+    index.add_with_ids(vectors, ids)
+    if kind == "flat":
+        assert search_params(index) is None  # nothing to tune and nothing to filter
+
+    allowed = ids[::7]
+    params = search_params(index, faiss.IDSelectorBatch(allowed), nprobe=4, ef_search=64)
+    assert type(params) is params_type
+    _, I = index.search(vectors[:3], 5, params=params)
+    assert set(I.ravel()) <= set(allowed.tolist())
+    # Each query vector is its own nearest neighbour when allowed
+    _, I = index.search(vectors[:1], 1, params=search_params(index, faiss.IDSelectorBatch(ids[:1]), nprobe=4))
+    assert I[0][0] == ids[0]
+
+
+def test_fewer_rows_than_k_gives_no_padding_hits(vectors):
+    index = rag.RAG(dim=DIM, metric="ip")
+    index.index.add_with_ids(vectors[:2], np.array([1, 2], dtype=np.int64))
+    index.texts = {1: "a", 2: "b"}
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # 2 - 2 * -FLT_MAX overflows
+        hits = index._search_faiss(vectors[0], 5)
+    assert [text for text, _ in hits] == ["a", "b"]
+    assert hits[0][1] == pytest.approx(0, abs=1e-5)
+    assert all(np.isfinite(d) for _, d in hits)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+import rag
+from index_factory import INDEX_TYPES, build_index, index_kind
+from index_store import IndexStore
+
+DIM = 16
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((400, DIM)).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def built(vectors):
+    # PQ training is the slow part, so each kind is built once for both mmap modes
+    cache = {}
+
+    def get(kind):
+        if kind not in cache:
+            index = build_index(kind, DIM, vectors=vectors, nlist=4, pq_m=4, hnsw_m=8)
+            index.add_with_ids(vectors, np.arange(100, 100 + len(vectors), dtype=np.int64))
+            cache[kind] = index
+        return cache[kind]
+    return get
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+@pytest.mark.parametrize("kind", INDEX_TYPES)
+def test_snapshot_reload_every_kind(tmp_path, vectors, built, kind, mmap):
+    index = built(kind)
+    ids = np.arange(100, 100 + len(vectors), dtype=np.int64)
+    expected_kind = "ivf" if kind.startswith(("ivf", "opq")) else kind
+    assert index_kind(index) == expected_kind
+
+    store = IndexStore(str(tmp_path), mmap=mmap)
+    with store.lock():
+        generation = store.write_snapshot(index, ids.tolist(), [f"text {i}" for i in ids])
+
+    # A second worker opening the snapshot written by the first
+    loaded_generation, loaded, loaded_ids, texts = IndexStore(str(tmp_path), mmap=mmap).load_snapshot()
+    assert loaded_generation == generation
+    assert loaded.ntotal == len(vectors)
+    assert loaded_ids == ids.tolist()
+    assert texts[0] == "text 100"
+    assert index_kind(loaded) == expected_kind
+
+    _, expected = index.search(vectors[:5], 3)
+    _, found = loaded.search(vectors[:5], 3)
+    np.testing.assert_array_equal(found, expected)
+
+
+def test_delta_log_round_trip(tmp_path):
+    store = IndexStore(str(tmp_path))
+    with store.lock():
+        generation = store.write_snapshot(build_index("flat", DIM), [], [])
+    vec = np.ones(DIM, dtype=np.float32)
+    store.append_delta(7, "màu hồng", vec)
+    store.append_delta(8, "size 90", vec * 2)
+
+    records, offset = store.read_delta(generation)
+    assert [(id, text) for id, text, _ in records] == [(7, "màu hồng"), (8, "size 90")]
+    np.testing.assert_array_equal(records[1][2], vec * 2)
+    assert store.read_delta(generation, offset) == ([], offset)
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "ivf_flat"])
+def test_compact_after_reload(tmp_path, vectors, built, kind):
+    ids = np.arange(100, 100 + len(vectors), dtype=np.int64)
+    store = IndexStore(str(tmp_path))
+    with store.lock():
+        store.write_snapshot(built(kind), ids.tolist(), [f"text {i}" for i in ids])
+
+    index = rag.RAG(dim=DIM, store=store, index_type=kind, metric="l2")
+    index.load()  # mapped snapshot
+    rng = np.random.default_rng(1)
+    for round in range(2):
+        for i in range(3):
+            id = 1000 + 10 * round + i
+            store.append_delta(id, f"new {id}", rng.standard_normal(DIM).astype(np.float32))
+        index.refresh(force=True)
+        generation = index.compact()
+        assert generation == round + 2
+        assert index.generation == generation  # reloaded the compacted snapshot
+        assert index.index.ntotal == len(vectors) + 3 * (round + 1)
+        assert index.delta_index.ntotal == 0
+    assert index_kind(index.index) == ("ivf" if kind == "ivf_flat" else kind)
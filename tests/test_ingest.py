@@ -0,0 +1,81 @@
+import argparse
+
+import pytest
+
+import ingest
+import rag
+from bench_fakes import SQLitePool, fake_embedding
+from index_store import IndexStore
+
+DIM = 32
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    pool = SQLitePool(str(tmp_path / "test.sqlite3"))
+    monkeypatch.setattr(rag, "get_db_pool", lambda: pool)
+    monkeypatch.setattr(ingest, "RAG", lambda **kwargs: rag.RAG(dim=DIM, **kwargs))
+    return pool
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    sent = []
+
+    def embed_batch(client, texts, limiter):
+        sent.append(list(texts))
+        return [fake_embedding(t, DIM) for t in texts], len(texts)
+
+    monkeypatch.setattr(ingest, "embed_batch", embed_batch)
+    return sent
+
+
+def ingestor():
+    args = argparse.Namespace(batch_size=2, workers=2, window=1000, chunk_tokens=400, chunk_overlap=1)
+    return ingest.Ingestor(args)
+
+
+def contents(pool):
+    cursor = pool.get_connection().cursor()
+    cursor.execute("SELECT content FROM knowledge ORDER BY id")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def test_window_dedups_and_embeds_through_the_cache(db, requests):
+    ing = ingestor()
+    ing.ingest_window(["Giá 175k", "Ship 2 ngày", "Giá 175k", "Đổi trả 7 ngày"])
+    assert contents(db) == ["Giá 175k", "Ship 2 ngày", "Đổi trả 7 ngày"]
+    assert ing.stats["inserted"] == 3 and ing.stats["duplicates"] == 1
+    assert sorted(t for batch in requests for t in batch) == ["Giá 175k", "Ship 2 ngày", "Đổi trả 7 ngày"]
+
+    # A rerun after the rows were lost (e.g. a rolled back window) costs no requests
+    conn = db.get_connection()
+    conn.cursor().execute("DELETE FROM knowledge")
+    conn.commit()
+    requests.clear()
+    ing.ingest_window(["Giá 175k", "Ship 2 ngày"])
+    assert requests == []
+    assert ing.stats["cached"] == 2
+    assert contents(db) == ["Giá 175k", "Ship 2 ngày"]
+
+
+def test_publish_index_keeps_rows_appended_during_the_build(db, requests, tmp_path, monkeypatch):
+    ingestor().ingest_window(["Giá 175k", "Ship 2 ngày"])
+    monkeypatch.setattr(ingest, "RAG_INDEX_DIR", str(tmp_path / "index"))
+    store = IndexStore(str(tmp_path / "index"))
+    store.write_snapshot(rag.RAG(dim=DIM).index, [], [])
+
+    build = rag.RAG.load_from_db
+
+    def load_while_a_worker_appends(self):
+        stats = build(self)
+        # The lock is free during the build, so this does not block
+        store.append_delta(99, "Màu hồng còn hàng", fake_embedding("Màu hồng còn hàng", DIM))
+        return stats
+
+    monkeypatch.setattr(rag.RAG, "load_from_db", load_while_a_worker_appends)
+    ingest.publish_index()
+
+    _, index, ids, texts = store.load_snapshot()
+    assert sorted(texts) == ["Giá 175k", "Màu hồng còn hàng", "Ship 2 ngày"]
+    assert index.ntotal == 3 and 99 in ids
@@ -0,0 +1,64 @@
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+DOCS = [
+    (10, "Giá mỗi bộ là 175k, mua từ 3 bộ giảm còn 160k"),
+    (11, "Bảng size: 90 cho bé 9-11kg, 100 cho bé 11-13kg"),
+    (12, "Có các màu hồng, trắng, đen và xanh cốm"),
+    (13, "Ship toàn quốc, nội thành 1-2 ngày"),
+]
+
+
+def build():
+    index = LexicalIndex()
+    index.build(DOCS)
+    return index
+
+
+def test_tokenize_folds_tones_and_adds_bigrams():
+    terms = tokenize("Xanh Cốm")
+    assert ("w", "com") in terms
+    assert ("b", "xanh_com") in terms
+    assert ("c", "#co") in terms
+
+
+def test_search_ranks_the_matching_document_first():
+    index = build()
+    assert index.search("giá bao nhiêu 1 bộ")[0][0] == 10
+    assert index.search("mau xanh com")[0][0] == 12  # typed without tones
+    assert index.search("shipp may ngay")[0][0] == 13  # char n-grams still match the typo
+
+
+def test_search_scores_are_descending_and_limited():
+    hits = build().search("bé mặc size 100 màu hồng", k=2)
+    assert len(hits) == 2
+    assert hits[0][1] >= hits[1][1]
+
+
+def test_allowed_restricts_hits():
+    index = build()
+    assert {i for i, _ in index.search("bé size 100 ship")} == {11, 13}
+    assert [i for i, _ in index.search("bé size 100 ship", allowed=[13, 99])] == [13]
+    assert index.search("giá bộ", allowed=[]) == []
+
+
+def test_add_after_build_and_duplicates():
+    index = build()
+    index.add(14, "Đổi trả trong 7 ngày")
+    index.add(14, "Đổi trả trong 7 ngày")
+    assert len(index) == 5
+    assert index.search("đổi trả")[0][0] == 14
+    assert index.stats()["documents"] == 5
+
+
+def test_empty_index_and_query():
+    assert LexicalIndex().search("giá") == []
+    assert build().search("") == []
+
+
+def test_reciprocal_rank_fusion():
+    vector = [("a", 0.1), ("b", 0.2), ("c", 0.3)]
+    lexical = [("b", -9.0), ("d", -5.0)]
+    fused = reciprocal_rank_fusion([vector, lexical], k=3, rrf_k=60)
+    assert [label for label, _ in fused] == ["b", "a", "d"]
+    assert fused[0][1] == -(1 / 62 + 1 / 61)
+    assert all(a[1] <= b[1] for a, b in zip(fused, fused[1:]))
@@ -0,0 +1,34 @@
+import pytest
+
+from metrics import MetricsRegistry, span, registry
+
+
+def test_counters_histograms_and_sources_render_as_prometheus_text():
+    reg = MetricsRegistry(buckets=(0.1, 1.0))
+    reg.inc("stage_errors_total", stage="llm")
+    reg.inc("stage_errors_total", 2, stage="llm")
+    reg.observe("stage_seconds", 0.05, stage="db")
+    reg.observe("stage_seconds", 0.5, stage="db")
+    reg.register_source("pool", lambda: {"depth": 3, "enabled": True, "name": "x"})
+    reg.register_source("broken", lambda: 1 / 0)
+
+    lines = reg.render().splitlines()
+    assert 'stage_errors_total{stage="llm"} 3' in lines
+    assert 'stage_seconds_bucket{stage="db",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="db",le="1.0"} 2' in lines
+    assert 'stage_seconds_bucket{stage="db",le="+Inf"} 2' in lines
+    assert 'stage_seconds_count{stage="db"} 2' in lines
+    assert "# TYPE stage_seconds histogram" in lines
+    assert "pool_depth 3" in lines
+    assert not any(line.startswith(("pool_enabled", "pool_name", "broken_")) for line in lines)
+
+
+def test_span_times_the_block_and_counts_errors():
+    with span("unit_test_stage"):
+        pass
+    with pytest.raises(KeyError):
+        with span("unit_test_stage"):
+            raise KeyError
+    text = registry.render()
+    assert 'stage_seconds_count{stage="unit_test_stage"} 2' in text
+    assert 'stage_errors_total{stage="unit_test_stage"} 1' in text
@@ -0,0 +1,34 @@
+import pytest
+
+import order_state
+from debounce import Turn, TurnSuperseded
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    store = {"c": ({"đơn hàng": [{"kích thước": "90", "màu sắc": None, "số bộ": 1}]}, 1)}
+    monkeypatch.setattr(order_state, "load_order_state", lambda convo_id: store.get(convo_id, (None, 0)))
+    monkeypatch.setattr(order_state, "save_order_state", lambda convo_id, state, turns: store.__setitem__(convo_id, (state, turns)))
+    return store
+
+
+def test_fast_update_is_saved(saved):
+    state = order_state.update_order_state("c", "màu hồng", lambda *args: [])
+    assert state["đơn hàng"][0]["màu sắc"] == "hồng"
+    assert saved["c"] == (state, 2)
+
+
+def test_superseded_turn_does_not_save_state(saved):
+    turn = Turn("c", [(1, "màu hồng")])
+    turn.supersede()
+    with pytest.raises(TurnSuperseded):
+        order_state.update_order_state("c", "màu hồng", lambda *args: [], before_save=turn.commit)
+    assert saved["c"][1] == 1
+    assert saved["c"][0]["đơn hàng"][0]["màu sắc"] is None
+
+
+def test_saving_state_commits_the_turn(saved):
+    turn = Turn("c", [(1, "màu hồng")])
+    order_state.update_order_state("c", "màu hồng", lambda *args: [], before_save=turn.commit)
+    assert turn.committed
+    assert not turn.supersede()
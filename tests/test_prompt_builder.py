@@ -0,0 +1,29 @@
+from prompt_builder import PromptTemplate, count_tokens, fit_tail_to_budget, fit_to_budget
+from rag import INTENT_TEMPLATE, build_intent_prompt
+
+
+def test_fit_to_budget_drops_duplicates_then_what_does_not_fit():
+    long = "x " * 500
+    assert fit_to_budget(["a b", "a  b", long, "c"], count_tokens("a b") + count_tokens("c")) == ["a b", "c"]
+
+
+def test_fit_to_budget_drops_blank_texts():
+    assert fit_to_budget(["", "  \n", None, "a b"], 100) == ["a b"]
+
+
+def test_fit_tail_to_budget_keeps_the_most_recent_lines_in_order():
+    lines = ["first message", "second", "third"]
+    assert fit_tail_to_budget(lines, count_tokens("second") + count_tokens("third")) == ["second", "third"]
+    assert fit_tail_to_budget(lines, 0) == []
+
+
+def test_render_appends_sections_after_the_prefix():
+    template = PromptTemplate("t", "static\n")
+    assert template.render(("a", "one "), ("b", "two")) == "static\none two"
+    assert template.prefix_tokens == count_tokens("static\n")
+
+
+def test_intent_prompt_shares_its_prefix_across_questions():
+    a, b = build_intent_prompt("ok chốt"), build_intent_prompt("dạ")
+    assert a.startswith(INTENT_TEMPLATE.prefix) and b.startswith(INTENT_TEMPLATE.prefix)
+    assert a.endswith('"ok chốt"')
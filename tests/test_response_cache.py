@@ -0,0 +1,78 @@
+import response_cache
+from bench_fakes import fake_embedding
+from response_cache import SemanticResponseCache
+
+ORDER = {
+    "đơn hàng": [{"kích thước": None, "màu sắc": "hồng", "số bộ": 1}],
+    "số điện thoại": None,
+    "địa chỉ giao hàng": None,
+}
+ANSWER = {"answer_only": "Dạ size 90 hợp với bé ạ", "question_ask_next": "Chị lấy màu nào ạ?"}
+
+
+def vec(text):
+    return fake_embedding(text, 64)
+
+
+def stored(cache, query, info_status=ORDER, answer=ANSWER, next_missing="kích thước"):
+    cache.store(query, vec(query), next_missing, info_status, answer, latency=1.5)
+
+
+def test_hit_on_the_same_question_in_the_same_situation():
+    cache = SemanticResponseCache(threshold=0.95)
+    stored(cache, "bé 10kg mặc size nào")
+    assert cache.lookup("bé 10kg mặc size nào", vec("bé 10kg mặc size nào"), "kích thước", ORDER) == ANSWER
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["saved_seconds"] == 1.5
+
+
+def test_miss_on_another_slot_or_order():
+    cache = SemanticResponseCache(threshold=0.95)
+    stored(cache, "bé 10kg mặc size nào")
+    q = vec("bé 10kg mặc size nào")
+    assert cache.lookup("bé 10kg mặc size nào", q, "màu sắc", ORDER) is None
+    other = {**ORDER, "đơn hàng": [{"kích thước": None, "màu sắc": "đen", "số bộ": 1}]}
+    assert cache.lookup("bé 10kg mặc size nào", q, "kích thước", other) is None
+
+
+def test_numbers_in_the_query_are_part_of_the_key():
+    cache = SemanticResponseCache(threshold=0.5)
+    stored(cache, "bé 10kg mặc size nào")
+    # Close enough by similarity alone, but a different weight needs a different size
+    assert cache.lookup("bé 14kg mặc size nào", vec("bé 10kg mặc size nào"), "kích thước", ORDER) is None
+    assert cache.lookup("bé 10kg thì mặc size nào", vec("bé 10kg thì mặc size nào"), "kích thước", ORDER) == ANSWER
+
+
+def test_phone_and_address_only_count_as_present_and_answers_quoting_them_are_skipped():
+    cache = SemanticResponseCache(threshold=0.95)
+    a = {**ORDER, "số điện thoại": "0912345678"}
+    b = {**ORDER, "số điện thoại": "0987654321"}
+    stored(cache, "ship mấy ngày", info_status=a, next_missing="địa chỉ giao hàng")
+    assert cache.lookup("ship mấy ngày", vec("ship mấy ngày"), "địa chỉ giao hàng", b) == ANSWER
+
+    quoted = {"answer_only": "Dạ em gọi 0912345678 nhé", "question_ask_next": ""}
+    stored(cache, "gọi cho chị", info_status=a, answer=quoted, next_missing="địa chỉ giao hàng")
+    assert cache.stats()["entries"] == 1
+
+
+def test_ttl_and_size_limit(monkeypatch):
+    cache = SemanticResponseCache(threshold=0.95, ttl=10, max_entries=2)
+    for q in ("size 90", "size 100", "size 110"):
+        stored(cache, q)
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup("size 90", vec("size 90"), "kích thước", ORDER) is None  # evicted
+
+    now = response_cache.time.monotonic()
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now + 11)
+    assert cache.lookup("size 110", vec("size 110"), "kích thước", ORDER) is None
+    assert cache.stats()["entries"] == 1
+
+
+def test_set_version_clears_only_on_change():
+    cache = SemanticResponseCache(threshold=0.95, version=("ctx", 1))
+    stored(cache, "size 90")
+    cache.set_version(("ctx", 1))
+    assert cache.stats()["entries"] == 1
+    cache.set_version(("ctx", 2))
+    assert cache.stats()["entries"] == 0
+    assert cache.lookup("size 90", vec("size 90"), "kích thước", ORDER) is None
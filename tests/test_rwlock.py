@@ -0,0 +1,68 @@
+import threading
+import time
+
+from rwlock import ReadWriteLock
+
+
+def test_readers_share_the_lock():
+    lock = ReadWriteLock()
+    inside = threading.Barrier(3, timeout=2)
+
+    def reader():
+        with lock.read():
+            inside.wait()  # only passes when all three readers hold the lock at once
+
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(2)
+    assert not inside.broken
+
+
+def test_writer_excludes_readers_and_waiting_writer_blocks_new_readers():
+    lock = ReadWriteLock()
+    events = []
+    first_reader_in = threading.Event()
+    release_reader = threading.Event()
+
+    def first_reader():
+        with lock.read():
+            first_reader_in.set()
+            release_reader.wait(2)
+            events.append("reader 1 out")
+
+    def writer():
+        with lock.write():
+            events.append("writer")
+
+    def late_reader():
+        with lock.read():
+            events.append("reader 2")
+
+    threads = [threading.Thread(target=first_reader)]
+    threads[0].start()
+    first_reader_in.wait(2)
+    threads.append(threading.Thread(target=writer))
+    threads[1].start()
+    time.sleep(0.05)  # the writer is now waiting
+    threads.append(threading.Thread(target=late_reader))
+    threads[2].start()
+    time.sleep(0.05)
+    assert events == []  # the late reader queues behind the writer
+    release_reader.set()
+    for t in threads:
+        t.join(2)
+    assert events == ["reader 1 out", "writer", "reader 2"]
+
+
+def test_lock_is_released_on_exceptions():
+    lock = ReadWriteLock()
+    for acquire in (lock.read, lock.write):
+        try:
+            with acquire():
+                raise ValueError
+        except ValueError:
+            pass
+    with lock.write():
+        pass
@@ -0,0 +1,50 @@
+import pytest
+
+import rag
+from bench_fakes import SQLitePool, fake_embedding
+
+DIM = 32
+CURATED = [f"Mẫu {i}: size 90 màu hồng giá 175k" for i in range(20)]
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    pool = SQLitePool(str(tmp_path / "test.sqlite3"))
+    monkeypatch.setattr(rag, "get_db_pool", lambda: pool)
+    monkeypatch.setattr(rag, "embed_texts", lambda texts: [fake_embedding(t, DIM) for t in texts])
+    monkeypatch.setattr(rag, "embed_text", lambda text: fake_embedding(text, DIM))
+    for text in CURATED:
+        rag.store_knowledge(text)
+    index = rag.RAG(dim=DIM, metric="l2")
+    index.load_from_db()
+    index.store_and_link_many("c", [("bé nhà chị 12kg mặc size nào", "user"), ("Dạ size 90 ạ", "bot")])
+    index.store_and_link_many("d", [("ship về Đà Nẵng mấy ngày", "user")])
+    index.pool = pool
+    return index
+
+
+@pytest.mark.parametrize("brute_force_max", [512, 0])  # numpy scoring, then the faiss selector
+def test_conversation_search_only_returns_that_conversations_rows(index, monkeypatch, brute_force_max):
+    monkeypatch.setattr(rag, "RAG_SCOPED_BRUTE_FORCE_MAX", brute_force_max)
+    q_vec = index._prepare(fake_embedding("size 90", DIM))[0]
+    hits = index._search_conversation(q_vec, "c", k=5)
+    assert {text for text, _ in hits} == {"bé nhà chị 12kg mặc size nào", "Dạ size 90 ạ"}
+    assert hits[0][0] == "Dạ size 90 ạ"
+    assert [text for text, _ in index._search_conversation(q_vec, "d", k=5)] == ["ship về Đà Nẵng mấy ngày"]
+    assert index._search_conversation(q_vec, "nobody", k=5) == []
+
+
+def test_search_merges_the_conversation_scope_with_the_global_hits(index):
+    hits = index.search("bé 12kg mặc size nào", k=3, convo_id="c")
+    assert hits[0][0] == "bé nhà chị 12kg mặc size nào"
+    assert [d for _, d in hits] == sorted(d for _, d in hits)
+    assert len({text for text, _ in hits}) == len(hits)
+
+
+def test_scope_is_cached_and_updated_by_new_links(index):
+    index._conversation_scope("c")
+    index.pool.queries = 0
+    index.store_and_link_many("c", [("lấy màu hồng nhé", "user")])
+    queries = index.pool.queries
+    assert "lấy màu hồng nhé" in index.get_conversation_knowledge("c")
+    assert index.pool.queries == queries  # served from the scope cache
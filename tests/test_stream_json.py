@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from stream_json import JsonFieldStream
+
+ANSWER = {"answer_only": "Dạ size 90 ạ, \"bé\" mặc vừa\n", "question_ask_next": "Chị lấy màu nào {ạ}?"}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1000])
+def test_fields_complete_as_soon_as_their_value_ends(chunk_size):
+    raw = json.dumps(ANSWER, ensure_ascii=False)
+    stream = JsonFieldStream()
+    seen = []
+    for i in range(0, len(raw), chunk_size):
+        for key, value in stream.feed(raw[i:i + chunk_size]):
+            seen.append((key, value, i + chunk_size >= len(raw)))
+    assert [(k, v) for k, v, _ in seen] == list(ANSWER.items())
+    assert stream.fields == ANSWER and stream.done
+    if chunk_size < 10:
+        assert seen[0][2] is False  # answer_only arrived before the stream ended
+
+
+def test_numbers_literals_and_nested_values():
+    obj = {"n": -1.5, "ok": True, "none": None, "list": [1, {"a": "]},"}], "obj": {"x": [2]}}
+    stream = JsonFieldStream()
+    pairs = []
+    for ch in "  " + json.dumps(obj) + " trailing":
+        pairs += stream.feed(ch)
+    assert dict(pairs) == obj
+    assert stream.done
+
+
+def test_incomplete_stream_keeps_completed_fields_only():
+    stream = JsonFieldStream()
+    stream.feed('{"answer_only": "Dạ", "question_ask_next": "Chị lấy')
+    assert stream.fields == {"answer_only": "Dạ"}
+    assert not stream.done
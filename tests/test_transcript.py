@@ -0,0 +1,88 @@
+import pytest
+
+import rag
+import transcript
+from bench_fakes import SQLitePool, fake_embedding
+from text_utils import content_hash
+from vector_codec import encode_vector
+
+DIM = 32
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    pool = SQLitePool(str(tmp_path / "test.sqlite3"))
+    monkeypatch.setattr(rag, "get_db_pool", lambda: pool)
+    monkeypatch.setattr(rag, "embed_texts", lambda texts: [fake_embedding(t, DIM) for t in texts])
+    monkeypatch.setattr(rag, "embed_text", lambda text: fake_embedding(text, DIM))
+    transcript.history_cache.invalidate()
+    return pool
+
+
+def query(pool, sql, params=()):
+    cursor = pool.get_connection().cursor()
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def insert_curated(pool, text):
+    conn = pool.get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO knowledge (content, content_hash, embedding) VALUES (%s, %s, %s)",
+        (text, content_hash(text), encode_vector(fake_embedding(text, DIM))),
+    )
+    conn.commit()
+    cursor.close()
+
+
+def test_record_turn_writes_transcript_and_history_cache(db):
+    assert transcript.get_conversation_history("c") == []
+    transcript.record_turn("c", [("size 90", "user"), ("Dạ vâng", "bot"), ("", "bot")])
+    transcript.record_turn("c", [("size 90", "user")])
+
+    # Written through to the cached entry: no reload, repeated messages kept
+    queries = db.queries
+    assert transcript.get_conversation_history("c") == ["size 90", "Dạ vâng", "size 90"]
+    assert db.queries == queries
+    assert transcript.get_conversation_history("c", last_n=1, summary="S") == ["S", "size 90"]
+    assert query(db, "SELECT COUNT(*) FROM knowledge") == [(0,)]  # nothing embedded by default
+
+
+def test_compaction_keeps_curated_rows_linked_by_a_chat(db):
+    insert_curated(db, "Giá mỗi bộ là 175k")
+    index = rag.RAG(dim=DIM)
+    index.load_from_db()
+    # A customer asks the FAQ text verbatim, plus a question of their own
+    index.store_and_link_many("c", [("Giá mỗi bộ là 175k", "user"), ("bé 12kg mặc size nào", "user")])
+    assert sorted(query(db, "SELECT content, origin FROM knowledge")) == [
+        ("Giá mỗi bộ là 175k", "curated"), ("bé 12kg mặc size nào", "chat"),
+    ]
+
+    links, deleted = transcript.prune_knowledge([], keep_questions=False)
+    assert (links, deleted) == (2, 1)
+    assert query(db, "SELECT content FROM knowledge") == [("Giá mỗi bộ là 175k",)]
+
+
+def test_compaction_keeps_questions_of_live_conversations(db):
+    index = rag.RAG(dim=DIM)
+    index.load_from_db()
+    index.store_and_link_many("live", [("còn màu hồng không", "user"), ("Dạ còn ạ", "bot")])
+    index.store_and_link_many("old", [("ship mấy ngày", "user")])
+
+    transcript.prune_knowledge(["old"], keep_questions=True)
+    assert query(db, "SELECT content FROM knowledge") == [("còn màu hồng không",)]
+    assert query(db, "SELECT conversation_id, from_source FROM conversation_link") == [("live", "user")]
+
+
+def test_adding_curated_text_promotes_a_chat_row(db):
+    index = rag.RAG(dim=DIM)
+    index.load_from_db()
+    index.store_and_link_many("c", [("Đổi trả trong 7 ngày", "user")])
+    rag.store_knowledge("Đổi trả trong 7 ngày")
+    assert query(db, "SELECT origin FROM knowledge") == [("curated",)]
+
+    transcript.prune_knowledge([], keep_questions=False)
+    assert query(db, "SELECT COUNT(*) FROM knowledge") == [(1,)]
@@ -0,0 +1,72 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import rag
+from bench_fakes import SQLitePool
+from vector_codec import HEADER_SIZE, decode_header, decode_vector, encode_vector, is_legacy_pickle
+
+
+@pytest.fixture
+def vec():
+    return np.random.default_rng(0).standard_normal(1536).astype(np.float32)
+
+
+def test_float32_round_trip_is_exact_and_zero_copy(vec):
+    blob = encode_vector(vec)
+    assert len(blob) == HEADER_SIZE + 4 * 1536
+    decoded = decode_vector(blob)
+    np.testing.assert_array_equal(decoded, vec)
+    assert not decoded.flags.writeable  # a view over the blob
+
+
+@pytest.mark.parametrize("dtype, size, tolerance", [("float16", 2, 1e-3), ("int8", 1, 0.02)])
+def test_compact_dtypes_round_trip_within_tolerance(vec, dtype, size, tolerance):
+    blob = encode_vector(vec, dtype)
+    assert len(blob) == HEADER_SIZE + size * 1536
+    decoded = decode_vector(blob)
+    assert decoded.dtype == np.float32
+    assert np.abs(decoded - vec).max() <= tolerance * np.abs(vec).max()
+
+
+def test_decode_into_a_preallocated_row(vec):
+    matrix = np.zeros((2, 1536), dtype=np.float32)
+    decode_vector(encode_vector(vec, "int8"), out=matrix[1])
+    assert np.abs(matrix[1] - vec).max() < 0.05
+    assert not matrix[0].any()
+
+
+def test_zero_vector_and_header(vec):
+    np.testing.assert_array_equal(decode_vector(encode_vector(np.zeros(4), "int8")), np.zeros(4))
+    assert decode_header(encode_vector(vec, "float16"))[1:] == (1536, 1.0)
+
+
+def test_legacy_pickles_are_detected_and_rejected_by_the_decoder(vec):
+    legacy = pickle.dumps(vec)
+    assert is_legacy_pickle(legacy)
+    assert not is_legacy_pickle(encode_vector(vec))
+    with pytest.raises(ValueError):
+        decode_vector(legacy + bytes(16))
+
+
+def test_bulk_loader_decodes_mixed_dtypes_and_skips_legacy_rows(tmp_path, monkeypatch):
+    pool = SQLitePool(str(tmp_path / "test.sqlite3"))
+    monkeypatch.setattr(rag, "get_db_pool", lambda: pool)
+    monkeypatch.setattr(rag, "EMBEDDING_LOAD_BATCH_SIZE", 2)
+    rows = [
+        ("a", encode_vector([1, 0, 0, 0])),
+        ("b", pickle.dumps(np.ones(4, dtype=np.float32))),
+        ("c", encode_vector([0, 0.5, 0, 0], "float16")),
+        ("d", encode_vector([0, 0, -1, 0], "int8")),
+    ]
+    conn = pool.get_connection()
+    cursor = conn.cursor()
+    cursor.executemany("INSERT INTO knowledge (content, content_hash, embedding) VALUES (%s, %s, %s)",
+                       [(text, text, blob) for text, blob in rows])
+    conn.commit()
+
+    ids, texts, matrix = rag.load_all_embeddings(dim=4)
+    assert texts == ["a", "c", "d"]
+    assert ids.tolist() == [1, 3, 4]
+    np.testing.assert_allclose(matrix, [[1, 0, 0, 0], [0, 0.5, 0, 0], [0, 0, -1, 0]], atol=1e-2)
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from worker_pool import ConversationWorkerPool, QueueFull
+
+
+def test_jobs_of_one_conversation_run_in_order_and_conversations_in_parallel():
+    log = []
+    lock = threading.Lock()
+    overlap = threading.Barrier(2, timeout=2)
+
+    def handler(convo_id, n):
+        if n == 0:
+            overlap.wait()  # the first jobs of "a" and "b" have to run at the same time
+        time.sleep(0.005)
+        with lock:
+            log.append((convo_id, n))
+
+    pool = ConversationWorkerPool(handler, workers=4).start()
+    for n in range(5):
+        pool.submit("a", "a", n)
+        pool.submit("b", "b", n)
+    assert pool.shutdown(timeout=5)
+    assert [n for c, n in log if c == "a"] == list(range(5))
+    assert [n for c, n in log if c == "b"] == list(range(5))
+    assert not overlap.broken
+    assert pool.stats()["completed"] == 10
+
+
+def test_full_queue_rejects_and_shutdown_stops_accepting():
+    release = threading.Event()
+    pool = ConversationWorkerPool(lambda: release.wait(2), workers=1, max_queue=2).start()
+    pool.submit("a")
+    time.sleep(0.05)  # picked up by the worker, no longer queued
+    pool.submit("a")
+    pool.submit("b")
+    assert pool.is_full()
+    with pytest.raises(QueueFull):
+        pool.submit("c")
+    release.set()
+    assert pool.shutdown(timeout=5)
+    with pytest.raises(QueueFull):
+        pool.submit("d")
+    assert pool.stats()["rejected"] == 2
+
+
+def test_failing_job_is_counted_and_the_conversation_continues():
+    done = []
+
+    def handler(n):
+        if n == 0:
+            raise RuntimeError("boom")
+        done.append(n)
+
+    pool = ConversationWorkerPool(handler, workers=2).start()
+    pool.submit("a", 0)
+    pool.submit("a", 1)
+    assert pool.shutdown(timeout=5)
+    assert done == [1]
+    assert pool.stats()["failed"] == 1
+
+
+def test_shutdown_times_out_with_jobs_left():
+    release = threading.Event()
+    pool = ConversationWorkerPool(lambda: release.wait(2), workers=1).start()
+    pool.submit("a")
+    pool.submit("a")
+    assert pool.shutdown(timeout=0.1) is False
+    release.set()
@@ -0,0 +1,22 @@
+import hashlib
+import re
+import unicodedata
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    # NFC so that precomposed and combining Vietnamese diacritics hash the same
+    text = unicodedata.normalize("NFC", text or "")
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def content_hash(text):
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def fold_diacritics(text):
+    # "Xanh cốm, Đen" -> "xanh com, den"; đ has no combining form so it is mapped by hand
+    text = unicodedata.normalize("NFD", normalize_text(text).lower())
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return text.replace("đ", "d")
@@ -0,0 +1,216 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from history_cache import ConversationHistoryCache
+from ingest import publish_index
+from metrics import traced, get_logger, log_event
+from rag import connect_db, get_shared_rag
+
+# Chat transcripts live in conversation_message: plain appends, no embedding, never in
+# the retrieval index. The index holds curated knowledge plus, when enabled, the
+# customers' questions (linked to their conversation for scoped search).
+#   python transcript.py compact --retention-days 90
+
+# Also embed customer questions into the retrieval index (bot replies never are)
+TRANSCRIPT_EMBED_QUESTIONS = os.getenv("TRANSCRIPT_EMBED_QUESTIONS", "0") == "1"
+TRANSCRIPT_RETENTION_DAYS = int(os.getenv("TRANSCRIPT_RETENTION_DAYS", "90"))
+
+# Write-through conversation history kept in memory
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "10000"))
+HISTORY_CACHE_TTL_SECONDS = float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "600"))
+
+log = get_logger("transcript")
+
+
+# ------------------- Transcript -------------------
+@traced("db_read", query="history")
+def load_messages(convo_id):
+    db = connect_db()
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT content FROM conversation_message WHERE conversation_id = %s ORDER BY id",
+        (convo_id,)
+    )
+    messages = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    db.close()
+    return messages
+
+history_cache = ConversationHistoryCache(
+    load_messages, max_conversations=HISTORY_CACHE_SIZE, ttl=HISTORY_CACHE_TTL_SECONDS,
+)
+
+def get_conversation_history(convo_id, last_n=None, summary=None):
+    # Last `last_n` messages (all when None). `summary` stands in for the older ones
+    # and is only prepended when something was actually left out.
+    history = history_cache.messages(convo_id)
+    if not last_n or len(history) <= last_n:
+        return history
+    return ([summary] if summary else []) + history[-last_n:]
+
+@traced("db_write", query="transcript")
+def append_messages(convo_id, items):
+    # items: [(text, source), ...] in the order they were said
+    db = connect_db()
+    cursor = db.cursor()
+    try:
+        cursor.executemany(
+            "INSERT INTO conversation_message (conversation_id, from_source, content) VALUES (%s, %s, %s)",
+            [(convo_id, source, text) for text, source in items]
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+        db.close()
+    history_cache.append(convo_id, [text for text, _ in items])
+
+def record_turn(convo_id, items):
+    items = [(text, source) for text, source in items if text]
+    append_messages(convo_id, items)
+    if TRANSCRIPT_EMBED_QUESTIONS:
+        questions = [(text, source) for text, source in items if source == 'user']
+        if questions:
+            get_shared_rag().store_and_link_many(convo_id, questions)
+
+
+# ------------------- Retention and compaction -------------------
+def _open_archive(path):
+    return gzip.open(path, "at", encoding="utf-8") if path.endswith(".gz") else open(path, "a", encoding="utf-8")
+
+def archive_messages(cutoff, archive_path=None, batch_size=5000):
+    # Moves messages older than the cutoff to a JSONL file (or just deletes them)
+    db = connect_db()
+    cursor = db.cursor()
+    archive = _open_archive(archive_path) if archive_path else None
+    removed = 0
+    try:
+        while True:
+            cursor.execute(
+                "SELECT id, conversation_id, from_source, content, created_at FROM conversation_message "
+                "WHERE created_at < %s ORDER BY id LIMIT %s",
+                (cutoff, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            if archive:
+                for id, convo_id, source, content, created_at in rows:
+                    archive.write(json.dumps({
+                        "id": id, "conversation_id": convo_id, "from": source,
+                        "content": content, "created_at": str(created_at),
+                    }, ensure_ascii=False) + "\n")
+                archive.flush()  # written out before the rows are deleted
+            ids = [row[0] for row in rows]
+            cursor.execute(
+                f"DELETE FROM conversation_message WHERE id IN ({', '.join(['%s'] * len(ids))})", tuple(ids)
+            )
+            db.commit()
+            removed += len(rows)
+            print(f"[Compact] {'Archived' if archive else 'Deleted'} {removed} messages")
+    finally:
+        if archive:
+            archive.close()
+        cursor.close()
+        db.close()
+    return removed
+
+def expire_conversations(cutoff):
+    # Order state of conversations without a turn since the cutoff; returns their ids
+    db = connect_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT conversation_id FROM conversation_state WHERE updated_at < %s", (cutoff,))
+    expired = [row[0] for row in cursor.fetchall()]
+    for i in range(0, len(expired), 1000):
+        part = expired[i:i + 1000]
+        cursor.execute(
+            f"DELETE FROM conversation_state WHERE conversation_id IN ({', '.join(['%s'] * len(part))})", tuple(part)
+        )
+    db.commit()
+    cursor.close()
+    db.close()
+    return expired
+
+def prune_knowledge(expired, keep_questions=TRANSCRIPT_EMBED_QUESTIONS):
+    # Unlinks bot replies, expired conversations and, unless questions are embedded, every
+    # chat row. Rows a conversation inserted (origin 'chat') are deleted once no link is
+    # left; curated rows stay even when a chat happened to link them.
+    db = connect_db()
+    cursor = db.cursor()
+    if keep_questions:
+        cursor.execute("SELECT id, conversation_id, knowledge_id FROM conversation_link WHERE from_source <> 'user'")
+        links = cursor.fetchall()
+        for i in range(0, len(expired), 1000):
+            part = expired[i:i + 1000]
+            cursor.execute(
+                "SELECT id, conversation_id, knowledge_id FROM conversation_link "
+                f"WHERE conversation_id IN ({', '.join(['%s'] * len(part))})", tuple(part)
+            )
+            links += cursor.fetchall()
+    else:
+        cursor.execute("SELECT id, conversation_id, knowledge_id FROM conversation_link")
+        links = cursor.fetchall()
+
+    link_ids = sorted({row[0] for row in links})
+    candidates = sorted({row[2] for row in links})
+    for i in range(0, len(link_ids), 1000):
+        part = link_ids[i:i + 1000]
+        cursor.execute(f"DELETE FROM conversation_link WHERE id IN ({', '.join(['%s'] * len(part))})", tuple(part))
+
+    deleted = 0
+    for i in range(0, len(candidates), 1000):
+        part = candidates[i:i + 1000]
+        placeholders = ', '.join(['%s'] * len(part))
+        cursor.execute(f"SELECT DISTINCT knowledge_id FROM conversation_link WHERE knowledge_id IN ({placeholders})", tuple(part))
+        still_linked = {row[0] for row in cursor.fetchall()}
+        orphans = [k for k in part if k not in still_linked]
+        if orphans:
+            cursor.execute(
+                f"DELETE FROM knowledge WHERE origin = 'chat' AND id IN ({', '.join(['%s'] * len(orphans))})",
+                tuple(orphans)
+            )
+            deleted += cursor.rowcount
+    db.commit()
+    cursor.close()
+    db.close()
+    return len(link_ids), deleted
+
+def compact(retention_days=TRANSCRIPT_RETENTION_DAYS, archive_path=None, publish=True):
+    cutoff = (datetime.now() - timedelta(days=retention_days)).replace(microsecond=0)
+    messages = archive_messages(cutoff, archive_path)
+    expired = expire_conversations(cutoff)
+    links, rows = prune_knowledge(expired)
+    log_event(log, logging.INFO, "transcript_compacted", cutoff=str(cutoff), messages=messages,
+              conversations=len(expired), links=links, knowledge_rows=rows)
+    print(f"[Compact] Cutoff {cutoff}: {messages} messages, {len(expired)} expired conversations, "
+          f"{links} links and {rows} knowledge rows removed")
+    if publish:
+        # A fresh snapshot from the retained rows; workers switch to it on their next refresh
+        publish_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcript retention and retrieval index compaction")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compaction = commands.add_parser(
+        "compact", help="Archive old messages, drop chat rows from knowledge and rebuild the index snapshot"
+    )
+    compaction.add_argument("--retention-days", type=int, default=TRANSCRIPT_RETENTION_DAYS)
+    compaction.add_argument("--archive", help="JSONL file (.gz to compress) old messages are appended to; "
+                                              "without it they are deleted")
+    compaction.add_argument("--no-index", action="store_true", help="skip publishing a new index snapshot")
+
+    args = parser.parse_args()
+    if args.command == "compact":
+        compact(args.retention_days, args.archive, publish=not args.no_index)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+from conversation import get_next_missing_field, build_turn_contexts, CONTEXT_VERSION
+from response_cache import response_cache
+from transcript import TRANSCRIPT_EMBED_QUESTIONS
+from metrics import get_logger, log_debug
+
+# The decisions of one turn, shared by the sync (app.py) and async (async_pipeline.py) pipelines.
+# Both only add the I/O around them: DB, LLM, embedding and Chatwoot calls.
+
+log = get_logger("turn")
+
+
+def search_scope(convo_id):
+    # Only embedded questions are linked to a conversation, so there is no scope to search otherwise
+    return convo_id if TRANSCRIPT_EMBED_QUESTIONS else None
+
+
+def turn_contexts(convo_id, info_status, rag_contexts):
+    # (contexts for the answer prompt, next missing slot) from the order state and the retrieval hits
+    next_missing = get_next_missing_field(info_status)
+    log_debug(log, "order_state", convo_id=convo_id, info_status=info_status, next_missing=next_missing)
+    return build_turn_contexts(next_missing, info_status, [text for text, _ in rag_contexts])
+
+
+def turn_response_cache(rag, next_missing):
+    # Only slot-filling answers are cached; the order summary path depends on the full order.
+    # Lookups reuse the query embedding, which lexical-only retrieval never computes.
+    if response_cache is None or next_missing is None or rag.retrieval_mode == "lexical":
+        return None
+    # A newly published knowledge snapshot invalidates the cached answers
+    response_cache.set_version((CONTEXT_VERSION, rag.generation))
+    return response_cache
+
+
+def sends_early(name, value):
+    # answer_only goes out as soon as the stream completes it; question_ask_next waits for the end
+    return name == "answer_only" and bool(value)
+
+
+def transcript_messages(query, answer):
+    return [
+        (query, 'user'),
+        (answer["answer_only"], 'bot'),
+        (answer["question_ask_next"], 'bot'),
+    ]
+
+
+def replies(answer, sent_early):
+    # Chatwoot messages still to send, in order
+    texts = [] if "answer_only" in sent_early else [answer["answer_only"]]
+    texts.append(answer["question_ask_next"])
+    return texts
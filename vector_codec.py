@@ -0,0 +1,64 @@
+import struct
+
+import numpy as np
+
+# Layout of an encoded embedding (little endian):
+#   magic "EV" | version u8 | dtype u8 | dim u32 | scale f32 | payload
+# The payload is dim values of the given dtype. For int8 each value is q * scale.
+MAGIC = b"EV"
+VERSION = 1
+HEADER = struct.Struct("<2sBBIf")
+HEADER_SIZE = HEADER.size
+
+DTYPES = {
+    "float32": (0, np.float32),
+    "float16": (1, np.float16),
+    "int8": (2, np.int8),
+}
+_CODES = {code: (name, dtype) for name, (code, dtype) in DTYPES.items()}
+
+# Pickled numpy arrays written by the old store_knowledge start with the PROTO opcode
+_PICKLE_PROTO = b"\x80"
+
+
+def encode_vector(vec, dtype="float32"):
+    code, np_dtype = DTYPES[dtype]
+    vec = np.asarray(vec, dtype=np.float32).ravel()
+    scale = 1.0
+
+    if dtype == "int8":
+        peak = float(np.abs(vec).max()) if vec.size else 0.0
+        scale = peak / 127 if peak > 0 else 1.0
+        payload = np.clip(np.rint(vec / scale), -127, 127).astype(np.int8)
+    else:
+        payload = vec.astype(np_dtype)
+
+    return HEADER.pack(MAGIC, VERSION, code, vec.size, scale) + payload.tobytes()
+
+
+def decode_header(blob):
+    magic, version, code, dim, scale = HEADER.unpack_from(blob)
+    if magic != MAGIC or version != VERSION or code not in _CODES:
+        raise ValueError("Not an encoded embedding")
+    return _CODES[code][1], dim, scale
+
+
+def decode_vector(blob, out=None):
+    # float32 payloads are returned as a zero-copy view over the blob unless `out` is given
+    np_dtype, dim, scale = decode_header(blob)
+    values = np.frombuffer(blob, dtype=np_dtype, count=dim, offset=HEADER_SIZE)
+
+    if out is None:
+        if np_dtype is np.float32:
+            return values
+        out = np.empty(dim, dtype=np.float32)
+
+    if np_dtype is np.int8:
+        np.multiply(values, scale, out=out, casting="unsafe")
+    else:
+        out[:] = values
+    return out
+
+
+def is_legacy_pickle(blob):
+    return bytes(blob[:1]) == _PICKLE_PROTO
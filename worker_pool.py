@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from metrics import get_logger, log_event
+
+log = get_logger("worker_pool")
+
+
+class QueueFull(Exception):
+    pass
+
+
+# Bounded pool of worker threads. Jobs for the same conversation run one at a time in
+# submission order; different conversations run in parallel.
+class ConversationWorkerPool:
+    def __init__(self, handler, workers=8, max_queue=500):
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+
+        self._cond = threading.Condition()
+        self._pending = {}  # conversation_id -> deque of (args, enqueued_at)
+        self._ready = deque()  # conversations with pending jobs and no job running
+        self._running = set()
+        self._depth = 0
+        self._closed = False
+        self._threads = []
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.processing_seconds_total = 0.0
+        self.processing_seconds_max = 0.0
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"conversation-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, convo_id, *args):
+        with self._cond:
+            if self._closed or self._depth >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(f"{self._depth} jobs pending")
+
+            jobs = self._pending.setdefault(convo_id, deque())
+            jobs.append((args, time.monotonic()))
+            self._depth += 1
+            self.submitted += 1
+            if len(jobs) == 1 and convo_id not in self._running:
+                self._ready.append(convo_id)
+                self._cond.notify()
+
+    def shutdown(self, timeout=30):
+        # Stop accepting work and give queued jobs up to `timeout` seconds to finish
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            while (self._depth or self._running) and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            dropped = self._depth
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        if dropped:
+            log_event(log, logging.WARNING, "shutdown_timed_out", dropped=dropped)
+        return dropped == 0
+
+    def is_full(self):
+        with self._cond:
+            return self._closed or self._depth >= self.max_queue
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": self._depth,
+                "running": len(self._running),
+                "workers": self.workers,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+                "wait_seconds_avg": self.wait_seconds_total / self.completed if self.completed else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+                "processing_seconds_avg": self.processing_seconds_total / self.completed if self.completed else 0.0,
+                "processing_seconds_max": self.processing_seconds_max,
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    if self._closed and not self._depth:
+                        return
+                    self._cond.wait()
+                convo_id = self._ready.popleft()
+                args, enqueued_at = self._pending[convo_id].popleft()
+                self._depth -= 1
+                self._running.add(convo_id)
+
+            started = time.monotonic()
+            try:
+                self.handler(*args)
+                ok = True
+            except Exception as e:
+                log_event(log, logging.ERROR, "job_failed", convo_id=convo_id, error=repr(e))
+                ok = False
+            finished = time.monotonic()
+
+            with self._cond:
+                self._running.discard(convo_id)
+                if self._pending[convo_id]:
+                    self._ready.append(convo_id)
+                else:
+                    del self._pending[convo_id]
+
+                wait, processing = started - enqueued_at, finished - started
+                self.completed += 1
+                self.failed += 0 if ok else 1
+                self.wait_seconds_total += wait
+                self.wait_seconds_max = max(self.wait_seconds_max, wait)
+                self.processing_seconds_total += processing
+                self.processing_seconds_max = max(self.processing_seconds_max, processing)
+                self._cond.notify_all()